@@ -0,0 +1,302 @@
+"""Agregados de ventas por tienda y mes, mantenidos de forma incremental.
+
+Cada documento de `analitica_cotizaciones` (id `tienda_AAAA-MM`, según la fecha
+de la cotización) guarda contadores por estado, por cliente y por SKU. Cada
+escritura de una cotización aplica en el mismo lote la diferencia entre lo que
+aportaba antes y lo que aporta después, así los tableros leen unos pocos
+documentos en lugar de recorrer todas las cotizaciones. `rebuild_analytics`
+recalcula todo desde cero para comprobar (y si se pide, reparar) los contadores.
+"""
+import hashlib
+
+import pandas as pd
+
+import metricas
+from catalogo import fold_text
+from cotizaciones_db import COLLECTION, CONFLICT_MESSAGE, commit_writes, quote_summary
+
+ANALYTICS_COLLECTION = 'analitica_cotizaciones'
+ESTADO_KEYS = {
+    "🔵 Creada": 'creada', "✉️ Enviada": 'enviada', "✅ Aprobada": 'aprobada',
+    "❌ Rechazada": 'rechazada', "🧾 Facturada": 'facturada',
+}
+FUNNEL = ('creada', 'enviada', 'aprobada', 'facturada')
+# Etapa del embudo a la que llegó una cotización según su estado actual (una rechazada ya se había enviado)
+FUNNEL_STAGE = {'creada': 0, 'enviada': 1, 'rechazada': 1, 'aprobada': 2, 'facturada': 3, 'otro': 0}
+WON = ('aprobada', 'facturada')
+WRITE_ATTEMPTS = 5
+TOLERANCE = 0.01
+
+
+def month_key(fecha):
+    """'AAAA-MM' de una fecha 'dd/mm/AAAA'; 'sin-fecha' si no se puede leer."""
+    parts = str(fecha or '').split('/')
+    if len(parts) == 3 and parts[1].isdigit() and parts[2].isdigit():
+        return f"{int(parts[2]):04d}-{int(parts[1]):02d}"
+    return 'sin-fecha'
+
+
+def analytics_doc_id(tienda, mes):
+    return f"{tienda}_{mes}"
+
+
+def _entry_key(text):
+    # Clave corta y segura como nombre de campo de Firestore (los nombres y SKUs traen puntos, espacios y tildes)
+    return hashlib.sha1(fold_text(str(text).strip()).encode()).hexdigest()[:16]
+
+
+def quote_contribution(data):
+    """Lo que una cotización aporta a los agregados: {id del documento: mapa anidado}."""
+    if not data or not data.get('tienda'):
+        return {}
+    mes = month_key(data.get('fecha'))
+    estado = ESTADO_KEYS.get(data.get('estado') or "🔵 Creada", 'otro')
+    won = 1 if estado in WON else 0
+    total = quote_summary(data)['total']
+    cliente = str(data.get('cliente_nombre') or 'N/A').strip() or 'N/A'
+
+    skus = {}
+    for item in (data.get('items') or {}).values():
+        sku = str(item.get('sku') or '').strip()
+        if not sku:
+            continue
+        unidades = item.get('cantidad', 0) or 0
+        valor = item.get('valor_total', 0) or 0
+        entry = skus.setdefault(_entry_key(sku), {
+            'sku': sku, 'nombre': item.get('nombre', ''), 'cotizaciones': 1,
+            'unidades': 0, 'valor': 0, 'unidades_ganadas': 0, 'valor_ganado': 0,
+        })
+        entry['unidades'] += unidades
+        entry['valor'] += valor
+        entry['unidades_ganadas'] += unidades * won
+        entry['valor_ganado'] += valor * won
+
+    return {
+        analytics_doc_id(data['tienda'], mes): {
+            'tienda': data['tienda'],
+            'mes': mes,
+            'estados': {estado: {'cotizaciones': 1, 'total': total}},
+            'embudo': {FUNNEL[stage]: 1 for stage in range(FUNNEL_STAGE[estado] + 1)},
+            'clientes': {_entry_key(cliente): {
+                'nombre': cliente, 'cotizaciones': 1, 'total': total, 'ganadas': won, 'total_ganado': total * won,
+            }},
+            'skus': skus,
+        }
+    }
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _flatten(nested, prefix=()):
+    for key, value in nested.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, prefix + (key,))
+        else:
+            yield prefix + (key,), value
+
+
+def _unflatten(flat):
+    nested = {}
+    for path, value in flat.items():
+        target = nested
+        for part in path[:-1]:
+            target = target.setdefault(part, {})
+        target[path[-1]] = value
+    return nested
+
+
+def analytics_delta(old, new):
+    """Incrementos que llevan los agregados del aporte de `old` al de `new` (None = no existe).
+
+    Devuelve {(colección, id): mapa anidado} listo para el quinto elemento de una
+    escritura de `commit_writes`; los textos (nombres, SKU) se toman de `new`.
+    """
+    before, after = quote_contribution(old), quote_contribution(new)
+    increments = {}
+    for doc_id in before.keys() | after.keys():
+        old_values = dict(_flatten(before.get(doc_id, {})))
+        new_values = dict(_flatten(after.get(doc_id, {})))
+        delta = {}
+        for path in old_values.keys() | new_values.keys():
+            old_value, new_value = old_values.get(path, 0), new_values.get(path, 0)
+            if _is_number(old_value) or _is_number(new_value):
+                difference = (new_value if _is_number(new_value) else 0) - (old_value if _is_number(old_value) else 0)
+                if difference:
+                    delta[path] = difference
+        if not delta:
+            continue
+        # Las etiquetas de los contadores que cambian acompañan al incremento (el documento puede ser nuevo)
+        changed_parents = {path[:-1] for path in delta}
+        for path, value in (new_values or old_values).items():
+            if not _is_number(value) and (path[:-1] in changed_parents or len(path) == 1):
+                delta[path] = value
+        increments[(ANALYTICS_COLLECTION, doc_id)] = _unflatten(delta)
+    return increments
+
+
+def write_quote(db, quote_id, data, kind='update', attempts=WRITE_ATTEMPTS):
+    """Crea, actualiza o borra una cotización y aplica su diferencia a los agregados en el mismo lote.
+
+    `kind` es 'create' (data completa), 'update' (campos a cambiar) o 'delete'. El
+    documento se lee antes y se escribe con precondición sobre su update_time; si
+    otra escritura se adelantó se vuelve a leer y se recalcula la diferencia.
+    Una cotización antigua sin `creado_en` recibe la fecha de creación del
+    documento, o no aparecería en el seguimiento (que ordena por ese campo).
+    Devuelve el update_time de la escritura.
+    """
+    ref = db.collection(COLLECTION).document(quote_id)
+    for _ in range(attempts):
+        snap = ref.get() if kind != 'create' else None
+        old = snap.to_dict() if snap is not None and snap.exists else None
+        if kind != 'create' and old is None:
+            raise LookupError(f"La cotización {quote_id} no existe.")
+        if kind == 'update' and not old.get('creado_en') and not data.get('creado_en'):
+            data = {**data, 'creado_en': snap.create_time}
+        new = None if kind == 'delete' else ({**old, **data} if kind == 'update' else data)
+        version = snap.update_time if snap is not None else None
+        update_times = {}
+        results = commit_writes(db, [(kind, quote_id, data, version, analytics_delta(old, new))],
+                                update_times=update_times)
+        error = results.get(quote_id)
+        if error is None:
+            return update_times.get(quote_id)
+        if error != CONFLICT_MESSAGE:
+            raise RuntimeError(error)
+    raise RuntimeError(CONFLICT_MESSAGE)
+
+
+def tracking_writes(db, edited_data):
+    """Escrituras de seguimiento con sus incrementos, a partir de {id: (cambios, versión leída)}.
+
+    Lee los documentos en una sola llamada. Devuelve (escrituras, {id: error}):
+    una cotización que cambió desde que se cargó la tabla o que ya no existe no
+    genera escritura y queda como error.
+    """
+    refs = [db.collection(COLLECTION).document(doc_id) for doc_id in edited_data]
+    snaps = {snap.id: snap for snap in db.get_all(refs)}
+    writes, errors = [], {}
+    for doc_id, (changes, version) in edited_data.items():
+        snap = snaps.get(doc_id)
+        if snap is None or not snap.exists:
+            errors[doc_id] = "La cotización ya no existe."
+        elif version is not None and snap.update_time != version:
+            errors[doc_id] = CONFLICT_MESSAGE
+        else:
+            old = snap.to_dict()
+            writes.append(('update', doc_id, changes, snap.update_time, analytics_delta(old, {**old, **changes})))
+    return writes, errors
+
+
+def aggregate_quotes(quotes):
+    """Agregados esperados de un conjunto de cotizaciones: {id del documento: mapa anidado}."""
+    expected = {}
+    for data in quotes:
+        for doc_id, contribution in quote_contribution(data).items():
+            target = expected.setdefault(doc_id, {})
+            for path, value in _flatten(contribution):
+                if _is_number(value):
+                    target[path] = target.get(path, 0) + value
+                else:
+                    target.setdefault(path, value)
+    return {doc_id: _unflatten(values) for doc_id, values in expected.items()}
+
+
+def rebuild_analytics(db, tienda=None, repair=False):
+    """Recalcula los agregados desde todas las cotizaciones y los compara con los guardados.
+
+    Devuelve un DataFrame con las diferencias (documento, campo, esperado,
+    guardado). Con `repair=True` reescribe los documentos que no coinciden y borra
+    los que sobran. Conviene correrlo con poca actividad: las escrituras que
+    lleguen mientras recorre la colección pueden verse como diferencias.
+    """
+    quotes = db.collection(COLLECTION)
+    stored_query = db.collection(ANALYTICS_COLLECTION)
+    if tienda:
+        quotes = quotes.where('tienda', '==', tienda)
+        stored_query = stored_query.where('tienda', '==', tienda)
+    expected = aggregate_quotes(snap.to_dict() for snap in quotes.stream())
+    stored = {snap.id: snap.to_dict() for snap in stored_query.stream()}
+
+    differences, broken = [], set()
+    for doc_id in expected.keys() | stored.keys():
+        want = {path: value for path, value in _flatten(expected.get(doc_id, {})) if _is_number(value)}
+        have = {path: value for path, value in _flatten(stored.get(doc_id, {})) if _is_number(value)}
+        for path in want.keys() | have.keys():
+            # Un contador en cero equivale a uno que no existe
+            if abs(want.get(path, 0) - have.get(path, 0)) > TOLERANCE:
+                differences.append((doc_id, '.'.join(path), want.get(path, 0), have.get(path, 0)))
+                broken.add(doc_id)
+
+    if repair and broken:
+        commit_writes(
+            db,
+            [('set', doc_id, expected[doc_id]) if doc_id in expected else ('delete', doc_id, None) for doc_id in broken],
+            collection=ANALYTICS_COLLECTION
+        )
+    return pd.DataFrame(differences, columns=['documento', 'campo', 'esperado', 'guardado'])
+
+
+def load_analytics(db, tienda):
+    """Documentos de agregados de una tienda (uno por mes)."""
+    query = db.collection(ANALYTICS_COLLECTION).where('tienda', '==', tienda)
+    with metricas.span('firestore_analitica') as tramo:
+        docs = [snap.to_dict() for snap in query.stream()]
+        tramo.set(documentos=len(docs))
+    metricas.count('firestore_documentos', len(docs), consulta='analitica')
+    return docs
+
+
+def monthly_summary(docs):
+    """Por mes: cotizaciones, total cotizado, total ganado y tasas de conversión del embudo."""
+    rows = []
+    for doc in docs:
+        estados = doc.get('estados', {})
+        embudo = doc.get('embudo', {})
+        creadas = embudo.get('creada', 0)
+        row = {
+            'Mes': doc.get('mes'),
+            'Cotizaciones': sum(e.get('cotizaciones', 0) for e in estados.values()),
+            'Total cotizado': sum(e.get('total', 0) for e in estados.values()),
+            'Total ganado': sum(estados.get(estado, {}).get('total', 0) for estado in WON),
+        }
+        for stage in FUNNEL[1:]:
+            row[f"% {stage.capitalize()}"] = embudo.get(stage, 0) / creadas * 100 if creadas else None
+        rows.append(row)
+    columns = ['Mes', 'Cotizaciones', 'Total cotizado', 'Total ganado'] + [f"% {s.capitalize()}" for s in FUNNEL[1:]]
+    return pd.DataFrame(rows, columns=columns).sort_values('Mes', ascending=False, ignore_index=True)
+
+
+def _entries_summary(docs, section, label_fields, limit):
+    totals = {}
+    for doc in docs:
+        for key, entry in doc.get(section, {}).items():
+            target = totals.setdefault(key, {})
+            for field, value in entry.items():
+                if _is_number(value):
+                    target[field] = target.get(field, 0) + value
+                else:
+                    target[field] = value
+    df = pd.DataFrame(totals.values())
+    if df.empty:
+        return df
+    # Los contadores que nunca cambiaron no se escribieron
+    numeric = [column for column in df.columns if column not in label_fields]
+    df[numeric] = df[numeric].fillna(0)
+    df = df[df['cotizaciones'] > 0]
+    order = 'total' if 'total' in df else 'valor'
+    return df.sort_values(order, ascending=False).head(limit)[label_fields + [c for c in df.columns if c not in label_fields]]
+
+
+def client_summary(docs, limit=20):
+    """Clientes con más valor cotizado (suma de todos los meses)."""
+    df = _entries_summary(docs, 'clientes', ['nombre'], limit)
+    if not df.empty:
+        df['% ganadas'] = df['ganadas'] / df['cotizaciones'] * 100
+    return df
+
+
+def sku_summary(docs, limit=20):
+    """Productos con más valor cotizado (suma de todos los meses)."""
+    return _entries_summary(docs, 'skus', ['sku', 'nombre'], limit)
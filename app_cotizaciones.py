@@ -1,16 +1,33 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import pandas as pd
 from datetime import date, datetime
 from PIL import Image
-from fpdf import FPDF
-import requests
-from io import BytesIO
 import firebase_admin
 from firebase_admin import credentials, firestore, exceptions
 import os
 import json
 from google.cloud.exceptions import NotFound
 import base64
+import copy
+import functools
+import hashlib
+import tempfile
+
+import metricas
+
+from analitica import (client_summary, load_analytics, monthly_summary, rebuild_analytics, sku_summary,
+                       tracking_writes, write_quote)
+from blobs import externalize_images, make_blob_store
+from cache import CATALOGO, COTIZACIONES, IMAGENES, PDFS, doc_tag, get_cache, tienda_tag
+from catalogo import CatalogSync, WixAPIError
+from cotizaciones_db import (QuoteNumberAllocator, QuoteSummaryStore, backfill_summaries, commit_writes,
+                             count_missing_summaries, day_range, failed_writes, fetch_tracking_labels,
+                             fetch_tracking_page, format_quote_number, migrate_inline_images, quote_summary,
+                             tracking_changes)
+from imagenes import is_remote_image, prefetch_images, shrink_upload, thumbnail_data_uri
+from importacion import RESULT_COLUMNS, SkuListError, match_sku_lines, merge_into_quote, parse_sku_text, read_sku_file
+from pdf_cotizacion import build_pdf_payload, export_quotes_zip, format_currency, generate_pdf_content
 
 # --- CONFIGURACIÓN DE LA PÁGINA ---
 st.set_page_config(
@@ -19,6 +36,47 @@ st.set_page_config(
     layout="wide"
 )
 
+# --- MÉTRICAS ---
+@st.cache_resource
+def init_metrics():
+    """Exportación de métricas según secrets, sección `metricas`: `log` (stderr o ruta del
+    log JSON), `archivo` (métricas de Prometheus), `puerto` (HTTP /metrics) y `perfilador`."""
+    config = dict(st.secrets["metricas"]) if 'metricas' in st.secrets else {}
+    if config.get('log'):
+        metricas.configure_logging(config['log'])
+    if config.get('puerto'):
+        try:
+            metricas.start_metrics_server(int(config['puerto']), config.get('host', '127.0.0.1'))
+        except OSError as e:
+            st.warning(f"No se pudo abrir el puerto de métricas {config['puerto']}: {e}")
+    return config
+
+def session_id():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else None
+
+metrics_config = init_metrics()
+previous_run = st.session_state.get('metricas_run')
+# Cada ejecución del script abre una `Run`: los tramos medidos llevan su id y el de la sesión
+st.session_state.metricas_run = metricas.begin_run(
+    session_id(),
+    previous=previous_run,
+    profile=bool(metrics_config.get('perfilador')) and st.session_state.get('perfilar_ejecuciones', False)
+)
+if previous_run is not None and previous_run.profile:
+    st.session_state.metricas_perfil = previous_run
+
+def metered_fragment(func):
+    """`st.fragment` que, cuando se vuelve a ejecutar solo (sin el resto del script), abre su propia `Run`."""
+    @functools.wraps(func)
+    def run_fragment(*args, **kwargs):
+        active = metricas.current_run()
+        if active is not None and not active.finished:
+            return func(*args, **kwargs)
+        with metricas.run_scope(session_id(), f"fragmento:{func.__name__}", metrics_file=metrics_config.get('archivo')):
+            return func(*args, **kwargs)
+    return st.fragment(run_fragment)
+
 # --- INICIALIZACIÓN DE FIREBASE ---
 @st.cache_resource
 def init_firebase():
@@ -46,122 +104,137 @@ def init_firebase():
 
 db = init_firebase()
 
+# --- IMÁGENES SUBIDAS ---
+@st.cache_resource
+def get_blob_store():
+    """Almacén de las imágenes de productos manuales; se elige en secrets, sección `blobs`."""
+    try:
+        config = dict(st.secrets["blobs"]) if 'blobs' in st.secrets else {}
+    except Exception:
+        config = {}
+    return make_blob_store(config, db)
+
+def get_uploaded_images(hashes):
+    """{hash: bytes} de imágenes subidas; el almacén en red ya las cachea en el espacio de imágenes."""
+    return {image_hash: data for image_hash, data in get_blob_store().get_many(hashes).items() if data is not None}
+
+def get_item_thumbnails(items):
+    """{clave del ítem: miniatura `data:`} para la tabla de la cotización.
+
+    Las miniaturas se guardan en el espacio de caché de imágenes por hash o URL,
+    así volver a pintar la tabla no descarga ni decodifica nada otra vez.
+    """
+    images = get_cache().namespace(IMAGENES)
+    sources = {}
+    for key, item in items.items():
+        if item.get('imagen_hash'):
+            sources[key] = ('hash', item['imagen_hash'])
+        elif item.get('imagen_base64'):
+            sources[key] = ('base64', item['imagen_base64'])
+        elif is_remote_image(item.get('imagen_url')):
+            sources[key] = ('url', item['imagen_url'])
+
+    def cache_key(source):
+        kind, value = source
+        if kind == 'base64':
+            value = hashlib.sha256(value.encode()).hexdigest()
+        return ('miniatura', kind, value)
+
+    thumbnails, missing = {}, {}
+    for source in set(sources.values()):
+        thumbnail = images.get(cache_key(source))
+        if thumbnail is None:
+            missing[source] = None
+        else:
+            thumbnails[source] = thumbnail
+    if missing:
+        uploaded = get_uploaded_images(value for kind, value in missing if kind == 'hash')
+        downloaded = prefetch_images(value for kind, value in missing if kind == 'url')
+        for kind, value in missing:
+            if kind == 'hash':
+                data = uploaded.get(value)
+            elif kind == 'url':
+                data = downloaded.get(value)
+            else:
+                data = base64.b64decode(value)
+            thumbnail = thumbnail_data_uri(data)
+            if thumbnail:
+                thumbnails[(kind, value)] = images.set(cache_key((kind, value)), thumbnail)
+    return {key: thumbnails.get(source) for key, source in sources.items()}
+
 # --- FUNCIONES DE WIX API ---
-@st.cache_data(ttl=3600, show_spinner=False)
-def fetch_and_process_wix_data():
-    """Descarga TODOS los productos de Wix (paginados) usando Secrets."""
-    
-    # Verificar si existen los secrets
+CATALOG_MAX_AGE = 3600  # segundos antes de pedir a Wix los productos modificados
+CATALOG_SNAPSHOT_PATH = os.path.join(".cache", "catalogo.arrow")
+
+@st.cache_resource
+def get_catalog_sync():
+    """Copia del catálogo compartida por todas las sesiones del proceso (y guardada en disco)."""
     if 'wix_api' not in st.secrets:
-        st.error("❌ No se encontraron las credenciales de Wix en st.secrets.")
         return None
 
-    api_key = st.secrets["wix_api"]["api_key"]
-    site_id = st.secrets["wix_api"]["site_id"]
-    url = "https://www.wixapis.com/stores/v1/products/query"
-
+    wix_config = st.secrets["wix_api"]
     headers = {
-        'Authorization': api_key,
-        'wix-site-id': site_id,
+        'Authorization': wix_config["api_key"],
+        'wix-site-id': wix_config["site_id"],
         'Content-Type': 'application/json'
     }
+    # Descargas simultáneas y tope de peticiones por segundo (configurables en secrets)
+    return CatalogSync(
+        headers,
+        max_workers=int(wix_config.get("max_workers", 4)),
+        max_requests_per_second=float(wix_config.get("max_requests_per_second", 8)),
+        snapshot_path=CATALOG_SNAPSHOT_PATH,
+        cache=get_cache().namespace(CATALOGO)
+    )
+
+def fetch_and_process_wix_data(force_refresh=False, full_resync=False):
+    """Devuelve el catálogo de Wix; tras la primera descarga solo trae los productos modificados."""
     
-    products = []
-    offset = 0
-    limit = 100
-    total_leidos = 0
-    
+    # Verificar si existen los secrets
+    sync = get_catalog_sync()
+    if sync is None:
+        st.error("❌ No se encontraron las credenciales de Wix en st.secrets.")
+        return None
+
+    if not (force_refresh or full_resync):
+        # Con una copia (en memoria o en disco) se responde ya y se actualiza en segundo plano
+        if sync.df is not None:
+            if sync.is_stale(CATALOG_MAX_AGE):
+                sync.refresh_in_background(max_age=CATALOG_MAX_AGE)
+            return sync.df
+
     progress_text = "Conectando con Wix..."
     my_bar = st.progress(0, text=progress_text)
 
+    def on_progress(total_leidos, total_results):
+        percent = min(total_leidos / total_results, 1.0)
+        my_bar.progress(percent, text=f"Descargando productos: {total_leidos} de {total_results}")
+
     try:
-        while True:
-            payload = {
-                "includeHiddenProducts": True, 
-                "query": {
-                    "paging": {
-                        "limit": limit,
-                        "offset": offset
-                    }
-                }
-            }
-            
-            response = requests.post(url, headers=headers, json=payload, timeout=20)
-            
-            if response.status_code != 200:
-                st.error(f"Error comunicando con Wix: {response.status_code} - {response.text}")
-                break
-                
-            data = response.json()
-            items = data.get('products', [])
-            total_results = data.get('totalResults', 0)
-            
-            if not items:
-                break
-                
-            for p in items:
-                sku = p.get('sku', '')
-                name = p.get('name', 'Sin Nombre')
-                
-                # Obtener precio estándar
-                price = p.get('price', {}).get('price', 0)
-                
-                # Inventario
-                stock_info = p.get('stock', {})
-                inventory = stock_info.get('quantity', 0)
-                # Si es un producto "In Stock" pero sin tracking numérico, asumimos stock alto
-                if inventory is None and stock_info.get('inStock', False):
-                    inventory = 999 
-                
-                # Imagen
-                image_url = "https://placehold.co/100x100/EEE/333?text=S/I"
-                media = p.get('media', {})
-                if media and media.get('mainMedia'):
-                    full_url = media['mainMedia'].get('image', {}).get('url', '')
-                    if full_url:
-                        image_url = full_url
-
-                products.append({
-                    'sku': str(sku),
-                    'nombre': name,
-                    'precio_iva_incluido': float(price),
-                    'imagen_url': image_url,
-                    'inventory': int(inventory or 0)
-                })
-
-            total_leidos += len(items)
-            
-            if total_results > 0:
-                percent = min(total_leidos / total_results, 1.0)
-                my_bar.progress(percent, text=f"Descargando productos: {total_leidos} de {total_results}")
+        sync.refresh(
+            full=full_resync,
+            on_progress=on_progress,
+            max_age=None if (force_refresh or full_resync) else CATALOG_MAX_AGE
+        )
+    except WixAPIError as e:
+        st.error(f"Error comunicando con Wix: {e}")
+    except Exception as e:
+        st.error(f"Error crítico descargando datos: {str(e)}")
 
-            if len(items) < limit:
-                break 
-            
-            offset += limit
-            
-        my_bar.empty()
-        
-        if not products:
-            return None
+    my_bar.empty()
+    return sync.df
 
-        df = pd.DataFrame(products)
-        df.dropna(subset=['sku', 'nombre'], inplace=True)
-        return df
+def get_sku_index():
+    """Índice de SKUs del catálogo cargado (se construye una vez por versión)."""
+    sync = get_catalog_sync()
+    return sync.sku_index if sync else None
 
-    except Exception as e:
-        st.error(f"Error crítico descargando datos: {str(e)}")
-        my_bar.empty()
-        return None
+def get_search_index():
+    """Índice del buscador rápido (nombre y SKU), reconstruido solo si cambia el catálogo."""
+    sync = get_catalog_sync()
+    return sync.search_index if sync else None
 
 # --- FUNCIONES AUXILIARES ---
-def format_currency(value):
-    try:
-        v = float(value)
-    except (TypeError, ValueError):
-        return "$0"
-    return f"${v:,.0f}".replace(",", ".")
-
 def parse_int_from_text(txt: str) -> int:
     if txt is None:
         return 0
@@ -172,250 +245,50 @@ def remove_item(sku):
     if sku in st.session_state.quote_items:
         del st.session_state.quote_items[sku]
 
-# --- CLASE PDF PERSONALIZADA ---
-class PDF(FPDF):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.color_primary = (4, 76, 125)
-        self.color_secondary = (240, 240, 240)
-        self.color_text = (50, 50, 50)
-        self.color_border = (220, 220, 220)
-        self.table_col_widths = None
-        self.is_table_page = False
-        self.current_font_family = 'Arial'
-
-    def header(self):
-        try:
-            self.add_font('Lato', '', 'Lato-Regular.ttf', uni=True)
-            self.add_font('Lato', 'B', 'Lato-Bold.ttf', uni=True)
-            self.add_font('Lato', 'I', 'Lato-Italic.ttf', uni=True)
-            self.current_font_family = 'Lato'
-        except RuntimeError:
-            self.current_font_family = 'Arial'
-
-        try:
-            self.image("logo_transparente.png", 10, 8, 45)
-        except FileNotFoundError:
-            self.set_font(self.current_font_family, "B", 14)
-            self.set_xy(10, 15)
-            self.cell(0, 10, "JUGANDO Y EDUCANDO")
-
-        self.set_font(self.current_font_family, "B", 9)
-        self.set_text_color(*self.color_text)
-        info_x = 120
-        self.set_xy(info_x, 10)
-        self.cell(0, 5, "DIDACTICOS JUGANDO Y EDUCANDO SAS", 0, 1, 'R')
-        self.set_font(self.current_font_family, "", 9)
-        self.set_x(info_x)
-        self.cell(0, 5, "NIT: 901144615-6", 0, 1, 'R')
-        self.set_x(info_x)
-        self.cell(0, 5, "CEL: 3153357921", 0, 1, 'R')
-        self.set_x(info_x)
-        self.cell(0, 5, "jugandoyeducando@hotmail.com", 0, 1, 'R')
-        self.set_x(info_x)
-        self.cell(0, 5, "Avenida 19 # 114A - 22, Bogota", 0, 1, 'R')
-
-        if self.is_table_page and self.table_col_widths:
-            self.set_y(40)
-            self.draw_table_header(self.table_col_widths)
-
-    def draw_quote_number(self, numero):
-        self.set_font(self.current_font_family, '', 11)
-        self.set_text_color(50, 50, 50)
-        self.set_xy(150, 55)
-        self.cell(35, 6, "Cotización N°:", 0, 0, 'R')
-
-        y_numero = self.get_y()
-        self.set_font(self.current_font_family, 'B', 12)
-        self.set_text_color(4, 76, 125)
-        self.cell(25, 6, numero, 0, 1, 'L')
-
-        self.set_draw_color(4, 76, 125)
-        self.set_line_width(0.6)
-        y_line = y_numero + 10
-        self.line(10, y_line, 200, y_line)
-        self.ln(12)
-
-    def draw_client_info(self, data):
-        self.ln(5)
-        self.set_font(self.current_font_family, "B", 11)
-        self.set_text_color(*self.color_primary)
-        self.cell(0, 8, "Información del Cliente", 0, 1, 'L')
-        self.set_font(self.current_font_family, "", 10)
-        self.set_text_color(*self.color_text)
-        y_start = self.get_y()
-        self.set_xy(10, y_start)
-        self.cell(25, 6, "Cliente:", 0, 0, 'L')
-        self.set_font(self.current_font_family, "B", 10)
-        self.multi_cell(75, 6, data.get('cliente_nombre', ''), 0, 'L')
-        self.set_font(self.current_font_family, "", 10)
-        self.set_xy(10, self.get_y())
-        self.cell(25, 6, "NIT/CC:", 0, 0, 'L')
-        self.multi_cell(75, 6, data.get('cliente_nit', ''), 0, 'L')
-        self.set_xy(10, self.get_y())
-        self.cell(25, 6, "Dirección:", 0, 0, 'L')
-        self.multi_cell(75, 6, f"{data.get('cliente_dir','')}, {data.get('cliente_ciudad','')}", 0, 'L')
-        y_left_end = self.get_y()
-        self.set_xy(110, y_start)
-        self.cell(25, 6, "Fecha:", 0, 0, 'L')
-        self.multi_cell(75, 6, data.get('fecha', ''), 0, 'L')
-        self.set_xy(110, self.get_y())
-        self.cell(25, 6, "Teléfono:", 0, 0, 'L')
-        self.multi_cell(75, 6, data.get('cliente_tel', ''), 0, 'L')
-        self.set_xy(110, self.get_y())
-        self.cell(25, 6, "Vigencia:", 0, 0, 'L')
-        self.multi_cell(75, 6, data.get('vigencia', ''), 0, 'L')
-        y_right_end = self.get_y()
-        self.set_y(max(y_left_end, y_right_end) + 5)
-
-    def get_multicell_lines(self, text, width):
-        self.set_font(self.current_font_family, "", 9)
-        words = str(text).split(' ')
-        lines_count = 1
-        current_line_w = 0
-        space_w = self.get_string_width(' ')
-        for word in words:
-            word_w = self.get_string_width(word)
-            if word_w > width:
-                lines_count += int(word_w / width)
-                word_w = word_w % width
-            if current_line_w + word_w + space_w < width:
-                current_line_w += word_w + space_w
-            else:
-                lines_count += 1
-                current_line_w = word_w + space_w
-        return lines_count
-
-    def draw_table_header(self, col_widths):
-        self.set_font(self.current_font_family, "B", 9)
-        self.set_fill_color(*self.color_primary)
-        self.set_text_color(255, 255, 255)
-        self.set_draw_color(*self.color_primary)
-        self.set_line_width(0.3)
-        self.cell(col_widths['img'], 8, "IMAGEN", 'T', 0, 'C', 1)
-        self.cell(col_widths['name'], 8, "PRODUCTO", 'T', 0, 'C', 1)
-        self.cell(col_widths['sku'], 8, "CÓDIGO", 'T', 0, 'C', 1)
-        self.cell(col_widths['qty'], 8, "UNDS.", 'T', 0, 'C', 1)
-        self.cell(col_widths['price'], 8, "VLR. UNITARIO", 'T', 0, 'C', 1)
-        self.cell(col_widths['total'], 8, "VALOR TOTAL", 'T', 1, 'C', 1)
-
-    def ensure_row_fits(self, row_height):
-        if self.get_y() + row_height > self.page_break_trigger:
-            self.add_page()
-            if self.is_table_page and self.table_col_widths:
-                self.set_y(40)
-                self.draw_table_header(self.table_col_widths)
-
-    def draw_table_row(self, item, col_widths, fill=False):
-        line_height = 5
-        num_lines = self.get_multicell_lines(item.get('nombre', ''), col_widths['name'] - 2)
-        name_height = num_lines * line_height
-        row_height = max(30, name_height + 4)
-
-        self.ensure_row_fits(row_height)
-
-        x_start = self.get_x()
-        y_start = self.get_y()
-
-        self.set_font(self.current_font_family, "", 9)
-        self.set_text_color(*self.color_text)
-        self.set_draw_color(*self.color_border)
-        self.set_fill_color(*self.color_secondary)
-
-        self.cell(col_widths['img'], row_height, "", 'B', 0, 'C', fill)
-        self.cell(col_widths['name'], row_height, "", 'B', 0, 'C', fill)
-        self.cell(col_widths['sku'], row_height, "", 'B', 0, 'C', fill)
-        self.cell(col_widths['qty'], row_height, "", 'B', 0, 'C', fill)
-        self.cell(col_widths['price'], row_height, "", 'B', 0, 'R', fill)
-        self.cell(col_widths['total'], row_height, "", 'B', 1, 'R', fill)
-
-        # Imagen
-        try:
-            image_source = None
-            if item.get('imagen_base64'):
-                image_bytes = base64.b64decode(item['imagen_base64'])
-                image_source = BytesIO(image_bytes)
-            elif item.get('imagen_url') and "placehold.co" not in item.get('imagen_url'):
-                # Añadimos header para simular navegador si es necesario, 
-                # aunque Wix suele servir imágenes estáticas sin problemas
-                headers_img = {'User-Agent': 'Mozilla/5.0'}
-                response = requests.get(item['imagen_url'], headers=headers_img, timeout=5)
-                if response.status_code == 200:
-                    image_source = BytesIO(response.content)
-            
-            if image_source:
-                # Ajuste de imagen para mantener proporción
-                self.image(image_source, x=x_start + 2, y=y_start + 2, w=col_widths['img'] - 4, h=row_height - 4)
-            else:
-                raise Exception("No image")
-        except Exception:
-            v_offset_placeholder = (row_height - 4) / 2
-            self.set_xy(x_start, y_start + v_offset_placeholder)
-            self.cell(col_widths['img'], 4, "S/I", 0, 0, 'C')
-
-        # Nombre
-        name_v_offset = (row_height - name_height) / 2
-        self.set_xy(x_start + col_widths['img'], y_start + name_v_offset)
-        self.multi_cell(col_widths['name'], line_height, str(item.get('nombre', '')), border=0, align='C')
-
-        text_height = self.font_size
-        cell_v_offset = (row_height - text_height) / 2
-        
-        # SKU
-        self.set_xy(x_start + col_widths['img'] + col_widths['name'], y_start + cell_v_offset)
-        self.cell(col_widths['sku'], text_height, str(item.get('sku', '')), 0, 0, 'C')
-        
-        # Cantidad
-        self.set_x(x_start + col_widths['img'] + col_widths['name'] + col_widths['sku'])
-        self.cell(col_widths['qty'], text_height, str(item.get('cantidad', '')), 0, 0, 'C')
-        
-        # Precio
-        self.set_x(x_start + col_widths['img'] + col_widths['name'] + col_widths['sku'] + col_widths['qty'])
-        self.cell(col_widths['price'], text_height, format_currency(item.get('precio_unitario', 0)), 0, 0, 'R')
-        
-        # Total
-        self.set_x(x_start + col_widths['img'] + col_widths['name'] + col_widths['sku'] + col_widths['qty'] + col_widths['price'])
-        self.cell(col_widths['total'], text_height, format_currency(item.get('valor_total', 0)), 0, 0, 'R')
-
-        self.set_y(y_start + row_height)
-
-    def footer(self):
-        self.set_y(-15)
-        self.set_font(self.current_font_family, "I", 8)
-        self.set_text_color(150, 150, 150)
-        self.cell(0, 10, f"Página {self.page_no()}", 0, 0, 'C')
-
 # --- FUNCIONES DE FIREBASE (DB) ---
-@firestore.transactional
-def get_next_quote_number_transaction(transaction, counter_ref, tienda_key):
-    snapshot = counter_ref.get(transaction=transaction)
-    data = snapshot.to_dict() or {}
-    current_number = data.get(tienda_key, 0)
-    new_number = current_number + 1
-    transaction.set(counter_ref, {tienda_key: new_number}, merge=True)
-    return new_number
+@st.cache_resource
+def get_quote_number_allocator():
+    """Reparte los números de cotización de esta instancia de la app por bloques."""
+    return QuoteNumberAllocator(db)
 
 def get_next_quote_number(db, tienda):
     if not db: return None
-    tienda_key = tienda.lower()
-    counter_ref = db.collection('counters').document('cotizaciones')
-    
     try:
-        new_number = get_next_quote_number_transaction(db.transaction(), counter_ref, tienda_key)
-        prefix = "OV" if tienda == "Oviedo" else "BQ"
-        return f"{prefix}-{str(new_number).zfill(4)}"
+        return format_quote_number(tienda, get_quote_number_allocator().next_number(tienda))
     except Exception as e:
         st.error(f"Error al obtener número de cotización: {e}")
         return None
 
+@st.cache_resource(show_spinner=False)
+def get_quote_store(_db, tienda):
+    """Resúmenes de cotizaciones de la tienda compartidos por todas las sesiones del proceso."""
+    store = QuoteSummaryStore(_db, tienda)
+    try:
+        store.start()
+    except Exception as e:
+        store.error = e
+    return store
+
+def live_quote_store(db, tienda):
+    """El store de la tienda si su listener está activo; si no, None y se consulta Firestore."""
+    if not db or not tienda: return None
+    store = get_quote_store(db, tienda)
+    return store if store.wait_ready() else None
+
 def get_quotes_list(db, tienda):
     if not db or not tienda: return {}
-    quotes_ref = db.collection('cotizaciones').where('tienda', '==', tienda).stream()
+    store = live_quote_store(db, tienda)
+    if store:
+        return store.labels()
+    quotes_ref = db.collection('cotizaciones').where('tienda', '==', tienda).select(['numero_cotizacion', 'cliente_nombre']).stream()
     quotes_dict = {}
-    for quote in quotes_ref:
-        quote_data = quote.to_dict()
-        label = quote_data.get('numero_cotizacion', quote.id)
-        quotes_dict[f"{label} - {quote_data.get('cliente_nombre', 'N/A')}"] = quote.id
+    with metricas.span('firestore_lista_cotizaciones') as tramo:
+        for quote in quotes_ref:
+            quote_data = quote.to_dict()
+            label = quote_data.get('numero_cotizacion', quote.id)
+            quotes_dict[f"{label} - {quote_data.get('cliente_nombre', 'N/A')}"] = quote.id
+        tramo.set(documentos=len(quotes_dict))
+    metricas.count('firestore_documentos', len(quotes_dict), consulta='lista_cotizaciones')
     return quotes_dict
 
 def save_quote(db, quote_data, quote_id=None):
@@ -426,8 +299,16 @@ def save_quote(db, quote_data, quote_id=None):
         st.error("Error: No se puede guardar la cotización sin una tienda asignada.")
         return None
     try:
+        # Las imágenes en línea de cotizaciones antiguas pasan al almacén al guardarlas,
+        # solo si el almacén las conserva; si no, siguen en la cotización
+        blob_store = get_blob_store()
+        if blob_store.durable:
+            quote_data['items'], _ = externalize_images(quote_data.get('items'), blob_store)
+        quote_data.update(quote_summary(quote_data))
         if quote_id:
-            db.collection('cotizaciones').document(quote_id).update(quote_data)
+            # La cotización y su diferencia en los agregados de analítica se escriben juntas
+            update_time = write_quote(db, quote_id, quote_data)
+            saved_id = quote_id
             st.success(f"¡Cotización '{quote_data.get('numero_cotizacion', '')}' actualizada!")
         else:
             quote_number = get_next_quote_number(db, quote_data['tienda'])
@@ -436,117 +317,175 @@ def save_quote(db, quote_data, quote_id=None):
             quote_data['numero_cotizacion'] = quote_number
             quote_data['estado'] = "🔵 Creada"
             quote_data['comentarios'] = ""
+            quote_data['creado_en'] = firestore.SERVER_TIMESTAMP
 
-            db.collection('cotizaciones').add(quote_data)
+            saved_id = db.collection('cotizaciones').document().id
+            update_time = write_quote(db, saved_id, quote_data, kind='create')
             st.success(f"¡Cotización '{quote_number}' guardada como nueva!")
         
-        st.cache_data.clear()
+        store = live_quote_store(db, quote_data['tienda'])
+        if store:
+            store.apply_local(saved_id, quote_data, update_time)
+        invalidate_quote_caches(quote_data['tienda'], saved_id)
         return True
     except Exception as e:
         st.error(f"Error al guardar la cotización: {e}")
         return None
 
-def delete_quote(db, quote_id):
+def delete_quote(db, quote_id, tienda=None):
     if not db: return
     try:
-        db.collection('cotizaciones').document(quote_id).delete()
+        write_quote(db, quote_id, None, kind='delete')
+        store = live_quote_store(db, tienda)
+        if store:
+            store.remove_local(quote_id)
         st.success("¡Cotización eliminada con éxito!")
-        st.cache_data.clear()
+        invalidate_quote_caches(tienda, quote_id)
     except Exception as e:
         st.error(f"Error al eliminar la cotización: {e}")
 
-def get_all_quotes_for_tracking(db, tienda):
+def invalidate_quote_caches(tienda, quote_id=None):
+    """Tras escribir cotizaciones se descarta solo lo derivado de esa tienda o de ese documento."""
+    cache = get_cache()
+    cache.invalidate(COTIZACIONES, tienda=tienda)
+    if quote_id:
+        cache.invalidate(PDFS, doc_id=quote_id)
+
+def get_tracking_page(db, tienda, cursor=None, **filtros):
+    """Devuelve (filas de la página, cursor de la siguiente o None)."""
+    if not db or not tienda: return [], None
+    store = live_quote_store(db, tienda)
+    if store:
+        return store.page(cursor=cursor, **filtros)
+    return fetch_tracking_page(db, tienda, cursor=cursor, **filtros)
+
+def get_tracking_labels(db, tienda, **filtros):
+    store = live_quote_store(db, tienda)
+    if store:
+        return store.labels(**filtros)
+    return get_cache().namespace(COTIZACIONES).get_or_compute(
+        ('etiquetas', tienda, tuple(sorted(filtros.items()))),
+        lambda: fetch_tracking_labels(db, tienda, **filtros),
+        tags=[tienda_tag(tienda)]
+    )
+
+def get_missing_summaries_count(db, tienda):
+    store = live_quote_store(db, tienda)
+    if store:
+        return store.missing_count()
+    return get_cache().namespace(COTIZACIONES).get_or_compute(
+        ('sin_resumen', tienda), lambda: count_missing_summaries(db, tienda), tags=[tienda_tag(tienda)]
+    )
+
+def get_analytics(db, tienda):
+    """Agregados de ventas de la tienda (un documento por mes); nunca recorre las cotizaciones."""
     if not db or not tienda: return []
-    quotes_ref = db.collection('cotizaciones').where('tienda', '==', tienda).stream()
-    quotes_list = []
-    for quote in quotes_ref:
-        data = quote.to_dict()
-        subtotal = sum(item.get('valor_total', 0) for item in data.get('items', {}).values())
-        flete_val_doc = data.get('flete_val', 0)
-        quotes_list.append({
-            "id": quote.id,
-            "N° Cotización": data.get("numero_cotizacion", "S/N"),
-            "Fecha": data.get("fecha", "S/F"),
-            "Cliente": data.get("cliente_nombre", "N/A"),
-            "Total": subtotal + (flete_val_doc or 0),
-            "Estado": data.get("estado", "🔵 Creada"),
-            "Comentarios": data.get("comentarios", "")
-        })
-    return quotes_list
-
-def update_quotes_tracking(db, edited_data):
-    if not db: return
+    return get_cache().namespace(COTIZACIONES).get_or_compute(
+        ('analitica', tienda), lambda: load_analytics(db, tienda), tags=[tienda_tag(tienda)]
+    )
+
+def go_to_tracking_page(page, cursor=None):
+    """Cambia de página guardando el cursor de la siguiente la primera vez que se visita."""
+    cursors = st.session_state.tracking_cursors
+    if cursor is not None and len(cursors) == page:
+        cursors.append(cursor)
+    st.session_state.tracking_page = page
+
+def reload_tracking_table():
+    """Descarta la copia de la página que muestra el editor; la siguiente ejecución la vuelve a leer."""
+    st.session_state.tracking_table_version = st.session_state.get('tracking_table_version', 0) + 1
+
+def update_quotes_tracking(db, edited_data, tienda=None):
+    """Guarda los cambios de seguimiento en lotes; devuelve {id: error} de los que fallaron.
+
+    `edited_data` es {id: (cambios, versión leída)}: una fila que otra persona
+    modificó después de cargar la tabla no se sobrescribe y queda como fallida.
+    """
+    if not db: return {}
+    update_times = {}
     try:
-        for doc_id, changes in edited_data.items():
-            db.collection('cotizaciones').document(doc_id).update(changes)
-        st.success("¡Seguimiento actualizado con éxito!")
+        # Cada cambio lleva su diferencia en los agregados de analítica, en el mismo lote
+        writes, results = tracking_writes(db, edited_data)
+        results.update(commit_writes(db, writes, update_times=update_times))
     except Exception as e:
         st.error(f"Error al actualizar seguimiento: {e}")
+        return {doc_id: str(e) for doc_id in edited_data}
+    store = live_quote_store(db, tienda)
+    if store:
+        for doc_id, error in results.items():
+            if error is None:
+                store.apply_local(doc_id, edited_data[doc_id][0], update_times.get(doc_id))
+    failures = failed_writes(results)
+    if not failures:
+        st.success("¡Seguimiento actualizado con éxito!")
+    return failures
+
+EXPORT_FETCH_BATCH = 20
+
+def export_quotes_pdf_zip(db, quote_ids, on_progress=None):
+    """Genera los PDFs de varias cotizaciones en un ZIP temporal; devuelve (ruta, errores).
+
+    Las cotizaciones se leen por tandas y sus imágenes al preparar cada trabajo, a
+    medida que el pool pide más, así la memoria no crece con la selección.
+    """
+    blob_store = get_blob_store()
+    errors = {}
+
+    def jobs():
+        for start in range(0, len(quote_ids), EXPORT_FETCH_BATCH):
+            batch = quote_ids[start:start + EXPORT_FETCH_BATCH]
+            refs = [db.collection('cotizaciones').document(quote_id) for quote_id in batch]
+            docs = {snap.id: snap.to_dict() for snap in db.get_all(refs) if snap.exists}
+            for quote_id in batch:
+                if quote_id in docs:
+                    yield quote_id, build_pdf_payload(docs.pop(quote_id), blob_store)
+                else:
+                    errors[quote_id] = "La cotización ya no existe."
+
+    with tempfile.NamedTemporaryFile(prefix="cotizaciones_", suffix=".zip", delete=False) as zip_file:
+        try:
+            errors.update(export_quotes_zip(jobs(), zip_file, on_progress=on_progress, total=len(quote_ids)))
+        except BaseException:
+            zip_file.close()
+            os.remove(zip_file.name)
+            raise
+    return zip_file.name, errors
+
+def take_export_zip(zip_path):
+    """Bytes del ZIP exportado; el archivo temporal se borra al leerlo (se descarga una vez)."""
+    with open(zip_path, 'rb') as f:
+        data = f.read()
+    os.remove(zip_path)
+    return data
 
 # --- GENERACIÓN DEL PDF ---
-def generate_pdf_content(quote_data):
-    pdf = PDF('P', 'mm', 'A4')
-    pdf.set_auto_page_break(auto=True, margin=15)
-    pdf.add_page()
-    
-    pdf.set_font(pdf.current_font_family, "B", 22)
-    pdf.set_text_color(*pdf.color_primary)
-    pdf.set_y(45)
-    pdf.cell(130, 10, "COTIZACIÓN", 0, 0, 'L')
-    pdf.draw_quote_number(quote_data.get("numero_cotizacion", "S/N"))
-    pdf.draw_client_info(quote_data)
-    
-    col_widths = {'img': 30, 'name': 70, 'sku': 20, 'qty': 15, 'price': 25, 'total': 30}
-    
-    pdf.is_table_page = True
-    pdf.table_col_widths = col_widths
-    pdf.draw_table_header(col_widths)
-    
-    fill = True
-    for item in quote_data['items'].values():
-        pdf.draw_table_row(item, col_widths, fill)
-        fill = not fill
-    
-    pdf.is_table_page = False
-
-    needed = 55
-    if pdf.get_y() + needed > pdf.page_break_trigger:
-        pdf.add_page()
-
-    total_label_x = 100
-    totals_y_start = pdf.get_y() + 5 
-    pdf.set_font(pdf.current_font_family, "", 10)
-    pdf.set_text_color(*pdf.color_text)
-    pdf.set_xy(total_label_x, totals_y_start)
-    pdf.cell(70, 8, "SUBTOTAL", 0, 0, 'R')
-    pdf.set_font(pdf.current_font_family, "B", 10)
-    pdf.cell(30, 8, format_currency(quote_data['subtotal']), 0, 1, 'R')
-
-    pdf.set_font(pdf.current_font_family, "", 10)
-    pdf.set_x(total_label_x)
-    flete_label = "FLETE (INCLUIDO)" if str(quote_data.get('flete_str','')).upper() == 'INCLUIDO' else "FLETE"
-    pdf.cell(70, 8, flete_label, 0, 0, 'R')
-    pdf.set_font(pdf.current_font_family, "B", 10)
-    pdf.cell(30, 8, format_currency(quote_data.get('flete_val', 0)), 0, 1, 'R')
-
-    pdf.set_font(pdf.current_font_family, "", 10)
-    pdf.set_x(total_label_x)
-    pdf.cell(70, 8, "TOTAL UNIDADES", 0, 0, 'R')
-    pdf.set_font(pdf.current_font_family, "B", 10)
-    pdf.cell(30, 8, str(quote_data['total_unidades']), 0, 1, 'R')
-    pdf.set_x(total_label_x)
-    pdf.set_draw_color(*pdf.color_border)
-    pdf.line(total_label_x + 5, pdf.get_y(), 200, pdf.get_y())
-    pdf.ln(2)
-    pdf.set_font(pdf.current_font_family, "B", 11)
-    pdf.set_text_color(*pdf.color_primary)
-    pdf.set_x(total_label_x)
-    pdf.cell(70, 10, "TOTAL COTIZACION INCLUIDO IVA", 0, 0, 'R')
-    pdf.set_font(pdf.current_font_family, "B", 12)
-    pdf.cell(30, 10, format_currency(quote_data['total_cotizacion']), 0, 1, 'R')
-    return bytes(pdf.output())
+def _canonical_value(value):
+    if isinstance(value, dict):
+        return {str(k): _canonical_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical_value(v) for v in value]
+    # 1000 y 1000.0 (p. ej. tras pasar por Firestore) producen el mismo PDF
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def quote_content_hash(quote_data):
+    """Hash estable del contenido de una cotización (ítems, cliente, flete y totales)."""
+    canonical = json.dumps(_canonical_value(quote_data), sort_keys=True, ensure_ascii=False,
+                           separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def get_pdf_bytes(quote_data, quote_id=None):
+    """PDF de la cotización, memorizado por el hash de su contenido (y etiquetado con su id)."""
+    return get_cache().namespace(PDFS).get_or_compute(
+        quote_content_hash(quote_data),
+        lambda: generate_pdf_content(quote_data, blob_store=get_blob_store()),
+        tags=[doc_tag(quote_id)] if quote_id else ()
+    )
 
 # --- ESTADO DE SESIÓN ---
+ESTADOS_COTIZACION = ["🔵 Creada", "✉️ Enviada", "✅ Aprobada", "❌ Rechazada", "🧾 Facturada"]
+
 def init_session_state():
     defaults = {
         'tienda_seleccionada': None, 'quote_items': {}, 'current_quote_id': None,
@@ -556,6 +495,9 @@ def init_session_state():
         'numero_cotizacion': None, 'estado': None, 'comentarios': None,
         'fecha': datetime.now(),
         'manual_product_count': 0,
+        'quote_items_version': 0,
+        'import_result': None,
+        'datos_cliente': {},
         'flete_val': 0
     }
     for key, value in defaults.items():
@@ -564,6 +506,7 @@ def init_session_state():
 def clear_form_state():
     current_tienda = st.session_state.tienda_seleccionada
     products_df = st.session_state.get('products_df')
+    metrics_run = st.session_state.get('metricas_run')
     
     for key in list(st.session_state.keys()):
         del st.session_state[key]
@@ -571,10 +514,343 @@ def clear_form_state():
     init_session_state()
     st.session_state.tienda_seleccionada = current_tienda
     st.session_state.products_df = products_df
+    st.session_state.metricas_run = metrics_run
     st.success("Formulario limpiado. Listo para una nueva cotización.")
 
 init_session_state()
 
+# --- EDITOR DE COTIZACIÓN ---
+# Cada paso es un fragmento: un cambio dentro de uno solo vuelve a ejecutar ese paso
+CLIENT_FIELDS = ('fecha', 'cliente_nombre', 'cliente_nit', 'cliente_ciudad', 'cliente_tel',
+                 'cliente_email', 'cliente_dir', 'forma_pago', 'vigencia')
+ITEM_ROW_HEIGHT = 70
+
+def on_client_name_change():
+    st.session_state.cliente_renombrado = True
+
+@metered_fragment
+def client_data_fragment():
+    """Paso 2: información general y datos del cliente."""
+    st.header("Paso 2: Información General")
+    c1, c2, c3 = st.columns(3)
+    c1.date_input("Fecha", key="fecha", disabled=True)
+    c1.text_input("Ciudad (Origen)", "BOGOTA D.C", disabled=True)
+    c2.text_input("Entrega", "A CONVENIR CON EL CLIENTE", disabled=True)
+    c2.selectbox("Forma de Pago", ["Transferencia bancaria (pago anticipado)", "50% anticipado - 50% contraentrega", "Contraentrega"], key="forma_pago")
+    c3.selectbox("Vigencia", [f"{i} DÍAS HÁBILES" for i in range(1, 8)], key="vigencia")
+
+    st.subheader("Datos del Cliente")
+    cl1, cl2 = st.columns(2)
+    cl1.text_input("Cliente:", key="cliente_nombre", on_change=on_client_name_change)
+    cl1.text_input("NIT/CC:", key="cliente_nit")
+    cl1.text_input("Ciudad (Destino):", key="cliente_ciudad")
+    cl2.text_input("Teléfono:", key="cliente_tel")
+    cl2.text_input("Correo:", key="cliente_email")
+    cl2.text_input("Dirección:", key="cliente_dir")
+
+    # Copia viva de estos campos para el PDF, que se genera al hacer clic sin volver a ejecutar los totales
+    st.session_state.datos_cliente.update({field: st.session_state[field] for field in CLIENT_FIELDS})
+    # El nombre del archivo del PDF lleva el del cliente y el botón no lo puede calcular al hacer clic:
+    # al renombrarlo se vuelve a ejecutar la app para que los totales no ofrezcan el nombre anterior
+    if st.session_state.pop('cliente_renombrado', False) and st.session_state.quote_items:
+        st.rerun()
+
+@metered_fragment
+def add_product_fragment():
+    """Paso 3: añadir productos por SKU o manualmente (al añadir se recarga toda la cotización)."""
+    st.header("Paso 3: Añadir Productos")
+    form_cols = st.columns([2, 1, 1])
+    form_cols[0].text_input("Introduce el SKU del producto:", key="sku_input")
+    form_cols[1].number_input("Cantidad", min_value=1, value=1, step=1, key="qty_input")
+    if form_cols[2].button("➕ Añadir Producto", type="primary", use_container_width=True):
+        if st.session_state.sku_input:
+            sku_index = get_sku_index()
+            data = sku_index.lookup(st.session_state.sku_input) if sku_index else None
+            if data is not None:
+                sku = data['sku']
+                if sku in st.session_state.quote_items:
+                    st.session_state.quote_items[sku]['cantidad'] += st.session_state.qty_input
+                else:
+                    st.session_state.quote_items[sku] = {
+                        'imagen_url': data['imagen_url'],
+                        'nombre': data['nombre'],
+                        'sku': sku,
+                        'cantidad': st.session_state.qty_input,
+                        'precio_unitario': data['precio_iva_incluido']
+                    }
+                item = st.session_state.quote_items[sku]
+                item['valor_total'] = item['precio_unitario'] * item['cantidad']
+                st.rerun()
+            else:
+                st.error(f"❌ SKU '{st.session_state.sku_input}' no encontrado.")
+        else:
+            st.warning("⚠️ Introduce un SKU.")
+
+    with st.expander("👇 O añadir un producto manualmente"):
+        with st.form("manual_product_form", clear_on_submit=True):
+            manual_name = st.text_input("Nombre del Producto")
+            manual_sku = st.text_input("Código/SKU (ej: VARIOS-01)")
+            manual_price = st.number_input("Valor Unitario", min_value=0, step=100)
+            manual_qty = st.number_input("Cantidad", min_value=1, value=1, step=1)
+            manual_image = st.file_uploader("Subir Imagen (Opcional)", type=['png', 'jpg', 'jpeg'])
+
+            submitted = st.form_submit_button("Añadir Producto Manualmente")
+            if submitted:
+                if not all([manual_name, manual_sku, manual_price, manual_qty]):
+                    st.warning("Por favor, completa todos los campos del producto manual.")
+                else:
+                    image = {'imagen_hash': None}
+                    if manual_image is not None:
+                        image_bytes = shrink_upload(manual_image.getvalue())
+                        blob_store = get_blob_store()
+                        if blob_store.durable:
+                            # Solo el hash viaja en la cotización; los bytes quedan en el almacén
+                            try:
+                                image = {'imagen_hash': blob_store.put(image_bytes)}
+                            except ValueError as e:
+                                image = None
+                                st.error(f"No se pudo guardar la imagen: {e}")
+                        else:
+                            # Un almacén que no sobrevive a un reinicio perdería la imagen
+                            image = {'imagen_base64': base64.b64encode(image_bytes).decode()}
+
+                    if image is not None:
+                        st.session_state.manual_product_count += 1
+                        unique_sku = f"manual_{st.session_state.manual_product_count}"
+                        st.session_state.quote_items[unique_sku] = {
+                            'nombre': manual_name,
+                            'sku': manual_sku,
+                            'cantidad': manual_qty,
+                            'precio_unitario': manual_price,
+                            'valor_total': manual_price * manual_qty,
+                            **image,
+                            'imagen_url': None
+                        }
+                        st.success(f"Producto '{manual_name}' añadido.")
+                        st.rerun()
+
+    with st.expander("📋 Importar lista de SKUs (pegada o CSV/Excel)"):
+        with st.form("bulk_import_form", clear_on_submit=True):
+            pasted_list = st.text_area("Pega una línea por producto: `SKU,cantidad` (sin cantidad se toma 1)", height=150)
+            list_file = st.file_uploader("O sube un archivo con columnas SKU y cantidad", type=['csv', 'xlsx'])
+            if st.form_submit_button("Importar lista"):
+                import_sku_list(pasted_list, list_file)
+
+    import_result = st.session_state.import_result
+    if import_result is not None:
+        counts = import_result['estado'].value_counts()
+        st.caption(" · ".join(f"{estado}: {count}" for estado, count in counts.items()))
+        st.dataframe(
+            import_result,
+            hide_index=True,
+            use_container_width=True,
+            column_config={
+                'linea': "Línea", 'sku': "SKU", 'cantidad': "Cantidad",
+                'nombre': "Producto", 'inventory': "Inventario", 'estado': "Resultado"
+            }
+        )
+        st.button("Cerrar resultado de la importación", on_click=clear_import_result)
+
+def import_sku_list(text, uploaded_file):
+    """Cruza la lista pegada y/o el archivo con el catálogo y suma a la cotización lo encontrado."""
+    try:
+        frames = []
+        if text and text.strip():
+            frames.append(parse_sku_text(text))
+        if uploaded_file is not None:
+            frames.append(read_sku_file(uploaded_file.name, uploaded_file.getvalue()))
+    except SkuListError as e:
+        st.error(f"❌ {e}")
+        return
+    lines = pd.concat(frames, ignore_index=True) if frames else None
+    if lines is None or lines.empty:
+        st.warning("⚠️ Pega una lista de SKUs o sube un archivo.")
+        return
+    sku_index = get_sku_index()
+    if sku_index is None:
+        st.error("❌ El catálogo no está cargado.")
+        return
+
+    lines['linea'] = range(1, len(lines) + 1)
+    matches = match_sku_lines(lines, sku_index)
+    merge_into_quote(st.session_state.quote_items, matches)
+    st.session_state.import_result = matches[RESULT_COLUMNS]
+    st.rerun()
+
+def clear_import_result():
+    st.session_state.import_result = None
+
+def quote_items_frame(items):
+    """Tabla de los ítems para el editor, con las miniaturas ya en caché."""
+    thumbnails = get_item_thumbnails(items)
+    return pd.DataFrame({
+        'Imagen': [thumbnails.get(key) for key in items],
+        'Producto': [item['nombre'] for item in items.values()],
+        'SKU': [item['sku'] for item in items.values()],
+        'Unds.': [int(item['cantidad']) for item in items.values()],
+        'Vlr. Unit.': [format_currency(item['precio_unitario']) for item in items.values()],
+        'Vlr. Total': [format_currency(item['valor_total']) for item in items.values()],
+    })
+
+def apply_item_edits(keys, changes):
+    """Aplica a los ítems las cantidades editadas y las filas borradas en la tabla; True si cambió algo."""
+    changed = False
+    for position, edits in changes.get('edited_rows', {}).items():
+        cantidad = edits.get('Unds.')
+        item = st.session_state.quote_items.get(keys[int(position)])
+        if item is not None and cantidad is not None and int(cantidad) >= 1 and int(cantidad) != item['cantidad']:
+            item['cantidad'] = int(cantidad)
+            item['valor_total'] = item['precio_unitario'] * item['cantidad']
+            changed = True
+    for position in changes.get('deleted_rows', []):
+        remove_item(keys[position])
+        changed = True
+    return changed
+
+@metered_fragment
+def quote_items_fragment():
+    """Paso 4: una sola tabla virtualizada con los ítems; las cantidades se editan en la celda."""
+    st.header("Paso 4: Cotización Actual")
+    items = st.session_state.quote_items
+    if not items:
+        st.info("Aún no has añadido productos.")
+        return
+
+    # La clave cambia tras aplicar una edición para que la tabla arranque limpia con los nuevos datos
+    editor_key = f"quote_items_editor_{st.session_state.quote_items_version}"
+    st.data_editor(
+        quote_items_frame(items),
+        key=editor_key,
+        column_config={
+            'Imagen': st.column_config.ImageColumn("Imagen", width="small"),
+            'Producto': st.column_config.TextColumn("Producto", width="large"),
+            'Unds.': st.column_config.NumberColumn("Unds.", min_value=1, step=1, required=True),
+        },
+        disabled=['Imagen', 'Producto', 'SKU', 'Vlr. Unit.', 'Vlr. Total'],
+        num_rows="delete",
+        hide_index=True,
+        row_height=ITEM_ROW_HEIGHT,
+        use_container_width=True
+    )
+    st.caption("Edita las unidades en la tabla; para quitar productos, selecciónalos y bórralos.")
+    changes = st.session_state[editor_key]
+    if changes.get('edited_rows') or changes.get('deleted_rows'):
+        st.session_state.quote_items_version += 1
+        if apply_item_edits(list(items), changes):
+            # Los totales y el PDF dependen de los ítems
+            st.rerun()
+
+@metered_fragment
+def quote_totals_fragment():
+    """Resumen, flete, guardado y PDF de la cotización."""
+    if not st.session_state.quote_items:
+        return
+
+    st.divider()
+    st.subheader("Resumen y Acciones")
+    subtotal = sum(item['valor_total'] for item in st.session_state.quote_items.values())
+    total_unidades = sum(item['cantidad'] for item in st.session_state.quote_items.values())
+
+    st.subheader("Costo de Envío (Flete)")
+
+    opcion_flete = st.radio(
+        "Elige una opción para el flete:",
+        ("Ingresar valor manualmente", "Flete Incluido en el precio"),
+        key="flete_option",
+        horizontal=True
+    )
+
+    costo_flete_str = "" 
+
+    if opcion_flete == "Ingresar valor manualmente":
+        costo_flete_str = "MANUAL"
+        flete_text = st.text_input(
+            "Valor del Flete",
+            value=str(st.session_state.get('flete_val', 0)),
+            help="Escribe solo números. Ej: 35000"
+        )
+        st.session_state.flete_val = parse_int_from_text(flete_text)
+    else:
+        costo_flete_str = "INCLUIDO"
+        st.session_state.flete_val = 0
+
+    total_cotizacion = subtotal + (st.session_state.flete_val or 0)
+
+    t1, t2, t3 = st.columns(3)
+    t1.metric("SUBTOTAL", format_currency(subtotal))
+
+    flete_display_val = "INCLUIDO" if opcion_flete == "Flete Incluido en el precio" else format_currency(st.session_state.flete_val)
+    t2.metric("FLETE", flete_display_val)
+
+    t3.metric("TOTAL COTIZACION", format_currency(total_cotizacion))
+
+    st.caption(f"Total de unidades: {total_unidades}")
+
+    action_cols = st.columns(2)
+
+    is_new_quote = not st.session_state.current_quote_id
+    save_button_label = "💾 Guardar como Nueva" if is_new_quote else "💾 Guardar Cambios"
+    if action_cols[0].button(save_button_label, use_container_width=True, type="primary"):
+        if not st.session_state.cliente_nombre:
+            st.warning("Por favor, introduce al menos el nombre del cliente.")
+        else:
+            quote_data_to_save = {
+                'tienda': st.session_state.tienda_seleccionada,
+                'fecha': st.session_state.fecha.strftime("%d/%m/%Y"),
+                'cliente_nombre': st.session_state.cliente_nombre,
+                'cliente_nit': st.session_state.cliente_nit,
+                'cliente_ciudad': st.session_state.cliente_ciudad,
+                'cliente_tel': st.session_state.cliente_tel,
+                'cliente_email': st.session_state.cliente_email,
+                'cliente_dir': st.session_state.cliente_dir,
+                'forma_pago': st.session_state.forma_pago,
+                'vigencia': st.session_state.vigencia,
+                'items': st.session_state.quote_items,
+                'numero_cotizacion': st.session_state.numero_cotizacion,
+                'estado': st.session_state.estado,
+                'comentarios': st.session_state.comentarios,
+                'flete_val': int(st.session_state.flete_val)
+            }
+            if save_quote(db, quote_data_to_save, st.session_state.current_quote_id):
+                if is_new_quote:
+                    clear_form_state()
+                    st.rerun()
+
+    pdf_data_dict = {
+        'numero_cotizacion': st.session_state.numero_cotizacion or "N/A",
+        'items': copy.deepcopy(st.session_state.quote_items),
+        'subtotal': subtotal,
+        'flete_str': costo_flete_str,
+        'flete_val': int(st.session_state.flete_val),
+        'total_unidades': total_unidades,
+        'total_cotizacion': total_cotizacion
+    }
+    file_name_cliente = st.session_state.cliente_nombre.replace(' ', '_') if st.session_state.cliente_nombre else 'General'
+    file_name_cot = st.session_state.numero_cotizacion or "NUEVA"
+
+    pdf_quote_id = st.session_state.current_quote_id
+    datos_cliente = st.session_state.datos_cliente
+    # La descarga corre fuera de esta ejecución: su `Run` apunta a la que dibujó el botón
+    pdf_parent_run = metricas.current_run()
+    pdf_session_id = session_id()
+
+    def build_pdf():
+        with metricas.run_scope(pdf_session_id, 'descarga_pdf', parent=pdf_parent_run,
+                                metrics_file=metrics_config.get('archivo')):
+            # Los datos del cliente se leen al hacer clic: su fragmento pudo cambiarlos después
+            quote_data = dict(pdf_data_dict, **datos_cliente)
+            quote_data['fecha'] = quote_data['fecha'].strftime("%d/%m/%Y")
+            return get_pdf_bytes(quote_data, pdf_quote_id)
+
+    # El PDF se genera solo al hacer clic (y se reutiliza si el contenido no cambió)
+    action_cols[1].download_button(
+        label="📄 Generar PDF",
+        data=build_pdf,
+        file_name=f"Cotizacion_{file_name_cot}_{file_name_cliente}.pdf",
+        mime="application/pdf",
+        use_container_width=True
+    )
+
 # --- BARRA LATERAL ---
 with st.sidebar:
     st.title("Gestión de Cotizaciones")
@@ -583,6 +859,7 @@ with st.sidebar:
     def on_store_change():
         new_store = st.session_state.tienda_selector
         products_df = st.session_state.get('products_df')
+        metrics_run = st.session_state.get('metricas_run')
 
         for key in list(st.session_state.keys()):
             del st.session_state[key]
@@ -590,6 +867,7 @@ with st.sidebar:
         init_session_state()
         st.session_state.tienda_seleccionada = new_store
         st.session_state.products_df = products_df
+        st.session_state.metricas_run = metrics_run
 
     if 'tienda_seleccionada' not in st.session_state or st.session_state.tienda_seleccionada is None:
         st.session_state.tienda_seleccionada = tiendas[0]
@@ -606,6 +884,24 @@ with st.sidebar:
     if st.session_state.tienda_seleccionada:
         st.success(f"Tienda seleccionada: **{st.session_state.tienda_seleccionada}**")
 
+    if metrics_config.get('perfilador'):
+        with st.expander("🩺 Diagnóstico"):
+            st.toggle(
+                "Perfilar las ejecuciones", key="perfilar_ejecuciones",
+                help="Muestrea la pila de cada ejecución de la app para encontrar la parte lenta."
+            )
+            perfil = st.session_state.get('metricas_perfil')
+            if perfil:
+                st.caption(f"Última ejecución perfilada: `{perfil.id}` ({perfil.profiler.samples} muestras)")
+                st.dataframe(
+                    pd.DataFrame(perfil.profiler.top(10), columns=["Función", "Muestras"]),
+                    hide_index=True, use_container_width=True
+                )
+                st.download_button(
+                    "⬇️ Descargar pilas (flamegraph)", data=perfil.profile,
+                    file_name=f"perfil_{perfil.id}.txt", mime="text/plain", use_container_width=True
+                )
+
 # --- UI PRINCIPAL ---
 if not st.session_state.tienda_seleccionada:
     st.info("👋 ¡Bienvenido! Por favor, selecciona tu tienda en la barra lateral para comenzar.")
@@ -614,7 +910,7 @@ if not st.session_state.tienda_seleccionada:
     except FileNotFoundError:
         pass
 else:
-    tab1, tab2 = st.tabs(["📝 Crear Cotización", "📊 Seguimiento de Cotizaciones"])
+    tab1, tab2, tab3 = st.tabs(["📝 Crear Cotización", "📊 Seguimiento de Cotizaciones", "📈 Analítica"])
 
     # --- PESTAÑA DE CREAR COTIZACIÓN ---
     with tab1:
@@ -641,7 +937,9 @@ else:
                     if st.button("📥 Cargar Cotización", use_container_width=True):
                         if selected_quote_label:
                             quote_id_to_load = quotes_dict[selected_quote_label]
-                            quote_data = db.collection('cotizaciones').document(quote_id_to_load).get().to_dict()
+                            with metricas.span('firestore_cargar_cotizacion'):
+                                quote_data = db.collection('cotizaciones').document(quote_id_to_load).get().to_dict()
+                            metricas.count('firestore_documentos', consulta='cargar_cotizacion')
                             
                             clear_form_state()
                             
@@ -671,7 +969,7 @@ else:
             
             if st.session_state.get('current_quote_id'):
                 if st.button("🗑️ Eliminar Cotización", use_container_width=True):
-                    delete_quote(db, st.session_state.current_quote_id)
+                    delete_quote(db, st.session_state.current_quote_id, st.session_state.tienda_seleccionada)
                     clear_form_state()
                     st.rerun()
 
@@ -684,21 +982,18 @@ else:
         st.markdown("---")
         st.header("Paso 1: Catálogo de Productos (Sincronizado)")
         
-        col_cat_1, col_cat_2 = st.columns([3, 1])
+        col_cat_1, col_cat_2, col_cat_3 = st.columns([3, 1, 1])
         with col_cat_1:
             st.info("El catálogo se conecta directamente a Wix y trae TODOS los productos (incluyendo stock 0).")
-        with col_cat_2:
-            if st.button("🔄 Forzar Actualización", help="Vuelve a descargar los productos desde Wix"):
-                st.cache_data.clear()
-                st.rerun()
+        force_refresh = col_cat_2.button("🔄 Forzar Actualización", help="Trae desde Wix los productos modificados")
+        full_resync = col_cat_3.button("♻️ Resincronizar Todo", help="Vuelve a descargar todos los productos desde Wix")
 
-        # Cargar datos automáticamente si no existen
-        if st.session_state.get('products_df') is None:
-            df_wix = fetch_and_process_wix_data()
-            if df_wix is not None:
-                st.session_state.products_df = df_wix
-            else:
-                st.warning("⚠️ No se pudieron cargar los productos. Revisa tu conexión o API Key.")
+        # Cargar datos automáticamente; tras la primera carga solo llegan los cambios
+        df_wix = fetch_and_process_wix_data(force_refresh=force_refresh, full_resync=full_resync)
+        if df_wix is not None:
+            st.session_state.products_df = df_wix
+        elif st.session_state.get('products_df') is None:
+            st.warning("⚠️ No se pudieron cargar los productos. Revisa tu conexión o API Key.")
 
         # Mostrar confirmación si ya están cargados
         if st.session_state.get('products_df') is not None:
@@ -707,279 +1002,286 @@ else:
             # Buscador rápido para verificar
             with st.expander("🔍 Verificar productos (Buscador rápido)"):
                 search_term = st.text_input("Buscar por nombre o SKU en el catálogo cargado:")
-                if search_term:
-                    mask = st.session_state.products_df.apply(lambda x: search_term.lower() in str(x).lower(), axis=1)
-                    st.dataframe(st.session_state.products_df[mask].head(10))
+                search_index = get_search_index()
+                if search_term and search_index:
+                    positions = search_index.search(search_term, limit=10)
+                    st.dataframe(search_index.df.iloc[positions])
                 else:
                     st.dataframe(st.session_state.products_df.head())
             st.divider()
 
-            st.header("Paso 2: Información General")
-            c1, c2, c3 = st.columns(3)
-            c1.date_input("Fecha", key="fecha", disabled=True)
-            c1.text_input("Ciudad (Origen)", "BOGOTA D.C", disabled=True)
-            c2.text_input("Entrega", "A CONVENIR CON EL CLIENTE", disabled=True)
-            c2.selectbox("Forma de Pago", ["Transferencia bancaria (pago anticipado)", "50% anticipado - 50% contraentrega", "Contraentrega"], key="forma_pago")
-            c3.selectbox("Vigencia", [f"{i} DÍAS HÁBILES" for i in range(1, 8)], key="vigencia")
-
-            st.subheader("Datos del Cliente")
-            cl1, cl2 = st.columns(2)
-            cl1.text_input("Cliente:", key="cliente_nombre")
-            cl1.text_input("NIT/CC:", key="cliente_nit")
-            cl1.text_input("Ciudad (Destino):", key="cliente_ciudad")
-            cl2.text_input("Teléfono:", key="cliente_tel")
-            cl2.text_input("Correo:", key="cliente_email")
-            cl2.text_input("Dirección:", key="cliente_dir")
-
+            client_data_fragment()
             st.divider()
-            st.header("Paso 3: Añadir Productos")
-            form_cols = st.columns([2, 1, 1])
-            sku_input = form_cols[0].text_input("Introduce el SKU del producto:", key="sku_input")
-            qty_input = form_cols[1].number_input("Cantidad", min_value=1, value=1, step=1, key="qty_input")
-            if form_cols[2].button("➕ Añadir Producto", type="primary", use_container_width=True):
-                if st.session_state.sku_input:
-                    product = st.session_state.products_df[st.session_state.products_df['sku'] == st.session_state.sku_input]
-                    if not product.empty:
-                        data = product.iloc[0]
-                        sku = data['sku']
-                        if sku in st.session_state.quote_items:
-                            st.session_state.quote_items[sku]['cantidad'] += st.session_state.qty_input
-                        else:
-                            st.session_state.quote_items[sku] = {
-                                'imagen_url': data['imagen_url'],
-                                'nombre': data['nombre'],
-                                'sku': sku,
-                                'cantidad': st.session_state.qty_input,
-                                'precio_unitario': data['precio_iva_incluido']
-                            }
-                        item = st.session_state.quote_items[sku]
-                        item['valor_total'] = item['precio_unitario'] * item['cantidad']
-                        st.rerun()
-                    else:
-                        st.error(f"❌ SKU '{st.session_state.sku_input}' no encontrado.")
-                else:
-                    st.warning("⚠️ Introduce un SKU.")
-            
-            with st.expander("👇 O añadir un producto manualmente"):
-                with st.form("manual_product_form", clear_on_submit=True):
-                    manual_name = st.text_input("Nombre del Producto")
-                    manual_sku = st.text_input("Código/SKU (ej: VARIOS-01)")
-                    manual_price = st.number_input("Valor Unitario", min_value=0, step=100)
-                    manual_qty = st.number_input("Cantidad", min_value=1, value=1, step=1)
-                    manual_image = st.file_uploader("Subir Imagen (Opcional)", type=['png', 'jpg', 'jpeg'])
-                    
-                    submitted = st.form_submit_button("Añadir Producto Manualmente")
-                    if submitted:
-                        if not all([manual_name, manual_sku, manual_price, manual_qty]):
-                            st.warning("Por favor, completa todos los campos del producto manual.")
-                        else:
-                            st.session_state.manual_product_count += 1
-                            unique_sku = f"manual_{st.session_state.manual_product_count}"
-                            
-                            image_base64 = None
-                            if manual_image is not None:
-                                image_bytes = manual_image.getvalue()
-                                image_base64 = base64.b64encode(image_bytes).decode()
-
-                            st.session_state.quote_items[unique_sku] = {
-                                'nombre': manual_name,
-                                'sku': manual_sku,
-                                'cantidad': manual_qty,
-                                'precio_unitario': manual_price,
-                                'valor_total': manual_price * manual_qty,
-                                'imagen_base64': image_base64,
-                                'imagen_url': None
-                            }
-                            st.success(f"Producto '{manual_name}' añadido.")
-                            st.rerun()
-
+            add_product_fragment()
             st.divider()
-            st.header("Paso 4: Cotización Actual")
-            if not st.session_state.quote_items:
-                st.info("Aún no has añadido productos.")
-            else:
-                cols = st.columns([1.2, 4, 1, 1, 2, 2, 1])
-                headers = ["Imagen", "Producto", "SKU", "Unds.", "Vlr. Unit.", "Vlr. Total", ""]
-                for col, header in zip(cols, headers):
-                    col.markdown(f"**{header}**")
-                
-                for sku, item in list(st.session_state.quote_items.items()):
-                    cols = st.columns([1.2, 4, 1, 1, 2, 2, 1])
-                    if item.get('imagen_base64'):
-                        img_bytes = base64.b64decode(item['imagen_base64'])
-                        cols[0].image(img_bytes, width=70)
-                    elif item.get('imagen_url') and "placehold.co" not in item['imagen_url']:
-                        cols[0].image(item['imagen_url'], width=70)
-                    else:
-                        cols[0].markdown("S/I")
-
-                    cols[1].write(item['nombre'])
-                    cols[2].write(item['sku'])
-                    cols[3].write(str(item['cantidad']))
-                    cols[4].write(format_currency(item['precio_unitario']))
-                    cols[5].write(format_currency(item['valor_total']))
-                    if cols[6].button("🗑️", key=f"delete_{sku}", on_click=remove_item, args=(sku,)):
-                        st.rerun()
-                
-                st.divider()
-                st.subheader("Resumen y Acciones")
-                subtotal = sum(item['valor_total'] for item in st.session_state.quote_items.values())
-                total_unidades = sum(item['cantidad'] for item in st.session_state.quote_items.values())
-
-                st.subheader("Costo de Envío (Flete)")
-                
-                opcion_flete = st.radio(
-                    "Elige una opción para el flete:",
-                    ("Ingresar valor manualmente", "Flete Incluido en el precio"),
-                    key="flete_option",
-                    horizontal=True
-                )
-
-                costo_flete_str = "" 
-
-                if opcion_flete == "Ingresar valor manualmente":
-                    costo_flete_str = "MANUAL"
-                    flete_text = st.text_input(
-                        "Valor del Flete",
-                        value=str(st.session_state.get('flete_val', 0)),
-                        help="Escribe solo números. Ej: 35000"
-                    )
-                    st.session_state.flete_val = parse_int_from_text(flete_text)
-                else:
-                    costo_flete_str = "INCLUIDO"
-                    st.session_state.flete_val = 0
-                
-                total_cotizacion = subtotal + (st.session_state.flete_val or 0)
-                
-                t1, t2, t3 = st.columns(3)
-                t1.metric("SUBTOTAL", format_currency(subtotal))
-                
-                flete_display_val = "INCLUIDO" if opcion_flete == "Flete Incluido en el precio" else format_currency(st.session_state.flete_val)
-                t2.metric("FLETE", flete_display_val)
-                
-                t3.metric("TOTAL COTIZACION", format_currency(total_cotizacion))
-
-                st.caption(f"Total de unidades: {total_unidades}")
-                
-                action_cols = st.columns(2)
-                
-                is_new_quote = not st.session_state.current_quote_id
-                save_button_label = "💾 Guardar como Nueva" if is_new_quote else "💾 Guardar Cambios"
-                if action_cols[0].button(save_button_label, use_container_width=True, type="primary"):
-                    if not st.session_state.cliente_nombre:
-                        st.warning("Por favor, introduce al menos el nombre del cliente.")
-                    else:
-                        quote_data_to_save = {
-                            'tienda': st.session_state.tienda_seleccionada,
-                            'fecha': st.session_state.fecha.strftime("%d/%m/%Y"),
-                            'cliente_nombre': st.session_state.cliente_nombre,
-                            'cliente_nit': st.session_state.cliente_nit,
-                            'cliente_ciudad': st.session_state.cliente_ciudad,
-                            'cliente_tel': st.session_state.cliente_tel,
-                            'cliente_email': st.session_state.cliente_email,
-                            'cliente_dir': st.session_state.cliente_dir,
-                            'forma_pago': st.session_state.forma_pago,
-                            'vigencia': st.session_state.vigencia,
-                            'items': st.session_state.quote_items,
-                            'numero_cotizacion': st.session_state.numero_cotizacion,
-                            'estado': st.session_state.estado,
-                            'comentarios': st.session_state.comentarios,
-                            'flete_val': int(st.session_state.flete_val)
-                        }
-                        if save_quote(db, quote_data_to_save, st.session_state.current_quote_id):
-                            if is_new_quote:
-                                clear_form_state()
-                                st.rerun()
-
-                pdf_data_dict = {
-                    'fecha': st.session_state.fecha.strftime("%d/%m/%Y"),
-                    'numero_cotizacion': st.session_state.numero_cotizacion or "N/A",
-                    'cliente_nombre': st.session_state.cliente_nombre,
-                    'cliente_nit': st.session_state.cliente_nit,
-                    'cliente_ciudad': st.session_state.cliente_ciudad,
-                    'cliente_tel': st.session_state.cliente_tel,
-                    'cliente_email': st.session_state.cliente_email,
-                    'cliente_dir': st.session_state.cliente_dir,
-                    'forma_pago': st.session_state.forma_pago,
-                    'vigencia': st.session_state.vigencia,
-                    'items': st.session_state.quote_items,
-                    'subtotal': subtotal,
-                    'flete_str': costo_flete_str,
-                    'flete_val': int(st.session_state.flete_val),
-                    'total_unidades': total_unidades,
-                    'total_cotizacion': total_cotizacion
-                }
-                pdf_bytes = generate_pdf_content(pdf_data_dict)
-                
-                file_name_cliente = st.session_state.cliente_nombre.replace(' ', '_') if st.session_state.cliente_nombre else 'General'
-                file_name_cot = st.session_state.numero_cotizacion or "NUEVA"
-                
-                action_cols[1].download_button(
-                    label="📄 Generar PDF",
-                    data=pdf_bytes,
-                    file_name=f"Cotizacion_{file_name_cot}_{file_name_cliente}.pdf",
-                    mime="application/pdf",
-                    use_container_width=True
-                )
+            quote_items_fragment()
+            quote_totals_fragment()
 
     # --- PESTAÑA DE SEGUIMIENTO ---
     with tab2:
         st.header(f"Seguimiento de Cotizaciones - {st.session_state.tienda_seleccionada}")
 
         if db:
-            tracking_data = get_all_quotes_for_tracking(db, st.session_state.tienda_seleccionada)
-            if not tracking_data:
-                st.info("No hay cotizaciones para mostrar en esta tienda.")
+            tienda = st.session_state.tienda_seleccionada
+            sin_resumen = get_missing_summaries_count(db, tienda)
+
+            f1, f2, f3 = st.columns(3)
+            estados_filtro = f1.multiselect("Estado", ESTADOS_COTIZACION, key="filtro_estados")
+            rango_filtro = f2.date_input("Creadas entre", value=(), key="filtro_fechas")
+            cliente_filtro = f3.text_input("Cliente", key="filtro_cliente", placeholder="Nombre o NIT")
+            filtros = {'estados': tuple(estados_filtro), 'desde': None, 'hasta': None, 'cliente': cliente_filtro.strip()}
+            if len(rango_filtro) == 2:
+                filtros['desde'], filtros['hasta'] = day_range(*rango_filtro)
+
+            # Al cambiar los filtros (o la fuente de los datos, que usa otro tipo de cursor) se vuelve a la primera página
+            fuente = "memoria" if live_quote_store(db, tienda) else "firestore"
+            firma_filtros = hashlib.sha1(repr((fuente, sorted(filtros.items()))).encode()).hexdigest()[:12]
+            if st.session_state.get('tracking_filtros') != firma_filtros:
+                st.session_state.tracking_filtros = firma_filtros
+                st.session_state.tracking_page = 0
+                st.session_state.tracking_cursors = [None]
+            page = st.session_state.tracking_page
+
+            write_errors = st.session_state.pop('tracking_write_errors', None)
+            if write_errors:
+                st.error(f"No se pudieron guardar {len(write_errors)} cotizaciones; las demás se guardaron.")
+                st.dataframe(pd.DataFrame(write_errors, columns=["N° Cotización", "Error"]), hide_index=True)
+
+            # El editor guarda sus cambios por posición de fila: se dibuja y se compara siempre contra la
+            # página tal como se leyó al mostrarla (con el id y el update_time de cada fila), no contra una
+            # lectura nueva en la que otra cotización pudo mover las filas o cambiar su versión
+            editor_key = f"tracking_editor_{firma_filtros}_{page}_{st.session_state.get('tracking_table_version', 0)}"
+            tabla = st.session_state.get('tracking_table')
+            if tabla is None or tabla['editor'] != editor_key:
+                tracking_data, next_cursor = get_tracking_page(db, tienda, cursor=st.session_state.tracking_cursors[page], **filtros)
+                tabla = st.session_state.tracking_table = {
+                    'editor': editor_key, 'filas': pd.DataFrame(tracking_data), 'siguiente': next_cursor
+                }
+            df, next_cursor = tabla['filas'], tabla['siguiente']
+            if df.empty:
+                st.info("No hay cotizaciones para mostrar con estos filtros." if page == 0 else "No hay más cotizaciones.")
             else:
-                df = pd.DataFrame(tracking_data)
-                
-                if 'original_df' not in st.session_state:
-                    st.session_state.original_df = df.set_index('id').copy()
-
-                st.info("Puedes editar los campos 'Estado' y 'Comentarios' directamente en la tabla. Luego presiona 'Guardar Cambios'.")
+                info_col, reload_col = st.columns([4, 1])
+                info_col.info("Puedes editar los campos 'Estado' y 'Comentarios' directamente en la tabla. Luego presiona 'Guardar Cambios'.")
+                reload_col.button("🔄 Recargar tabla", on_click=reload_tracking_table, use_container_width=True)
                 
                 edited_df = st.data_editor(
                     df,
                     column_config={
                         "id": None,
+                        "version": None,
                         "N° Cotización": st.column_config.TextColumn(disabled=True),
                         "Fecha": st.column_config.TextColumn(disabled=True),
                         "Cliente": st.column_config.TextColumn(disabled=True),
                         "Total": st.column_config.NumberColumn("Total", format="$ %d", disabled=True),
                         "Estado": st.column_config.SelectboxColumn(
                             "Estado",
-                            options=["🔵 Creada", "✉️ Enviada", "✅ Aprobada", "❌ Rechazada", "🧾 Facturada"],
+                            options=ESTADOS_COTIZACION,
                             required=True,
                         ),
                         "Comentarios": st.column_config.TextColumn(width="large")
                     },
                     use_container_width=True,
                     hide_index=True,
-                    key="tracking_editor"
+                    key=editor_key
                 )
 
+            nav_prev, nav_label, nav_next = st.columns([1, 2, 1])
+            nav_prev.button("◀ Anterior", disabled=page == 0, on_click=go_to_tracking_page, args=(page - 1,), use_container_width=True)
+            nav_label.caption(f"Página {page + 1}")
+            nav_next.button("Siguiente ▶", disabled=next_cursor is None, on_click=go_to_tracking_page, args=(page + 1, next_cursor), use_container_width=True)
+
+            if not df.empty:
                 if st.button("💾 Guardar Cambios de Seguimiento", type="primary"):
-                    changes_to_update = {}
-                    original_df_reindexed = st.session_state.original_df.reset_index()
+                    changes_to_update = tracking_changes(df, edited_df)
 
-                    for i, row in edited_df.iterrows():
-                        try:
-                            original_row = original_df_reindexed.iloc[i]
-                            doc_id = original_row['id']
-                            
-                            if row['Estado'] != original_row['Estado'] or row['Comentarios'] != original_row['Comentarios']:
-                                changes_to_update[doc_id] = {
-                                    'estado': row['Estado'],
-                                    'comentarios': row['Comentarios']
-                                }
-                        except IndexError:
-                            continue
-                    
                     if changes_to_update:
-                        update_quotes_tracking(db, changes_to_update)
-                        st.cache_data.clear()
-                        if 'original_df' in st.session_state:
-                            del st.session_state.original_df
+                        failures = update_quotes_tracking(db, changes_to_update, tienda)
+                        if failures:
+                            numeros = dict(zip(df['id'], df['N° Cotización']))
+                            st.session_state.tracking_write_errors = [
+                                (numeros.get(doc_id, doc_id), error) for doc_id, error in failures.items()
+                            ]
+                        invalidate_quote_caches(tienda)
+                        # La tabla se vuelve a crear con los datos (y versiones) recién leídos
+                        reload_tracking_table()
                         st.rerun()
                     else:
                         st.toast("No se detectaron cambios para guardar.")
+
+            with st.expander("📦 Exportar PDFs en lote"):
+                opciones_export = get_tracking_labels(db, tienda, **filtros)
+                st.caption("Se listan todas las cotizaciones que cumplen los filtros de la tabla, no solo las de esta página.")
+                seleccion_export = st.multiselect(
+                    "Cotizaciones a exportar",
+                    options=list(opciones_export.keys()),
+                    default=list(opciones_export.keys())
+                )
+
+                if st.button(f"📦 Generar ZIP ({len(seleccion_export)} cotizaciones)", disabled=not seleccion_export):
+                    export_bar = st.progress(0, text="Generando PDFs...")
+
+                    def on_export_progress(hechas, total):
+                        export_bar.progress(hechas / total, text=f"Generando PDFs: {hechas} de {total}")
+
+                    previous_zip = st.session_state.get('export_zip_path')
+                    if previous_zip and os.path.exists(previous_zip):
+                        os.remove(previous_zip)
+                    zip_path, export_errors = export_quotes_pdf_zip(
+                        db, [opciones_export[label] for label in seleccion_export], on_progress=on_export_progress
+                    )
+                    export_bar.empty()
+                    st.session_state.export_zip_path = zip_path
+                    st.session_state.export_errors = export_errors
+
+                zip_path = st.session_state.get('export_zip_path')
+                if zip_path and os.path.exists(zip_path):
+                    export_errors = st.session_state.get('export_errors') or {}
+                    if export_errors:
+                        etiquetas = {quote_id: label for label, quote_id in opciones_export.items()}
+                        st.warning(f"{len(export_errors)} cotizaciones no se pudieron generar (ver ERRORES.txt en el ZIP).")
+                        st.dataframe(
+                            pd.DataFrame(
+                                [(etiquetas.get(quote_id, quote_id), error) for quote_id, error in export_errors.items()],
+                                columns=["Cotización", "Error"]
+                            ),
+                            hide_index=True
+                        )
+                    st.download_button(
+                        label="⬇️ Descargar ZIP",
+                        data=lambda: take_export_zip(zip_path),
+                        file_name=f"Cotizaciones_{tienda}_{date.today():%Y%m%d}.zip",
+                        mime="application/zip"
+                    )
+
+            with st.expander("🛠️ Mantenimiento", expanded=sin_resumen > 0):
+                if sin_resumen:
+                    st.warning(f"{sin_resumen} cotizaciones antiguas no aparecen en la tabla hasta completar sus campos resumen.")
+                st.caption("Calcula total, unidades, número de ítems, fecha de creación y términos de búsqueda en las cotizaciones guardadas antes de que existieran esos campos.")
+                if st.button("Completar campos resumen", disabled=not sin_resumen):
+                    backfill_bar = st.progress(0, text="Actualizando cotizaciones...")
+
+                    def on_backfill_progress(hechas, total):
+                        backfill_bar.progress(hechas / total, text=f"Actualizando cotizaciones: {hechas} de {total}")
+
+                    try:
+                        resultados = backfill_summaries(db, tienda, on_progress=on_backfill_progress)
+                        fallidas = failed_writes(resultados)
+                        invalidate_quote_caches(tienda)
+                        st.toast(f"Se actualizaron {len(resultados) - len(fallidas)} cotizaciones.")
+                        if fallidas:
+                            st.session_state.tracking_write_errors = list(fallidas.items())
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Error al completar los campos resumen: {e}")
+
+                st.divider()
+                st.caption("Mueve las imágenes de productos manuales guardadas dentro de las cotizaciones al almacén de imágenes; cada cotización queda solo con el hash.")
+                images_durable = get_blob_store().durable
+                if not images_durable:
+                    st.warning("El almacén de imágenes es el disco local de esta instancia: las imágenes se perderían al reiniciar. Configura `backend = \"firestore\"` en la sección `blobs`.")
+                if st.button("Mover imágenes al almacén", disabled=not images_durable):
+                    images_bar = st.progress(0, text="Revisando cotizaciones...")
+
+                    def on_images_progress(hechas, total):
+                        images_bar.progress(hechas / total, text=f"Revisando cotizaciones: {hechas} de {total}")
+
+                    try:
+                        resultados = migrate_inline_images(db, get_blob_store(), tienda, on_progress=on_images_progress)
+                        fallidas = failed_writes(resultados)
+                        invalidate_quote_caches(tienda)
+                        st.toast(f"Se migraron las imágenes de {len(resultados) - len(fallidas)} cotizaciones.")
+                        if fallidas:
+                            st.session_state.tracking_write_errors = list(fallidas.items())
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Error al mover las imágenes: {e}")
+
+                st.divider()
+                st.caption("Cachés del proceso: aciertos y fallos por espacio.")
+                st.dataframe(pd.DataFrame(get_cache().stats()), hide_index=True)
+
+    # --- PESTAÑA DE ANALÍTICA ---
+    with tab3:
+        st.header(f"Analítica de Ventas - {st.session_state.tienda_seleccionada}")
+
+        if db:
+            tienda = st.session_state.tienda_seleccionada
+            analitica = get_analytics(db, tienda)
+            if not analitica:
+                st.info("Aún no hay datos agregados. Si ya existen cotizaciones, usa 'Reconstruir agregados' en Mantenimiento.")
+            else:
+                meses = monthly_summary(analitica)
+                m1, m2, m3, m4 = st.columns(4)
+                m1.metric("Cotizaciones", int(meses['Cotizaciones'].sum()))
+                m2.metric("Total cotizado", format_currency(meses['Total cotizado'].sum()))
+                m3.metric("Total ganado", format_currency(meses['Total ganado'].sum()))
+                cotizado = meses['Total cotizado'].sum()
+                m4.metric("Conversión en valor", f"{meses['Total ganado'].sum() / cotizado * 100:.1f}%" if cotizado else "N/A")
+
+                st.subheader("Por mes")
+                porcentaje = st.column_config.NumberColumn(format="%.1f%%")
+                st.dataframe(
+                    meses,
+                    hide_index=True,
+                    use_container_width=True,
+                    column_config={
+                        "Total cotizado": st.column_config.NumberColumn(format="$ %d"),
+                        "Total ganado": st.column_config.NumberColumn(format="$ %d"),
+                        "% Enviada": porcentaje, "% Aprobada": porcentaje, "% Facturada": porcentaje,
+                    }
+                )
+                st.bar_chart(meses.set_index('Mes')[['Total cotizado', 'Total ganado']].sort_index())
+
+                a1, a2 = st.columns(2)
+                with a1:
+                    st.subheader("Clientes")
+                    st.dataframe(
+                        client_summary(analitica),
+                        hide_index=True,
+                        use_container_width=True,
+                        column_config={
+                            "nombre": "Cliente", "cotizaciones": "Cotizaciones", "ganadas": "Ganadas",
+                            "total": st.column_config.NumberColumn("Total", format="$ %d"),
+                            "total_ganado": st.column_config.NumberColumn("Total ganado", format="$ %d"),
+                            "% ganadas": st.column_config.NumberColumn(format="%.1f%%"),
+                        }
+                    )
+                with a2:
+                    st.subheader("Productos")
+                    st.dataframe(
+                        sku_summary(analitica),
+                        hide_index=True,
+                        use_container_width=True,
+                        column_config={
+                            "sku": "SKU", "nombre": "Producto", "cotizaciones": "Cotizaciones",
+                            "unidades": "Unidades", "unidades_ganadas": "Unidades ganadas",
+                            "valor": st.column_config.NumberColumn("Valor", format="$ %d"),
+                            "valor_ganado": st.column_config.NumberColumn("Valor ganado", format="$ %d"),
+                        }
+                    )
+
+            with st.expander("🛠️ Mantenimiento"):
+                st.caption("Recalcula los agregados recorriendo todas las cotizaciones de la tienda y los compara con los guardados. Úsalo con poca actividad.")
+                v1, v2 = st.columns(2)
+                verificar = v1.button("Verificar agregados", use_container_width=True)
+                reconstruir = v2.button("Reconstruir agregados", use_container_width=True)
+                if verificar or reconstruir:
+                    with st.spinner("Recorriendo cotizaciones..."):
+                        try:
+                            diferencias = rebuild_analytics(db, tienda, repair=reconstruir)
+                        except Exception as e:
+                            st.error(f"Error al recalcular la analítica: {e}")
+                            diferencias = None
+                    if diferencias is not None:
+                        if diferencias.empty:
+                            st.success("Los agregados coinciden con las cotizaciones.")
+                        else:
+                            accion = "Se corrigieron" if reconstruir else "Hay"
+                            st.warning(f"{accion} {diferencias['documento'].nunique()} documentos con diferencias.")
+                            st.dataframe(diferencias, hide_index=True, use_container_width=True)
+                        if reconstruir:
+                            invalidate_quote_caches(tienda)
+
+# --- MÉTRICAS DE LA EJECUCIÓN ---
+metricas.end_run(st.session_state.metricas_run, metrics_file=metrics_config.get('archivo'))
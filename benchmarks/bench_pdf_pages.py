@@ -0,0 +1,111 @@
+"""Páginas por segundo de generate_pdf_content: encabezado anterior frente al registro de recursos.
+
+El modo "anterior" reproduce el `PDF.header()` original, que llamaba `add_font()`
+para las tres fuentes Lato en cada página y decodificaba el logo en cada
+documento; el modo "registro" usa `PdfResources`, que registra las fuentes una
+vez por documento con el API público de fpdf2 e inserta el logo ya convertido
+una vez por proceso a JPEG, que fpdf2 incrusta sin decodificar.
+
+Uso:
+    python benchmarks/bench_pdf_pages.py
+    python benchmarks/bench_pdf_pages.py --items 10 100 400 --repeats 7
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import warnings
+
+warnings.simplefilter('ignore')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pdf_cotizacion  # noqa: E402
+from pdf_cotizacion import FONT_FILES, LOGO_PATH, PDF, generate_pdf_content  # noqa: E402
+
+
+class LegacyResources:
+    """Recursos del encabezado anterior: el logo se lee del PNG en cada documento."""
+
+    def __init__(self, resources):
+        self.logo_available = resources.logo_available
+
+    def logo(self):
+        return LOGO_PATH
+
+
+class LegacyHeaderPDF(PDF):
+    """Encabezado como estaba antes del registro: fuentes y logo se cargan en cada documento
+    y `add_font()` se vuelve a llamar en cada página."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fonts.clear()
+        self.image_cache.images.clear()
+        self.resources = LegacyResources(self.resources)
+        self.current_font_family = 'Arial'
+
+    def header(self):
+        try:
+            for style, path in FONT_FILES.items():
+                self.add_font('Lato', style, path)
+            self.current_font_family = 'Lato'
+        except RuntimeError:
+            self.current_font_family = 'Arial'
+        super().header()
+
+
+def synthetic_quote(n_items):
+    items = {}
+    for i in range(n_items):
+        nombre = f"Producto didáctico de prueba {i}" + (" con un nombre largo que ocupa varias líneas" if i % 3 == 0 else "")
+        items[f"SKU{i}"] = {
+            'nombre': nombre, 'sku': f"SKU{i}", 'cantidad': i + 1,
+            'precio_unitario': 1000.0 * (i + 1), 'valor_total': 1000.0 * (i + 1) ** 2, 'imagen_url': None
+        }
+    return {
+        'fecha': "01/01/2025", 'numero_cotizacion': "OV-0001", 'cliente_nombre': "Cliente de prueba",
+        'cliente_nit': "900000000", 'cliente_ciudad': "Bogotá", 'cliente_tel': "3000000000",
+        'cliente_dir': "Calle 1 # 2-3", 'vigencia': "5 DÍAS HÁBILES", 'items': items, 'subtotal': 0,
+        'flete_str': "MANUAL", 'flete_val': 0, 'total_unidades': 0, 'total_cotizacion': 0
+    }
+
+
+def pages_per_second(pdf_class, quote, duration):
+    pdf_cotizacion.PDF = pdf_class
+    try:
+        generate_pdf_content(quote)
+        docs = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            pdf_bytes = generate_pdf_content(quote)
+            docs += 1
+        elapsed = time.perf_counter() - start
+    finally:
+        pdf_cotizacion.PDF = PDF
+    pages = pdf_bytes.count(b"/Type /Page\n") or pdf_bytes.count(b"/Type /Page")
+    return docs * pages / elapsed, pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, nargs='+', default=[5, 60, 300])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--duration', type=float, default=1.0, help="segundos por medición")
+    args = parser.parse_args()
+
+    print(f"{'ítems':>6} {'páginas':>8} {'anterior (pág/s)':>17} {'registro (pág/s)':>17} {'mejora':>7}")
+    for n_items in args.items:
+        quote = synthetic_quote(n_items)
+        legacy, registry = [], []
+        for _ in range(args.repeats):
+            rate, pages = pages_per_second(LegacyHeaderPDF, quote, args.duration)
+            legacy.append(rate)
+            rate, pages = pages_per_second(PDF, quote, args.duration)
+            registry.append(rate)
+        before, after = statistics.median(legacy), statistics.median(registry)
+        print(f"{n_items:>6} {pages:>8} {before:>17.1f} {after:>17.1f} {after / before:>6.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Microbenchmark del índice de SKUs frente al filtro booleano sobre el DataFrame.
+
+Uso:
+    python benchmarks/bench_sku_index.py
+    python benchmarks/bench_sku_index.py --sizes 50000 200000 --lookups 20000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalogo import SkuIndex  # noqa: E402
+
+
+def synthetic_catalog(size, seed=7):
+    rng = random.Random(seed)
+    skus = [f"{rng.choice(['', 'JYE-', 'MD', '00'])}{i:06d}" for i in range(size)]
+    return pd.DataFrame({
+        'sku': skus,
+        'nombre': [f"Producto {i}" for i in range(size)],
+        'precio_iva_incluido': [float(rng.randint(1000, 500000)) for _ in range(size)],
+        'imagen_url': [f"https://static.wixstatic.com/media/{i}.jpg" for i in range(size)],
+        'inventory': [rng.randint(0, 50) for _ in range(size)]
+    })
+
+
+def per_call_us(fn, args):
+    start = time.perf_counter()
+    for a in args:
+        fn(a)
+    return (time.perf_counter() - start) / len(args) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000, 100000, 200000])
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--scans', type=int, default=50, help="búsquedas con filtro booleano por tamaño")
+    args = parser.parse_args()
+
+    print(f"{'productos':>10} {'índice (ms)':>12} {'lookup (µs)':>12} {'position (µs)':>14} {'scan (µs)':>12}")
+    for size in args.sizes:
+        df = synthetic_catalog(size)
+        rng = random.Random(size)
+        queries = [rng.choice(df['sku'].tolist()) for _ in range(args.lookups)]
+        # Mezcla de consultas exactas y con otra forma (espacios, mayúsculas)
+        queries = [f" {q.upper()} " if i % 2 else q for i, q in enumerate(queries)]
+
+        start = time.perf_counter()
+        index = SkuIndex(df)
+        build_ms = (time.perf_counter() - start) * 1e3
+
+        lookup_us = per_call_us(index.lookup, queries)
+        position_us = per_call_us(index.position, queries)
+        scan_us = per_call_us(lambda q: df[df['sku'] == q], queries[:args.scans])
+        print(f"{size:>10} {build_ms:>12.1f} {lookup_us:>12.2f} {position_us:>14.3f} {scan_us:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Guardado de seguimiento: una escritura por cotización frente a `commit_writes` en lotes.
+
+Usa el Firestore en memoria de `fake_firestore` con latencia por RPC y una tasa
+de fallos transitorios; una de las cotizaciones editadas se borra antes de
+guardar para comprobar que el reporte por documento la aísla.
+
+Uso:
+    python benchmarks/bench_tracking_writes.py
+    python benchmarks/bench_tracking_writes.py --quotes 200 1000 --latency 0.03 --failure-rate 0.1
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cotizaciones_db  # noqa: E402
+from cotizaciones_db import COLLECTION, commit_writes, failed_writes  # noqa: E402
+from fake_firestore import FakeFirestore  # noqa: E402
+
+
+def seeded_db(n_quotes, latency, failure_rate):
+    db = FakeFirestore(seed=n_quotes)
+    batch = db.batch()
+    for i in range(n_quotes):
+        batch.set(db.collection(COLLECTION).document(f"q{i:05d}"), {
+            'tienda': "Oviedo", 'numero_cotizacion': f"OV-{i:04d}", 'estado': "✉️ Enviada", 'comentarios': ""
+        })
+        if len(batch) == 500:
+            batch.commit()
+            batch = db.batch()
+    batch.commit()
+    db.latency, db.failure_rate = latency, failure_rate
+    return db
+
+
+def edits(n_quotes):
+    return {f"q{i:05d}": {'estado': "🧾 Facturada", 'comentarios': f"Factura {i}"} for i in range(n_quotes)}
+
+
+def sequential(db, changes):
+    """Como se guardaba antes: un update por cotización, sin reintentos."""
+    failures = {}
+    for doc_id, fields in changes.items():
+        try:
+            db.collection(COLLECTION).document(doc_id).update(fields)
+        except Exception as e:
+            failures[doc_id] = f"{type(e).__name__}: {e}"
+    return failures
+
+
+def batched(db, changes):
+    return failed_writes(commit_writes(db, [('update', doc_id, fields) for doc_id, fields in changes.items()]))
+
+
+def run(mode, n_quotes, latency, failure_rate):
+    db = seeded_db(n_quotes, latency, failure_rate)
+    changes = edits(n_quotes)
+    db.latency, db.failure_rate = 0.0, 0.0
+    db.collection(COLLECTION).document("q00000").delete()
+    db.latency, db.failure_rate = latency, failure_rate
+    start = time.perf_counter()
+    failures = mode(db, changes)
+    elapsed = time.perf_counter() - start
+    applied = sum(1 for snap in db.collection(COLLECTION).where('estado', '==', "🧾 Facturada").stream())
+    return elapsed, db.stats['commits'], len(failures), applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quotes', type=int, nargs='+', default=[50, 200, 1000])
+    parser.add_argument('--latency', type=float, default=0.02, help="segundos por RPC")
+    parser.add_argument('--failure-rate', type=float, default=0.05)
+    args = parser.parse_args()
+    cotizaciones_db.RETRY_BASE_DELAY = args.latency
+
+    print(f"{'cotizaciones':>12} {'modo':>10} {'tiempo (s)':>11} {'commits':>8} {'fallidas':>9} {'aplicadas':>10}")
+    for n_quotes in args.quotes:
+        for name, mode in (('secuencial', sequential), ('lotes', batched)):
+            elapsed, commits, failed, applied = run(mode, n_quotes, args.latency, args.failure_rate)
+            print(f"{n_quotes:>12} {name:>10} {elapsed:>11.2f} {commits:>8} {failed:>9} {applied:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,430 @@
+"""Firestore en memoria para pruebas de carga y benchmarks locales.
+
+Implementa la parte del cliente de google-cloud-firestore que usa la app:
+colecciones, documentos, consultas (where, order_by, limit, start_after, select,
+count), lotes de escritura (`set(merge=True)` combina los mapas anidados),
+`get_all` y listeners `on_snapshot`. `latency` simula la ida y vuelta de cada
+RPC y `failure_rate` hace fallar una fracción de los commits con un error
+transitorio, como haría el servicio bajo carga.
+"""
+import copy
+import enum
+import itertools
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from google.api_core import exceptions as gexc
+from google.cloud.firestore_v1 import DELETE_FIELD, SERVER_TIMESTAMP
+from google.cloud.firestore_v1.transforms import Increment
+
+MAX_BATCH_WRITES = 500
+
+_OPERATORS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a is not None and a != b,
+    '<': lambda a, b: a is not None and a < b,
+    '<=': lambda a, b: a is not None and a <= b,
+    '>': lambda a, b: a is not None and a > b,
+    '>=': lambda a, b: a is not None and a >= b,
+    'in': lambda a, b: a in b,
+    'not-in': lambda a, b: a is not None and a not in b,
+    'array_contains': lambda a, b: isinstance(a, list) and b in a,
+    'array_contains_any': lambda a, b: isinstance(a, list) and any(v in a for v in b),
+}
+
+
+def _get_field(data, field_path):
+    for part in field_path.split('.'):
+        if not isinstance(data, dict) or part not in data:
+            return None
+        data = data[part]
+    return data
+
+
+class ChangeType(enum.Enum):
+    ADDED = 1
+    REMOVED = 2
+    MODIFIED = 3
+
+
+class FakeChange:
+    def __init__(self, change_type, document):
+        self.type = change_type
+        self.document = document
+
+
+class FakeWriteResult:
+    def __init__(self, update_time):
+        self.update_time = update_time
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data, create_time=None, update_time=None):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self.create_time = create_time
+        self.update_time = update_time
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+    def get(self, field_path):
+        # Como el cliente real: None si el documento no existe, KeyError si falta el campo
+        if not self.exists:
+            return None
+        value = self._data
+        for part in field_path.split('.'):
+            if not isinstance(value, dict) or part not in value:
+                raise KeyError(field_path)
+            value = value[part]
+        return copy.deepcopy(value)
+
+
+class FakeDocumentReference:
+    def __init__(self, client, collection, doc_id):
+        self._client = client
+        self._collection = collection
+        self.id = doc_id
+        self.path = f"{collection}/{doc_id}"
+
+    def get(self, transaction=None, field_paths=None):
+        self._client._rpc()
+        return self._client._snapshot(self)
+
+    def set(self, document_data, merge=False):
+        batch = self._client.batch()
+        batch.set(self, document_data, merge=merge)
+        return batch.commit()[0]
+
+    def create(self, document_data):
+        batch = self._client.batch()
+        batch.create(self, document_data)
+        return batch.commit()[0]
+
+    def update(self, field_updates, option=None):
+        batch = self._client.batch()
+        batch.update(self, field_updates, option=option)
+        return batch.commit()[0]
+
+    def delete(self, option=None):
+        batch = self._client.batch()
+        batch.delete(self, option=option)
+        batch.commit()
+
+
+class FakeAggregation:
+    def __init__(self, value):
+        self.value = value
+
+
+class FakeCountQuery:
+    def __init__(self, query):
+        self._query = query
+
+    def get(self):
+        self._query._client._rpc()
+        return [[FakeAggregation(len(self._query._matching_ids()))]]
+
+
+class FakeQuery:
+    def __init__(self, client, collection, filters=(), orders=(), limit=None, start_after=None, fields=None):
+        self._client = client
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._start_after = start_after
+        self._fields = fields
+
+    def _copy(self, **changes):
+        state = dict(
+            filters=self._filters, orders=self._orders, limit=self._limit,
+            start_after=self._start_after, fields=self._fields
+        )
+        state.update(changes)
+        return FakeQuery(self._client, self._collection, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction='ASCENDING'):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, snapshot):
+        return self._copy(start_after=snapshot)
+
+    def select(self, field_paths):
+        return self._copy(fields=list(field_paths))
+
+    def count(self, alias=None):
+        return FakeCountQuery(self)
+
+    def _matching_ids(self):
+        docs = self._client._collections.get(self._collection, {})
+        ids = [
+            doc_id for doc_id, doc in docs.items()
+            if all(_OPERATORS[op](_get_field(doc['data'], field), value) for field, op, value in self._filters)
+        ]
+        ids.sort()
+        for field, direction in reversed(self._orders):
+            # Como Firestore, los documentos sin el campo de orden quedan fuera
+            ids = [doc_id for doc_id in ids if _get_field(docs[doc_id]['data'], field) is not None]
+            ids.sort(key=lambda doc_id: _get_field(docs[doc_id]['data'], field), reverse=direction == 'DESCENDING')
+        if self._start_after is not None and self._start_after.id in ids:
+            ids = ids[ids.index(self._start_after.id) + 1:]
+        if self._limit is not None:
+            ids = ids[:self._limit]
+        return ids
+
+    def stream(self, transaction=None):
+        self._client._rpc()
+        with self._client._lock:
+            snaps = [self._client._snapshot_locked(FakeDocumentReference(self._client, self._collection, doc_id))
+                     for doc_id in self._matching_ids()]
+        for snap in snaps:
+            if self._fields is not None:
+                snap._data = {k: v for k, v in snap._data.items() if k in self._fields}
+            yield snap
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction))
+
+    def on_snapshot(self, callback):
+        return self._client._watch(self, callback)
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client, name):
+        super().__init__(client, name)
+        self.id = name
+
+    def document(self, document_id=None):
+        return FakeDocumentReference(self._client, self._collection, document_id or self._client._auto_id())
+
+    def add(self, document_data, document_id=None):
+        ref = self.document(document_id)
+        return ref.create(document_data).update_time, ref
+
+
+class FakeWriteBatch:
+    """Lote atómico: se valida entero antes de aplicar cualquier escritura."""
+
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(('set', reference, document_data, merge))
+
+    def create(self, reference, document_data):
+        self._writes.append(('create', reference, document_data, None))
+
+    def update(self, reference, field_updates, option=None):
+        self._writes.append(('update', reference, field_updates, option))
+
+    def delete(self, reference, option=None):
+        self._writes.append(('delete', reference, None, option))
+
+    def commit(self):
+        if len(self._writes) > MAX_BATCH_WRITES:
+            raise gexc.InvalidArgument(f"maximum {MAX_BATCH_WRITES} writes allowed per request")
+        self._client._rpc(commit=True)
+        results = self._client._apply(self._writes)
+        self._writes = []
+        return results
+
+
+class _Watch:
+    def __init__(self, client, query, callback):
+        self._client = client
+        self._query = query.limit(None)
+        self._callback = callback
+        self._known = set()
+        self.is_active = True
+
+    def unsubscribe(self):
+        self.is_active = False
+        with self._client._lock:
+            if self in self._client._watches:
+                self._client._watches.remove(self)
+
+    def _deliver(self, doc_ids=None):
+        if not self.is_active:
+            return
+        with self._client._lock:
+            matching = set(self._query._matching_ids())
+            candidates = matching if doc_ids is None else set(doc_ids)
+            changes = []
+            for doc_id in sorted(candidates):
+                ref = FakeDocumentReference(self._client, self._query._collection, doc_id)
+                if doc_id in matching:
+                    change_type = ChangeType.MODIFIED if doc_id in self._known else ChangeType.ADDED
+                    self._known.add(doc_id)
+                    changes.append(FakeChange(change_type, self._client._snapshot_locked(ref)))
+                elif doc_id in self._known:
+                    self._known.discard(doc_id)
+                    changes.append(FakeChange(ChangeType.REMOVED, FakeSnapshot(ref, None)))
+        if changes or doc_ids is None:
+            self._callback([], changes, self._client._now())
+
+
+class FakeFirestore:
+    """Cliente de Firestore en memoria y seguro entre hilos."""
+
+    def __init__(self, latency=0.0, failure_rate=0.0, listener_delay=0.05, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.listener_delay = listener_delay
+        self.stats = {'rpcs': 0, 'reads': 0, 'commits': 0, 'writes': 0, 'failures': 0}
+        self._collections = {}
+        self._watches = []
+        self._lock = threading.RLock()
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._clock = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+    def collection(self, name):
+        return FakeCollectionReference(self, name)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        self._rpc()
+        with self._lock:
+            snaps = [self._snapshot_locked(ref) for ref in references]
+        yield from snaps
+
+    def close(self):
+        for watch in list(self._watches):
+            watch.unsubscribe()
+
+    def _auto_id(self):
+        return f"auto{next(self._ids):08d}"
+
+    def _now(self):
+        # Reloj estrictamente creciente: dos escrituras nunca tienen el mismo update_time
+        with self._lock:
+            self._clock = max(self._clock + timedelta(microseconds=1), datetime.now(timezone.utc))
+            return self._clock
+
+    def _rpc(self, commit=False):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.stats['rpcs'] += 1
+            if commit:
+                if self.failure_rate and self._random.random() < self.failure_rate:
+                    self.stats['failures'] += 1
+                    raise gexc.ServiceUnavailable("fake: servicio no disponible")
+                self.stats['commits'] += 1
+
+    def _snapshot(self, reference):
+        with self._lock:
+            return self._snapshot_locked(reference)
+
+    def _snapshot_locked(self, reference):
+        self.stats['reads'] += 1
+        doc = self._collections.get(reference._collection, {}).get(reference.id)
+        if doc is None:
+            return FakeSnapshot(reference, None)
+        return FakeSnapshot(reference, copy.deepcopy(doc['data']), doc['create_time'], doc['update_time'])
+
+    def _resolve(self, value, previous, now):
+        if value is SERVER_TIMESTAMP:
+            return now
+        if isinstance(value, Increment):
+            return (previous if isinstance(previous, (int, float)) else 0) + value.value
+        return copy.deepcopy(value)
+
+    def _check_option(self, doc, option, path):
+        if option is None:
+            return
+        last_update_time = getattr(option, '_last_update_time', None)
+        if last_update_time is not None and (doc is None or doc['update_time'] != last_update_time):
+            raise gexc.FailedPrecondition(f"fake: {path} cambió desde la lectura")
+        exists = getattr(option, '_exists', None)
+        if exists is not None and (doc is not None) != exists:
+            raise gexc.FailedPrecondition(f"fake: precondición de existencia de {path}")
+
+    def write_option(self, last_update_time=None, exists=None):
+        option = type('FakeWriteOption', (), {})()
+        option._last_update_time = last_update_time
+        option._exists = exists
+        return option
+
+    def _apply(self, writes):
+        with self._lock:
+            # Validación completa antes de tocar datos: el lote es atómico
+            for kind, ref, _, option in writes:
+                doc = self._collections.get(ref._collection, {}).get(ref.id)
+                if kind == 'create' and doc is not None:
+                    raise gexc.AlreadyExists(f"fake: {ref.path} ya existe")
+                if kind == 'update' and doc is None:
+                    raise gexc.NotFound(f"fake: no existe {ref.path}")
+                if kind in ('update', 'delete'):
+                    self._check_option(doc, option, ref.path)
+            now = self._now()
+            touched = []
+            for kind, ref, data, merge in writes:
+                docs = self._collections.setdefault(ref._collection, {})
+                doc = docs.get(ref.id)
+                if kind == 'delete':
+                    docs.pop(ref.id, None)
+                else:
+                    if doc is None:
+                        doc = docs[ref.id] = {'data': {}, 'create_time': now}
+                    if kind in ('set', 'create') and not merge:
+                        doc['data'] = {}
+                    if kind == 'set' and merge:
+                        self._merge_fields(doc['data'], data, now)
+                    else:
+                        for field_path, value in data.items():
+                            self._set_field(doc['data'], field_path, value, now, split=kind == 'update')
+                    doc['update_time'] = now
+                touched.append(ref)
+                self.stats['writes'] += 1
+            watches = list(self._watches)
+        for watch in watches:
+            ids = [ref.id for ref in touched if ref._collection == watch._query._collection]
+            if ids:
+                threading.Timer(self.listener_delay, watch._deliver, args=(ids,)).start()
+        return [FakeWriteResult(now) for _ in writes]
+
+    def _set_field(self, data, field_path, value, now, split):
+        parts = field_path.split('.') if split else [field_path]
+        for part in parts[:-1]:
+            data = data.setdefault(part, {})
+        if value is DELETE_FIELD:
+            data.pop(parts[-1], None)
+        else:
+            data[parts[-1]] = self._resolve(value, data.get(parts[-1]), now)
+
+    def _merge_fields(self, data, values, now):
+        # set(merge=True) combina los mapas anidados en lugar de reemplazarlos
+        for key, value in values.items():
+            if isinstance(value, dict):
+                if not isinstance(data.get(key), dict):
+                    data[key] = {}
+                self._merge_fields(data[key], value, now)
+            else:
+                self._set_field(data, key, value, now, split=False)
+
+    def _watch(self, query, callback):
+        watch = _Watch(self, query, callback)
+        with self._lock:
+            self._watches.append(watch)
+        threading.Timer(self.listener_delay, watch._deliver).start()
+        return watch
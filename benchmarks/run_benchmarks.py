@@ -0,0 +1,383 @@
+"""Suite de benchmarks reproducibles de los caminos críticos de la app, con resultados en JSON.
+
+Todo corre sin red: un servidor HTTP local responde `products/query` con un
+catálogo sintético con la forma del API de Wix y sirve imágenes JPEG de prueba,
+y el seguimiento se carga desde `FakeFirestore`. Para cada caso se mide el
+tiempo (mediana, mínimo y máximo de `--repeats` ejecuciones) y el pico de
+memoria de Python (tracemalloc, en una ejecución aparte).
+
+Casos:
+    catalogo_parseo   productos de Wix -> DataFrame (parse_wix_product + build_catalog_dataframe)
+    catalogo_descarga fetch_wix_products contra el servidor local (paginado en paralelo incluido)
+    sku_lookup        construir SkuIndex y buscar SKUs (con y sin ceros/mayúsculas)
+    busqueda_rapida   construir SearchIndex y resolver consultas con prefijos y errores
+    pdf               generate_pdf_content con 10-1000 ítems, sin y con imágenes
+    seguimiento       primera página desde Firestore, carga del almacén en memoria y páginas filtradas
+
+Uso:
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --quick --output resultados.json
+    python benchmarks/run_benchmarks.py --only pdf --quote-items 10 100 --compare base.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import warnings
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+warnings.simplefilter('ignore')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from PIL import Image  # noqa: E402
+
+import catalogo  # noqa: E402
+import imagenes  # noqa: E402
+from catalogo import SearchIndex, SkuIndex, build_catalog_dataframe, fetch_wix_products, parse_wix_product  # noqa: E402
+from cotizaciones_db import QuoteSummaryStore, fetch_tracking_page, quote_summary  # noqa: E402
+from fake_firestore import FakeFirestore  # noqa: E402
+from pdf_cotizacion import generate_pdf_content  # noqa: E402
+
+CASES = ('catalogo_parseo', 'catalogo_descarga', 'sku_lookup', 'busqueda_rapida', 'pdf', 'seguimiento')
+ESTADOS = ["🔵 Creada", "✉️ Enviada", "✅ Aprobada", "❌ Rechazada", "🧾 Facturada"]
+WORDS = ["rompecabezas", "bloques", "didáctico", "madera", "números", "letras", "encajable", "tablero",
+         "memoria", "ábaco", "figuras", "colores", "animales", "granja", "ensartar", "lógico"]
+
+
+# --- Datos sintéticos ---
+
+def wix_products(size, image_base=None, seed=7):
+    """Productos con la forma de la respuesta de `products/query` de Wix."""
+    rng = random.Random(seed)
+    products = []
+    for i in range(size):
+        name = " ".join(rng.sample(WORDS, 3)).capitalize() + f" {i}"
+        image = f"{image_base}/{i % 50}.jpg" if image_base else f"https://static.wixstatic.com/media/{i}.jpg"
+        products.append({
+            'id': f"prod-{i:06d}",
+            'sku': f"{rng.choice(['', 'JYE-', 'MD', '00'])}{i:06d}",
+            'name': name,
+            'price': {'price': float(rng.randint(1000, 500000)), 'currency': 'COP'},
+            'stock': {'quantity': rng.choice([None, 0, rng.randint(1, 50)]), 'inStock': rng.random() > 0.1},
+            'lastUpdated': f"2025-01-{1 + i % 28:02d}T10:00:00.000Z",
+            'media': {'mainMedia': {'image': {'url': image}}} if rng.random() > 0.05 else {},
+        })
+    return products
+
+
+def synthetic_quote(n_items, image_base=None, seed=11):
+    rng = random.Random(seed)
+    items = {}
+    for i in range(n_items):
+        precio = float(rng.randint(1000, 200000))
+        cantidad = rng.randint(1, 20)
+        items[f"SKU{i}"] = {
+            'nombre': " ".join(rng.sample(WORDS, 4)).capitalize() + (" con un nombre largo que ocupa varias líneas" if i % 4 == 0 else ""),
+            'sku': f"SKU{i}", 'cantidad': cantidad, 'precio_unitario': precio, 'valor_total': precio * cantidad,
+            'imagen_url': f"{image_base}/{i % 50}.jpg" if image_base else None,
+        }
+    subtotal = sum(item['valor_total'] for item in items.values())
+    return {
+        'fecha': "15/01/2025", 'numero_cotizacion': "OV-0001", 'cliente_nombre': "Colegio de prueba",
+        'cliente_nit': "900123456-7", 'cliente_ciudad': "Bogotá", 'cliente_tel': "3000000000",
+        'cliente_email': "compras@example.com", 'cliente_dir': "Calle 1 # 2-3", 'forma_pago': "Contraentrega",
+        'vigencia': "5 DÍAS HÁBILES", 'items': items, 'subtotal': subtotal, 'flete_str': "MANUAL",
+        'flete_val': 20000, 'total_unidades': sum(item['cantidad'] for item in items.values()),
+        'total_cotizacion': subtotal + 20000,
+    }
+
+
+def seeded_firestore(n_quotes, tienda='Oviedo', seed=5):
+    db = FakeFirestore(listener_delay=0.0, seed=seed)
+    rng = random.Random(seed)
+    batch, base = db.batch(), datetime(2025, 1, 1, tzinfo=timezone.utc).timestamp()
+    for i in range(n_quotes):
+        quote = synthetic_quote(rng.randint(1, 15), seed=i)
+        quote.update({
+            'tienda': tienda, 'numero_cotizacion': f"OV-{i:05d}", 'cliente_nombre': f"Cliente {rng.randint(1, 400)}",
+            'estado': rng.choice(ESTADOS), 'comentarios': "",
+            'creado_en': datetime.fromtimestamp(base + i * 600, timezone.utc),
+        })
+        quote.update(quote_summary(quote))
+        batch.set(db.collection('cotizaciones').document(f"q{i:06d}"), quote)
+        if len(batch) == 500:
+            batch.commit()
+            batch = db.batch()
+    if len(batch):
+        batch.commit()
+    return db
+
+
+def jpeg_fixture(width=1200, height=900):
+    out = io.BytesIO()
+    Image.effect_noise((width, height), 60).convert('RGB').save(out, 'JPEG', quality=90)
+    return out.getvalue()
+
+
+class FixtureServer:
+    """Servidor HTTP local: `POST /products/query` pagina `products` y `GET /img/N.jpg` devuelve una imagen."""
+
+    def __init__(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, body, content_type):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                paging = payload['query']['paging']
+                page = server.products[paging['offset']:paging['offset'] + paging['limit']]
+                body = json.dumps({'products': page, 'totalResults': len(server.products)}).encode()
+                self._send(body, 'application/json')
+
+            def do_GET(self):
+                self._send(server.image, 'image/jpeg')
+
+        self.products = []
+        self.image = jpeg_fixture()
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self._httpd.server_port}"
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+# --- Medición ---
+
+def measure(fn, repeats, setup=None):
+    """Tiempos de `repeats` ejecuciones de fn(estado) y pico de memoria de una ejecución más."""
+    times = []
+    for _ in range(repeats):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        fn(state)
+        times.append(time.perf_counter() - start)
+    state = setup() if setup else None
+    tracemalloc.start()
+    try:
+        fn(state)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'segundos': {'mediana': statistics.median(times), 'min': min(times), 'max': max(times)},
+        'memoria_pico_mb': peak / 1024 / 1024,
+    }
+
+
+def result(caso, parametros, medicion, **extra):
+    return {'caso': caso, 'parametros': parametros, **medicion, **extra}
+
+
+# --- Casos ---
+
+def bench_catalog_parse(sizes, repeats, **_):
+    for size in sizes:
+        products = wix_products(size)
+        medicion = measure(lambda _: build_catalog_dataframe([parse_wix_product(p) for p in products]), repeats)
+        yield result('catalogo_parseo', {'productos': size}, medicion,
+                     productos_por_segundo=size / medicion['segundos']['mediana'])
+
+
+def bench_catalog_fetch(sizes, repeats, server, **_):
+    catalogo.WIX_PRODUCTS_URL = f"{server.base_url}/products/query"
+    for size in sizes:
+        server.products = wix_products(size)
+        medicion = measure(lambda _: fetch_wix_products({}, max_workers=4), repeats)
+        yield result('catalogo_descarga', {'productos': size, 'max_workers': 4}, medicion,
+                     paginas=-(-size // catalogo.PAGE_LIMIT))
+
+
+def bench_sku_lookup(sizes, repeats, lookups=5000, **_):
+    for size in sizes:
+        df = build_catalog_dataframe([parse_wix_product(p) for p in wix_products(size)])
+        rng = random.Random(3)
+        skus = [rng.choice(df['sku'].tolist()) for _ in range(lookups)]
+        # Variantes que el índice resuelve por forma normalizada (mayúsculas, espacios, sin ceros)
+        skus = [s.lower().lstrip('0') + " " if i % 3 == 0 else s for i, s in enumerate(skus)]
+        yield result('sku_lookup', {'productos': size, 'etapa': 'construccion'}, measure(lambda _: SkuIndex(df), repeats))
+        index = SkuIndex(df)
+        medicion = measure(lambda _: [index.lookup(s) for s in skus], repeats)
+        yield result('sku_lookup', {'productos': size, 'etapa': 'busquedas', 'busquedas': lookups}, medicion,
+                     microsegundos_por_busqueda=medicion['segundos']['mediana'] / lookups * 1e6)
+
+
+def bench_quick_search(sizes, repeats, queries=300, **_):
+    rng = random.Random(9)
+    terms = []
+    for _ in range(queries):
+        word = rng.choice(WORDS)
+        kind = rng.random()
+        # Palabras completas, prefijos mientras se escribe, errores de digitación y SKUs
+        if kind < 0.3:
+            terms.append(word)
+        elif kind < 0.6:
+            terms.append(word[:rng.randint(2, len(word))])
+        elif kind < 0.85:
+            i = rng.randrange(len(word))
+            terms.append(word[:i] + word[i + 1:] + " " + rng.choice(WORDS)[:4])
+        else:
+            terms.append(f"{rng.randint(0, 999):03d}")
+    for size in sizes:
+        df = build_catalog_dataframe([parse_wix_product(p) for p in wix_products(size)])
+        yield result('busqueda_rapida', {'productos': size, 'etapa': 'construccion'}, measure(lambda _: SearchIndex(df), repeats))
+        index = SearchIndex(df)
+        medicion = measure(lambda _: [index.search(t, limit=10) for t in terms], repeats)
+        yield result('busqueda_rapida', {'productos': size, 'etapa': 'consultas', 'consultas': queries}, medicion,
+                     milisegundos_por_consulta=medicion['segundos']['mediana'] / queries * 1e3)
+
+
+def bench_pdf(item_counts, repeats, server, **_):
+    cache_dir = tempfile.mkdtemp(prefix="bench_imagenes_")
+    for n_items in item_counts:
+        for with_images in (False, True):
+            quote = synthetic_quote(n_items, image_base=f"{server.base_url}/img" if with_images else None)
+
+            def cold_cache():
+                # Caché de imágenes vacía: cada ejecución descarga y normaliza como la primera vez
+                imagenes._default_cache = imagenes.ImageCache(tempfile.mkdtemp(dir=cache_dir))
+                imagenes._normalized.clear()
+
+            parametros = {'items': n_items, 'imagenes': with_images}
+            pdf_bytes = generate_pdf_content(quote)
+            if with_images:
+                yield result('pdf', {**parametros, 'cache': 'fria'}, measure(lambda _: generate_pdf_content(quote), repeats, setup=cold_cache),
+                             pdf_kb=len(pdf_bytes) / 1024)
+            medicion = measure(lambda _: generate_pdf_content(quote), repeats)
+            yield result('pdf', {**parametros, 'cache': 'caliente'} if with_images else parametros, medicion,
+                         pdf_kb=len(pdf_bytes) / 1024)
+
+
+def bench_tracking(quote_counts, repeats, **_):
+    for n_quotes in quote_counts:
+        db = seeded_firestore(n_quotes)
+        yield result('seguimiento', {'cotizaciones': n_quotes, 'etapa': 'pagina_firestore'},
+                     measure(lambda _: fetch_tracking_page(db, 'Oviedo'), repeats))
+
+        def load_store(_):
+            store = QuoteSummaryStore(db, 'Oviedo')
+            store.start()
+            store.wait_ready(timeout=120)
+            store.close()
+        yield result('seguimiento', {'cotizaciones': n_quotes, 'etapa': 'carga_almacen'}, measure(load_store, repeats))
+
+        store = QuoteSummaryStore(db, 'Oviedo')
+        store.start()
+        store.wait_ready(timeout=120)
+        filtros = [{}, {'estados': ("✅ Aprobada",)}, {'cliente': "cliente 12"}]
+        medicion = measure(lambda _: [store.page(**f) for f in filtros], repeats)
+        store.close()
+        yield result('seguimiento', {'cotizaciones': n_quotes, 'etapa': 'paginas_almacen', 'consultas': len(filtros)}, medicion)
+
+
+RUNNERS = {
+    'catalogo_parseo': (bench_catalog_parse, 'catalog_sizes'),
+    'catalogo_descarga': (bench_catalog_fetch, 'catalog_sizes'),
+    'sku_lookup': (bench_sku_lookup, 'catalog_sizes'),
+    'busqueda_rapida': (bench_quick_search, 'catalog_sizes'),
+    'pdf': (bench_pdf, 'quote_items'),
+    'seguimiento': (bench_tracking, 'quotes'),
+}
+
+
+# --- Salida ---
+
+def result_key(entry):
+    return entry['caso'], json.dumps(entry['parametros'], sort_keys=True)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    previous = {result_key(entry): entry for entry in (baseline or {}).get('resultados', [])}
+    print(f"{'caso':<18} {'parámetros':<58} {'mediana (s)':>12} {'pico (MB)':>10} {'vs base':>8}")
+    for entry in results:
+        median = entry['segundos']['mediana']
+        base = previous.get(result_key(entry))
+        ratio = f"{median / base['segundos']['mediana']:.2f}x" if base and base['segundos']['mediana'] else ""
+        params = ", ".join(f"{k}={v}" for k, v in entry['parametros'].items())
+        print(f"{entry['caso']:<18} {params:<58} {median:>12.4f} {entry['memoria_pico_mb']:>10.1f} {ratio:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--only', nargs='+', choices=CASES, default=list(CASES))
+    parser.add_argument('--catalog-sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--quote-items', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--quotes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--quick', action='store_true', help="tamaños pequeños para una corrida rápida")
+    parser.add_argument('--output', help="archivo JSON de resultados (por defecto benchmarks/resultados/<fecha>.json)")
+    parser.add_argument('--compare', help="JSON de una corrida anterior para mostrar la razón de tiempos")
+    args = parser.parse_args()
+    if args.quick:
+        args.catalog_sizes, args.quote_items, args.quotes, args.repeats = [1000], [10, 100], [1000], 2
+
+    sizes = {'catalog_sizes': args.catalog_sizes, 'quote_items': args.quote_items, 'quotes': args.quotes}
+    server = FixtureServer()
+    results = []
+    try:
+        for case in args.only:
+            runner, size_arg = RUNNERS[case]
+            for entry in runner(sizes[size_arg], args.repeats, server=server):
+                results.append(entry)
+                print(f"  {entry['caso']} {entry['parametros']}: {entry['segundos']['mediana']:.4f} s", file=sys.stderr)
+    finally:
+        server.close()
+
+    report = {
+        'meta': {
+            'fecha': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count(),
+            'repeticiones': args.repeats,
+            'argumentos': sys.argv[1:],
+        },
+        'resultados': results,
+    }
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'resultados', f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    print(f"\nResultados en {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""Prueba del cliente HTTP compartido contra un servidor local que falla a propósito.
+
+El servidor imita `products/query` de Wix y un CDN de imágenes. Una fracción de
+las peticiones responde 429 con `Retry-After`, 503 sin él o corta la conexión
+sin responder. Se verifica que el catálogo llegue completo y en orden y que
+todas las imágenes se descarguen. También se mide cuántas conexiones TCP se
+abrieron (keep-alive), el máximo de peticiones simultáneas por host y la tasa
+real cuando hay límite por segundo.
+
+Uso:
+    python benchmarks/stress_http_client.py
+    python benchmarks/stress_http_client.py --products 5000 --failure-rate 0.3 --rate 50
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import catalogo  # noqa: E402
+import cliente_http  # noqa: E402
+import imagenes  # noqa: E402
+from catalogo import fetch_wix_products  # noqa: E402
+from cliente_http import HttpClient  # noqa: E402
+
+
+class FlakyServer:
+    """Servidor HTTP/1.1 local que falla en `failure_rate` de las peticiones, solo al primer intento."""
+
+    def __init__(self, products, failure_rate, seed=1):
+        server = self
+        self.products = products
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.failures = {'429': 0, '503': 0, 'corte': 0}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.request_times = []
+        self._failed_once = set()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                with server.lock:
+                    server.connections += 1
+
+            def _failure(self, key):
+                with server.lock:
+                    server.requests += 1
+                    server.request_times.append(time.monotonic())
+                    if key in server._failed_once or server.random.random() >= server.failure_rate:
+                        return None
+                    server._failed_once.add(key)
+                    mode = server.random.choice(['429', '503', 'corte'])
+                    server.failures[mode] += 1
+                    return mode
+
+            def _respond(self, key, status, body, content_type):
+                with server.lock:
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    time.sleep(0.002)
+                    mode = self._failure(key)
+                    if mode == 'corte':
+                        self.close_connection = True
+                        self.connection.shutdown(2)
+                        return
+                    if mode:
+                        status, body, content_type = int(mode), b'{}', 'application/json'
+                    self.send_response(status)
+                    if mode == '429':
+                        self.send_header('Retry-After', '0.2')
+                    self.send_header('Content-Type', content_type)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with server.lock:
+                        server.in_flight -= 1
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                paging = payload['query']['paging']
+                page = server.products[paging['offset']:paging['offset'] + paging['limit']]
+                body = json.dumps({'products': page, 'totalResults': len(server.products)}).encode()
+                self._respond(('page', paging['offset'], paging['limit']), 200, body, 'application/json')
+
+            def do_GET(self):
+                self._respond(('img', self.path), 200, self.path.encode() * 200, 'image/jpeg')
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self._httpd.server_port}"
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+
+    def reset_counters(self):
+        with self.lock:
+            self.connections = self.requests = self.max_in_flight = 0
+            self.request_times = []
+            self.failures = dict.fromkeys(self.failures, 0)
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=3000)
+    parser.add_argument('--images', type=int, default=200)
+    parser.add_argument('--failure-rate', type=float, default=0.2)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--connections', type=int, default=4, help="conexiones por host del cliente")
+    parser.add_argument('--rate', type=float, default=None, help="peticiones por segundo al host de Wix")
+    args = parser.parse_args()
+
+    products = [{'id': f"p{i}", 'sku': f"SKU{i:06d}", 'name': f"Producto {i}", 'price': {'price': 1000.0 + i},
+                 'stock': {'quantity': i % 7}, 'media': {}} for i in range(args.products)]
+    server = FlakyServer(products, args.failure_rate)
+    client = HttpClient(connections_per_host=args.connections, base_delay=0.05)
+    catalogo.WIX_PRODUCTS_URL = f"{server.base_url}/products/query"
+    ok = True
+    try:
+        start = time.perf_counter()
+        rows = fetch_wix_products({}, max_workers=args.workers, max_requests_per_second=args.rate, client=client)
+        elapsed = time.perf_counter() - start
+        complete = [row['sku'] for row in rows] == [p['sku'] for p in products]
+        ok &= complete
+        span = server.request_times[-1] - server.request_times[0] if len(server.request_times) > 1 else 0
+        print(f"Catálogo: {len(rows)}/{len(products)} productos, {'completo y en orden' if complete else 'INCOMPLETO'}, {elapsed:.2f} s")
+        print(f"  peticiones {server.requests}, fallos inyectados {server.failures}, conexiones TCP {server.connections}, "
+              f"simultáneas máx. {server.max_in_flight} (tope {args.connections})")
+        if args.rate and span:
+            print(f"  tasa observada {(server.requests - 1) / span:.1f} peticiones/s (límite {args.rate})")
+        ok &= server.max_in_flight <= args.connections
+
+        server.reset_counters()
+        urls = [f"{server.base_url}/img/{i}.jpg" for i in range(args.images)]
+        # fetch_image usa el cliente compartido del proceso: aquí, el de la prueba
+        cliente_http._default_client = client
+        start = time.perf_counter()
+        downloaded = imagenes.prefetch_images(urls, cache=imagenes.ImageCache(tempfile.mkdtemp()), max_workers=args.workers)
+        elapsed = time.perf_counter() - start
+        good = sum(1 for url in urls if downloaded.get(url) == url.split(server.base_url)[1].encode() * 200)
+        ok &= good == len(urls)
+        print(f"Imágenes: {good}/{len(urls)} descargadas, {elapsed:.2f} s, peticiones {server.requests}, "
+              f"fallos inyectados {server.failures}, conexiones TCP {server.connections}")
+    finally:
+        client.close()
+        server.close()
+    print("OK" if ok else "FALLÓ")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Prueba de concurrencia del reparto de números de cotización contra el Firestore en memoria.
+
+Varias "instancias de la app" (un `QuoteNumberAllocator` cada una) comparten el
+contador y muchos hilos piden números de ambas tiendas a la vez. Se verifica que
+no haya números repetidos y se compara con bloques de 1, que equivale a la
+transacción por cotización que había antes.
+
+Uso:
+    python benchmarks/stress_quote_numbers.py
+    python benchmarks/stress_quote_numbers.py --threads 64 --per-thread 50 --instances 4 --latency 0.01
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cotizaciones_db  # noqa: E402
+from cotizaciones_db import QuoteNumberAllocator, format_quote_number  # noqa: E402
+from fake_firestore import FakeFirestore  # noqa: E402
+
+TIENDAS = ["Oviedo", "Barranquilla"]
+
+
+def hammer(block_size, threads, per_thread, instances, latency):
+    db = FakeFirestore(latency=latency)
+    db.collection('counters').document('cotizaciones').set({'oviedo': 120, 'barranquilla': 7})
+    allocators = [QuoteNumberAllocator(db, block_size=block_size) for _ in range(instances)]
+    numbers, errors = [], []
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker(i):
+        allocator = allocators[i % instances]
+        tienda = TIENDAS[i % len(TIENDAS)]
+        barrier.wait()
+        for _ in range(per_thread):
+            try:
+                number = format_quote_number(tienda, allocator.next_number(tienda))
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+                continue
+            with lock:
+                numbers.append(number)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    duplicates = [n for n, count in Counter(numbers).items() if count > 1]
+    assert not duplicates, f"números repetidos: {duplicates[:10]}"
+    assert not errors, f"{len(errors)} errores, el primero: {errors[0]!r}"
+    assert min(n for n in numbers if n.startswith("OV")) == "OV-0121", "la numeración no continúa el contador"
+    conflicts = sum(a.stats['conflictos'] for a in allocators)
+    reservations = sum(a.stats['reservas'] for a in allocators)
+    return len(numbers), elapsed, reservations, conflicts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--per-thread', type=int, default=25)
+    parser.add_argument('--instances', type=int, default=3, help="asignadores que comparten el contador")
+    parser.add_argument('--blocks', type=int, nargs='+', default=[1, 20])
+    parser.add_argument('--latency', type=float, default=0.005, help="segundos por RPC")
+    args = parser.parse_args()
+    cotizaciones_db.RETRY_BASE_DELAY = args.latency
+
+    print(f"{'bloque':>7} {'números':>8} {'tiempo (s)':>11} {'números/s':>10} {'reservas':>9} {'conflictos':>11}")
+    for block_size in args.blocks:
+        total, elapsed, reservations, conflicts = hammer(
+            block_size, args.threads, args.per_thread, args.instances, args.latency
+        )
+        print(f"{block_size:>7} {total:>8} {elapsed:>11.2f} {total / elapsed:>10.0f} {reservations:>9} {conflicts:>11}")
+    print("Sin números repetidos.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""Almacén de imágenes subidas a mano, direccionado por el sha256 de su contenido.
+
+Cada imagen se guarda una sola vez y los ítems de la cotización solo llevan su
+hash (`imagen_hash`). El almacén es intercambiable: `LocalBlobStore` escribe en
+disco y `FirestoreBlobStore` usa una colección de Firestore (un documento por
+imagen); los que están en red se envuelven en `CachedBlobStore`.
+
+Solo un almacén durable (`durable`), que sobrevive a reinicios y comparten
+todas las instancias de la app, puede recibir las imágenes de las cotizaciones:
+el disco local lo es solo si la configuración lo declara (un volumen
+persistente y compartido).
+"""
+import base64
+import hashlib
+import os
+import threading
+
+from cache import IMAGENES, get_cache
+from imagenes import get_image_cache
+
+DEFAULT_BLOB_DIR = "blobs"
+BLOB_COLLECTION = 'blobs'
+# Un documento de Firestore admite 1 MiB; se deja margen para el resto de campos
+MAX_FIRESTORE_BLOB_BYTES = 1000 * 1000
+
+
+def blob_key(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class LocalBlobStore:
+    """Blobs como archivos `directorio/ab/abcdef...`; la escritura es atómica."""
+
+    def __init__(self, directory=DEFAULT_BLOB_DIR, durable=False):
+        self.directory = directory
+        self.durable = durable
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def put(self, data):
+        key = blob_key(data)
+        path = self._path(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return key
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def get_many(self, keys):
+        return {key: self.get(key) for key in dict.fromkeys(keys)}
+
+
+class FirestoreBlobStore:
+    """Un documento por blob en la colección `blobs`, con los bytes en el campo `data`."""
+
+    durable = True
+
+    def __init__(self, db, collection=BLOB_COLLECTION):
+        self.db = db
+        self.collection = collection
+
+    def put(self, data):
+        if len(data) > MAX_FIRESTORE_BLOB_BYTES:
+            raise ValueError(f"La imagen pesa {len(data) // 1024} KB; el máximo es {MAX_FIRESTORE_BLOB_BYTES // 1024} KB.")
+        key = blob_key(data)
+        ref = self.db.collection(self.collection).document(key)
+        # Mismo contenido, mismo documento: reescribirlo no cambia nada
+        ref.set({'data': data, 'bytes': len(data)})
+        return key
+
+    def get(self, key):
+        return self.get_many([key])[key]
+
+    def get_many(self, keys):
+        keys = list(dict.fromkeys(keys))
+        found = dict.fromkeys(keys)
+        if keys:
+            refs = [self.db.collection(self.collection).document(key) for key in keys]
+            for snap in self.db.get_all(refs):
+                if snap.exists:
+                    found[snap.id] = bytes(snap.get('data'))
+        return found
+
+
+class CachedBlobStore:
+    """Lecturas de otro almacén a través del espacio de caché de imágenes y de la caché en disco.
+
+    En memoria se usa el espacio `imagenes` del registro de cachés del proceso
+    (su tope y sus estadísticas). Como el contenido de un hash no cambia, lo
+    cacheado nunca queda desactualizado.
+    """
+
+    def __init__(self, backend, cache=None, memory=None):
+        self.backend = backend
+        self.cache = cache or get_image_cache()
+        self.memory = memory if memory is not None else get_cache().namespace(IMAGENES)
+
+    @property
+    def durable(self):
+        return self.backend.durable
+
+    @staticmethod
+    def _cache_key(key):
+        return f"blob:{key}"
+
+    def put(self, data):
+        key = self.backend.put(data)
+        self.cache.put(self._cache_key(key), data)
+        self.memory.set(self._cache_key(key), data)
+        return key
+
+    def get(self, key):
+        return self.get_many([key])[key]
+
+    def get_many(self, keys):
+        result, missing = {}, []
+        for key in dict.fromkeys(keys):
+            data = self.memory.get(self._cache_key(key))
+            if data is None:
+                data = self.cache.get(self._cache_key(key))
+                if data is not None:
+                    self.memory.set(self._cache_key(key), data)
+            if data is None:
+                missing.append(key)
+            else:
+                result[key] = data
+        if missing:
+            for key, data in self.backend.get_many(missing).items():
+                result[key] = data
+                if data is not None:
+                    self.cache.put(self._cache_key(key), data)
+                    self.memory.set(self._cache_key(key), data)
+        return result
+
+
+def make_blob_store(config=None, db=None):
+    """Crea el almacén según la configuración (`backend` = "local" o "firestore").
+
+    Sin `backend` se usa Firestore si hay conexión y, si no, el disco local. El
+    local solo es durable con `durable = true` en la configuración.
+    """
+    config = dict(config or {})
+    backend = config.get('backend', 'firestore' if db is not None else 'local')
+    if backend == 'local':
+        return LocalBlobStore(config.get('directory', DEFAULT_BLOB_DIR), bool(config.get('durable', False)))
+    if backend == 'firestore':
+        if db is None:
+            raise ValueError("El almacén de imágenes en Firestore necesita una conexión a la base de datos.")
+        return CachedBlobStore(FirestoreBlobStore(db, config.get('collection', BLOB_COLLECTION)))
+    raise ValueError(f"Almacén de imágenes desconocido: {backend}")
+
+
+def require_durable(store):
+    """Lanza ValueError si `store` no conserva las imágenes tras un reinicio o entre instancias."""
+    if not getattr(store, 'durable', False):
+        raise ValueError("El almacén de imágenes configurado no es durable (disco local de esta instancia); "
+                         "usa `backend = \"firestore\"` o declara `durable = true` en la sección `blobs`.")
+
+
+def externalize_images(items, store):
+    """Copia de los ítems con las imágenes `imagen_base64` movidas al almacén.
+
+    Devuelve (ítems, cuántas imágenes se movieron); los ítems sin imagen en línea
+    quedan iguales. El almacén debe ser durable (ValueError si no).
+    """
+    require_durable(store)
+    moved = 0
+    result = {}
+    for sku, item in (items or {}).items():
+        if item.get('imagen_base64'):
+            item = {k: v for k, v in item.items() if k != 'imagen_base64'}
+            item['imagen_hash'] = store.put(base64.b64decode(items[sku]['imagen_base64']))
+            moved += 1
+        result[sku] = item
+    return result, moved
@@ -0,0 +1,181 @@
+"""Caché en memoria del proceso, separada en espacios con nombre e invalidación dirigida.
+
+Cada espacio (catálogo, resúmenes de cotizaciones, PDFs, imágenes) tiene su
+propio tope de entradas y tiempo de vida, y cuenta aciertos y fallos. Las
+entradas pueden llevar etiquetas (`tienda`, `doc`) para invalidar solo lo que
+depende de una tienda o de una cotización, en lugar de vaciarlo todo.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+CATALOGO = 'catalogo'
+COTIZACIONES = 'cotizaciones'
+PDFS = 'pdfs'
+IMAGENES = 'imagenes'
+# Límites de cada espacio: entradas máximas (LRU) y segundos de vida
+NAMESPACE_LIMITS = {
+    CATALOGO: {'max_entries': 4},
+    # Las etiquetas de seguimiento van por combinación de filtros: sin tope crecerían sin fin
+    COTIZACIONES: {'max_entries': 256, 'ttl': 300},
+    PDFS: {'max_entries': 200},
+    IMAGENES: {'max_entries': 256},
+}
+
+_MISSING = object()
+
+
+def tienda_tag(tienda):
+    return ('tienda', tienda)
+
+
+def doc_tag(doc_id):
+    return ('doc', doc_id)
+
+
+class CacheNamespace:
+    """Entradas LRU con tiempo de vida opcional y etiquetas para invalidar por grupos.
+
+    Cada `set` descarta además las entradas vencidas, aunque nadie vuelva a leerlas.
+    """
+
+    def __init__(self, name, max_entries=None, ttl=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _drop(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def _expired(self, entry, now):
+        return self.ttl is not None and now - entry[1] > self.ttl
+
+    def _sweep(self, now):
+        expired = [key for key, entry in self._entries.items() if self._expired(entry, now)]
+        for key in expired:
+            self._drop(key)
+        self.evictions += len(expired)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, time.monotonic()):
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, tags=()):
+        tags = frozenset(tags)
+        with self._lock:
+            now = time.monotonic()
+            if key in self._entries:
+                self._drop(key)
+            if self.ttl is not None:
+                self._sweep(now)
+            self._entries[key] = (value, now, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while self.max_entries is not None and len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+        return value
+
+    def get_or_compute(self, key, compute, tags=()):
+        """Valor cacheado o `compute()`; el cálculo corre fuera del candado."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = self.set(key, compute(), tags)
+        return value
+
+    def invalidate(self, key=_MISSING, tag=None):
+        """Borra una clave, las entradas con una etiqueta o, sin argumentos, todo el espacio."""
+        with self._lock:
+            if key is not _MISSING:
+                keys = [key] if key in self._entries else []
+            elif tag is not None:
+                keys = list(self._tags.get(tag, ()))
+            else:
+                keys = list(self._entries)
+            for k in keys:
+                self._drop(k)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'espacio': self.name,
+                'entradas': len(self._entries),
+                'aciertos': self.hits,
+                'fallos': self.misses,
+                'tasa_aciertos': self.hits / lookups if lookups else None,
+                'desalojos': self.evictions,
+                'invalidaciones': self.invalidations,
+            }
+
+
+class CacheRegistry:
+    """Los espacios de caché del proceso, por nombre."""
+
+    def __init__(self, limits=NAMESPACE_LIMITS):
+        self._namespaces = {name: CacheNamespace(name, **options) for name, options in limits.items()}
+        self._lock = threading.Lock()
+
+    def namespace(self, name, max_entries=None, ttl=None):
+        """El espacio `name`; uno nuevo se crea con estos límites la primera vez que se pide."""
+        with self._lock:
+            namespace = self._namespaces.get(name)
+            if namespace is None:
+                namespace = self._namespaces[name] = CacheNamespace(name, max_entries, ttl)
+            return namespace
+
+    def invalidate(self, namespace=None, tienda=None, doc_id=None):
+        """Invalida un espacio entero, o en uno o todos los espacios lo de una tienda o un documento."""
+        with self._lock:
+            targets = [self._namespaces[namespace]] if namespace in self._namespaces else (
+                [] if namespace is not None else list(self._namespaces.values())
+            )
+        removed = 0
+        for target in targets:
+            if tienda is None and doc_id is None:
+                removed += target.invalidate()
+            if tienda is not None:
+                removed += target.invalidate(tag=tienda_tag(tienda))
+            if doc_id is not None:
+                removed += target.invalidate(tag=doc_tag(doc_id))
+        return removed
+
+    def stats(self):
+        with self._lock:
+            namespaces = list(self._namespaces.values())
+        return [namespace.stats() for namespace in namespaces]
+
+
+_registry = CacheRegistry()
+
+
+def get_cache():
+    """Registro de cachés compartido por el proceso."""
+    return _registry
@@ -0,0 +1,540 @@
+"""Descarga y procesamiento del catálogo de productos de Wix."""
+import bisect
+import heapq
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc
+import requests
+
+import metricas
+from cache import CATALOGO, CacheNamespace
+from cliente_http import HttpClient, get_http_client
+
+WIX_PRODUCTS_URL = "https://www.wixapis.com/stores/v1/products/query"
+PAGE_LIMIT = 100
+PLACEHOLDER_IMAGE_URL = "https://placehold.co/100x100/EEE/333?text=S/I"
+CATALOG_COLUMNS = ['sku', 'nombre', 'precio_iva_incluido', 'imagen_url', 'inventory']
+SNAPSHOT_COLUMNS = ['id'] + CATALOG_COLUMNS + ['last_updated']
+
+
+class WixAPIError(Exception):
+    """Respuesta no exitosa del API de Wix.
+
+    `partial` guarda los productos de las páginas contiguas leídas antes del fallo.
+    """
+
+    def __init__(self, message, partial=None):
+        super().__init__(message)
+        self.partial = partial or []
+
+
+def parse_wix_product(p):
+    """Convierte un producto del API de Wix en una fila del catálogo."""
+    sku = p.get('sku', '')
+    name = p.get('name', 'Sin Nombre')
+
+    # Obtener precio estándar
+    price = p.get('price', {}).get('price', 0)
+
+    # Inventario
+    stock_info = p.get('stock', {})
+    inventory = stock_info.get('quantity', 0)
+    # Si es un producto "In Stock" pero sin tracking numérico, asumimos stock alto
+    if inventory is None and stock_info.get('inStock', False):
+        inventory = 999
+
+    # Imagen
+    image_url = PLACEHOLDER_IMAGE_URL
+    media = p.get('media', {})
+    if media and media.get('mainMedia'):
+        full_url = media['mainMedia'].get('image', {}).get('url', '')
+        if full_url:
+            image_url = full_url
+
+    return {
+        'sku': str(sku),
+        'nombre': name,
+        'precio_iva_incluido': float(price),
+        'imagen_url': image_url,
+        'inventory': int(inventory or 0)
+    }
+
+
+def normalize_sku(sku):
+    """Forma canónica de un SKU: sin espacios, en minúsculas y sin ceros a la izquierda si es numérico."""
+    s = str(sku).strip().casefold()
+    if s.isdigit():
+        s = s.lstrip('0') or '0'
+    return s
+
+
+class SkuIndex:
+    """Índice hash SKU -> posición de fila, construido una vez por versión del catálogo.
+
+    Primero se busca el SKU tal cual (mismo resultado que la comparación exacta de
+    siempre) y, si no aparece, por su forma normalizada. Ante SKUs repetidos gana
+    la primera fila, como hacía `iloc[0]`.
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self._exact = {}
+        self._normalized = {}
+        for pos, sku in enumerate(df['sku'].tolist()):
+            self._exact.setdefault(sku, pos)
+            self._normalized.setdefault(normalize_sku(sku), pos)
+
+    def __len__(self):
+        return len(self._normalized)
+
+    def position(self, sku):
+        if sku is None:
+            return None
+        pos = self._exact.get(sku)
+        if pos is None:
+            pos = self._normalized.get(normalize_sku(sku))
+        return pos
+
+    def lookup(self, sku):
+        """Fila del catálogo (Series) para `sku`, o None si no existe."""
+        pos = self.position(sku)
+        return None if pos is None else self.df.iloc[pos]
+
+    def positions(self, skus):
+        """Posición de fila de cada SKU de una Series (NaN si no existe), en una sola pasada."""
+        skus = skus.astype(str)
+        exact = skus.map(self._exact)
+        return exact.fillna(skus.map(normalize_sku).map(self._normalized))
+
+
+def fold_text(text):
+    """Texto sin tildes y en minúsculas ("Niño" -> "nino")."""
+    decomposed = unicodedata.normalize('NFKD', str(text))
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+
+
+def tokenize(text):
+    return re.findall(r'[a-z0-9]+', fold_text(text))
+
+
+def _trigrams(token):
+    padded = f" {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """Índice invertido sobre nombre y SKU para el buscador rápido.
+
+    Cada consulta se tokeniza igual que el catálogo (sin tildes ni mayúsculas) y
+    cada término se compara por coincidencia exacta, por prefijo (mientras se
+    escribe) y por trigramas para tolerar errores de digitación. Se devuelven las
+    posiciones de las `limit` mejores filas.
+    """
+
+    EXACT, PREFIX = 3.0, 2.0
+    MAX_PREFIX_TOKENS = 500
+    MIN_FUZZY_SIMILARITY = 0.4
+
+    def __init__(self, df):
+        self.df = df
+        postings = defaultdict(set)
+        self._skus = {}
+        for pos, (nombre, sku) in enumerate(zip(df['nombre'].tolist(), df['sku'].tolist())):
+            for token in tokenize(nombre) + tokenize(sku):
+                postings[token].add(pos)
+            self._skus.setdefault(normalize_sku(sku), pos)
+        self._postings = dict(postings)
+        self._tokens = sorted(self._postings)
+        trigram_tokens = defaultdict(list)
+        for token in self._tokens:
+            for gram in _trigrams(token):
+                trigram_tokens[gram].append(token)
+        self._trigram_tokens = dict(trigram_tokens)
+
+    def _candidate_tokens(self, term):
+        """Tokens del índice que pueden corresponder a `term`, con su peso."""
+        candidates = {}
+        if term in self._postings:
+            candidates[term] = self.EXACT
+        start = bisect.bisect_left(self._tokens, term)
+        for token in self._tokens[start:start + self.MAX_PREFIX_TOKENS]:
+            if not token.startswith(term):
+                break
+            candidates.setdefault(token, self.PREFIX)
+        if len(term) >= 3 and not candidates:
+            grams = _trigrams(term)
+            shared = defaultdict(int)
+            for gram in grams:
+                for token in self._trigram_tokens.get(gram, ()):
+                    shared[token] += 1
+            for token, count in shared.items():
+                similarity = count / (len(grams) + len(_trigrams(token)) - count)
+                if similarity >= self.MIN_FUZZY_SIMILARITY:
+                    candidates[token] = similarity
+        return candidates
+
+    def search(self, query, limit=10):
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        scores = defaultdict(float)
+        matched = defaultdict(int)
+        for term in terms:
+            best = {}
+            for token, weight in self._candidate_tokens(term).items():
+                for pos in self._postings[token]:
+                    if weight > best.get(pos, 0):
+                        best[pos] = weight
+            for pos, weight in best.items():
+                scores[pos] += weight
+                matched[pos] += 1
+        # Un SKU idéntico a la consulta va primero
+        sku_pos = self._skus.get(normalize_sku(query))
+        if sku_pos is not None:
+            scores[sku_pos] += self.EXACT * len(terms)
+            matched[sku_pos] = len(terms)
+        return heapq.nlargest(limit, scores, key=lambda pos: (matched[pos], scores[pos], -pos))
+
+
+def build_catalog_dataframe(products):
+    """Arma el DataFrame del catálogo a partir de las filas ya procesadas."""
+    if not products:
+        return None
+    df = pd.DataFrame(products)
+    df.dropna(subset=['sku', 'nombre'], inplace=True)
+    return df
+
+
+def catalog_frame(data):
+    """DataFrame del catálogo a partir de la copia con metadatos (indexada por id), sin pasar por dicts."""
+    if data is None or data.empty:
+        return None
+    return data[CATALOG_COLUMNS].reset_index(drop=True).dropna(subset=['sku', 'nombre'])
+
+
+def fetch_wix_page(client, headers, offset, limit=PAGE_LIMIT, query_filter=None):
+    """Descarga una página de `products/query` y devuelve el JSON de la respuesta.
+
+    Los 429, 5xx y cortes de conexión los reintenta `client`; lo que siga
+    fallando se lanza como `WixAPIError` para que el paginado lo trate igual.
+    """
+    payload = {
+        "includeHiddenProducts": True,
+        "query": {
+            "paging": {
+                "limit": limit,
+                "offset": offset
+            }
+        }
+    }
+    if query_filter:
+        payload["query"]["filter"] = json.dumps(query_filter)
+    try:
+        response = client.post(WIX_PRODUCTS_URL, headers=headers, json=payload, timeout=20)
+    except requests.RequestException as e:
+        raise WixAPIError(f"Sin respuesta de Wix en el offset {offset}: {e}") from e
+    metricas.count('wix_paginas', estado=response.status_code)
+    metricas.count('wix_bytes', len(response.content))
+    if response.status_code != 200:
+        raise WixAPIError(f"{response.status_code} - {response.text}")
+    return response.json()
+
+
+def fetch_wix_products(headers, max_workers=4, max_requests_per_second=None, on_progress=None,
+                       query_filter=None, parse=parse_wix_product, client=None):
+    """Descarga todos los productos de Wix, en el mismo orden que el paginado secuencial.
+
+    La primera página trae `totalResults`; el resto de offsets se piden en paralelo
+    con un pool acotado a `max_workers` y se unen ordenados por offset. Si Wix no
+    informa el total, o el catálogo creció mientras se descargaba, se sigue
+    página a página hasta encontrar una incompleta. `query_filter` limita la
+    consulta (p. ej. por `lastUpdated`) y `parse` convierte cada producto.
+    Las peticiones salen por `client` (por defecto el cliente HTTP compartido),
+    con `max_requests_per_second` como límite del host de Wix.
+    """
+    client = client or get_http_client()
+    if max_requests_per_second:
+        client.set_rate(HttpClient.host(WIX_PRODUCTS_URL), max_requests_per_second)
+    products = []
+
+    def add_page(items, total_results):
+        products.extend(parse(p) for p in items)
+        if on_progress and total_results > 0:
+            on_progress(len(products), total_results)
+
+    try:
+        data = fetch_wix_page(client, headers, 0, query_filter=query_filter)
+        items = data.get('products', [])
+        total_results = data.get('totalResults', 0)
+        if not items:
+            return products
+        add_page(items, total_results)
+        if len(items) < PAGE_LIMIT:
+            return products
+
+        offset = PAGE_LIMIT
+        pending_offsets = list(range(PAGE_LIMIT, total_results, PAGE_LIMIT))
+        if pending_offsets and max_workers > 1:
+            pages = {}
+            failure = None
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    executor.submit(fetch_wix_page, client, headers, page_offset,
+                                    query_filter=query_filter): page_offset
+                    for page_offset in pending_offsets
+                }
+                for future in as_completed(futures):
+                    page_offset = futures[future]
+                    try:
+                        pages[page_offset] = future.result().get('products', [])
+                    except WixAPIError as e:
+                        failure = failure or e
+                        for f in futures:
+                            f.cancel()
+                        continue
+                    if on_progress and total_results > 0:
+                        leidos = len(products) + sum(len(p) for p in pages.values())
+                        on_progress(leidos, total_results)
+
+            # Unir en orden de offset, deteniéndose donde lo haría el recorrido secuencial
+            for page_offset in pending_offsets:
+                if page_offset not in pages:
+                    failure = failure or WixAPIError(f"Página con offset {page_offset} no descargada")
+                    raise WixAPIError(str(failure), partial=products)
+                page_items = pages[page_offset]
+                if not page_items:
+                    return products
+                products.extend(parse(p) for p in page_items)
+                if len(page_items) < PAGE_LIMIT:
+                    return products
+            offset = pending_offsets[-1] + PAGE_LIMIT
+
+        # Recorrido secuencial: sin total conocido o con páginas nuevas al final
+        while True:
+            data = fetch_wix_page(client, headers, offset, query_filter=query_filter)
+            items = data.get('products', [])
+            if not items:
+                break
+            add_page(items, data.get('totalResults', 0))
+            if len(items) < PAGE_LIMIT:
+                break
+            offset += PAGE_LIMIT
+        return products
+    except WixAPIError as e:
+        if not e.partial:
+            e.partial = products
+        raise
+
+
+def fetch_wix_total(headers):
+    """Número de productos que Wix reporta hoy para el catálogo completo."""
+    return fetch_wix_page(get_http_client(), headers, 0, limit=1).get('totalResults', 0)
+
+
+def save_catalog_snapshot(path, data, high_water_mark=None, synced_at=None):
+    """Escribe el catálogo en `path` como archivo Arrow IPC (reemplazo atómico)."""
+    table = pa.Table.from_pandas(data.reset_index()[SNAPSHOT_COLUMNS], preserve_index=False)
+    metadata = {
+        b'high_water_mark': (high_water_mark or '').encode(),
+        b'synced_at': str(synced_at or '').encode()
+    }
+    table = table.replace_schema_metadata(metadata)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def load_catalog_snapshot(path):
+    """Lee con memory-map un catálogo guardado; devuelve (data, marca, synced_at) o None."""
+    if not os.path.exists(path):
+        return None
+    with pa.memory_map(path, 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+    metadata = table.schema.metadata or {}
+    high_water_mark = metadata.get(b'high_water_mark', b'').decode() or None
+    synced_at = metadata.get(b'synced_at', b'').decode()
+    data = table.to_pandas().set_index('id')
+    return data, high_water_mark, float(synced_at) if synced_at else None
+
+
+def _parse_wix_product_with_meta(p):
+    row = parse_wix_product(p)
+    row['id'] = p.get('id') or row['sku']
+    row['last_updated'] = p.get('lastUpdated') or ''
+    return row
+
+
+class CatalogSync:
+    """Última copia del catálogo de Wix más su marca de agua (`lastUpdated` más reciente).
+
+    `refresh()` pide a Wix solo los productos modificados desde la marca y los
+    inserta o reemplaza por id de producto (así un cambio de SKU o un SKU vacío no
+    pisa otras filas). La descarga completa se hace en la primera carga, cuando se
+    pide explícitamente o cuando el total de Wix no coincide con la copia local
+    (p. ej. productos eliminados, que el filtro por fecha no puede ver).
+
+    Con `snapshot_path` la copia se guarda en disco tras cada cambio y se carga al
+    crear el objeto, así un proceso nuevo sirve el catálogo sin esperar a Wix.
+    Los índices derivados viven en el espacio de caché `cache` y se invalidan al
+    publicar una copia nueva.
+    """
+
+    def __init__(self, headers, max_workers=4, max_requests_per_second=None, snapshot_path=None, cache=None):
+        self.headers = headers
+        self.max_workers = max_workers
+        self.max_requests_per_second = max_requests_per_second
+        self.snapshot_path = snapshot_path
+        self.high_water_mark = None
+        self.synced_at = None
+        self.last_error = None
+        self._data = None
+        # (DataFrame, versión) se publican juntos: un lector nunca ve un frame con la versión de otro
+        self._published = (None, 0)
+        self._lock = threading.Lock()
+        self._background = None
+        self._cache = cache if cache is not None else CacheNamespace(CATALOGO)
+        if snapshot_path:
+            self._load_snapshot()
+
+    @property
+    def df(self):
+        return self._published[0]
+
+    @property
+    def version(self):
+        return self._published[1]
+
+    def _index(self, index_class):
+        """Índice del catálogo vigente; solo se reconstruye cuando cambia la copia."""
+        df, version = self._published
+        if df is None:
+            return None
+        return self._cache.get_or_compute((index_class.__name__, version), lambda: index_class(df))
+
+    @property
+    def sku_index(self):
+        return self._index(SkuIndex)
+
+    @property
+    def search_index(self):
+        return self._index(SearchIndex)
+
+    def is_stale(self, max_age):
+        return self.synced_at is None or time.time() - self.synced_at > max_age
+
+    def _fetch(self, on_progress=None, query_filter=None):
+        with metricas.span('wix_catalogo', tipo='delta' if query_filter else 'completo') as tramo:
+            rows = fetch_wix_products(
+                self.headers,
+                max_workers=self.max_workers,
+                max_requests_per_second=self.max_requests_per_second,
+                on_progress=on_progress,
+                query_filter=query_filter,
+                parse=_parse_wix_product_with_meta
+            )
+            tramo.set(productos=len(rows))
+            return rows
+
+    def _load_snapshot(self):
+        try:
+            snapshot = load_catalog_snapshot(self.snapshot_path)
+        except (OSError, pa.ArrowException):
+            return
+        if snapshot is None:
+            return
+        data, self.high_water_mark, self.synced_at = snapshot
+        self._data = data
+        self._published = (catalog_frame(data), self.version + 1)
+        self._cache.invalidate()
+
+    def _publish(self, data):
+        data = data[~data.index.duplicated(keep='last')]
+        self._data = data
+        self._published = (catalog_frame(data), self.version + 1)
+        marks = data['last_updated'][data['last_updated'] != '']
+        self.high_water_mark = marks.max() if not marks.empty else None
+        self._cache.invalidate()
+        if self.snapshot_path:
+            save_catalog_snapshot(self.snapshot_path, data, self.high_water_mark, time.time())
+
+    def full_sync(self, on_progress=None):
+        try:
+            rows = self._fetch(on_progress)
+        except WixAPIError as e:
+            # Sin copia previa se usa lo leído hasta el fallo, como el recorrido secuencial
+            if self._data is None and e.partial:
+                self._publish(pd.DataFrame(e.partial).set_index('id'))
+            raise
+        if rows:
+            self._publish(pd.DataFrame(rows).set_index('id'))
+        self.synced_at = time.time()
+        return len(rows)
+
+    def delta_sync(self, on_progress=None):
+        """Aplica los cambios desde la marca de agua; devuelve cuántos productos cambiaron."""
+        query_filter = {"lastUpdated": {"$gte": self.high_water_mark}}
+        rows = self._fetch(on_progress, query_filter=query_filter)
+        if rows:
+            changes = pd.DataFrame(rows).set_index('id')
+            changes = changes[~changes.index.duplicated(keep='last')]
+            data = self._data.copy()
+            existing = changes.index[changes.index.isin(data.index)]
+            data.loc[existing, changes.columns] = changes.loc[existing]
+            data = pd.concat([data, changes[~changes.index.isin(data.index)]])
+            if not data[CATALOG_COLUMNS].equals(self._data[CATALOG_COLUMNS]):
+                self._publish(data)
+            else:
+                self._data = data
+        self.synced_at = time.time()
+        return len(rows)
+
+    def is_consistent(self):
+        return self._data is not None and fetch_wix_total(self.headers) == len(self._data)
+
+    def refresh(self, full=False, on_progress=None, max_age=None):
+        """Sincroniza con Wix; devuelve 'full', 'delta' o None si otra sesión ya lo hizo.
+
+        Con `max_age` solo se sincroniza si la copia es más antigua que esos segundos.
+        """
+        with self._lock:
+            if not full and max_age is not None and not self.is_stale(max_age):
+                return None
+            if full or self._data is None or not self.high_water_mark:
+                self.full_sync(on_progress)
+                return 'full'
+            self.delta_sync(on_progress)
+            if not self.is_consistent():
+                self.full_sync(on_progress)
+                return 'full'
+            return 'delta'
+
+    @property
+    def refreshing(self):
+        return self._background is not None and self._background.is_alive()
+
+    def refresh_in_background(self, max_age=None):
+        """Lanza `refresh()` en un hilo aparte; mientras tanto se sigue sirviendo la copia actual."""
+        if self.refreshing:
+            return
+
+        def run():
+            try:
+                self.refresh(max_age=max_age)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = e
+
+        self._background = threading.Thread(target=run, name="catalog-refresh", daemon=True)
+        self._background.start()
@@ -0,0 +1,168 @@
+"""Cliente HTTP compartido para el API de Wix y las imágenes de productos.
+
+Una sola `requests.Session` con un pool de conexiones por host, así las
+peticiones reutilizan la conexión TLS (keep-alive) y las respuestas llegan
+comprimidas (`Accept-Encoding` de requests). Cada host tiene un tope de
+peticiones simultáneas igual al tamaño de su pool y, si se configura, un
+límite de peticiones por segundo. Los errores de conexión, los 429 y los 5xx
+se reintentan con espera exponencial con jitter; un `Retry-After` del
+servidor manda sobre esa espera y frena a todos los hilos que usan ese host.
+"""
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metricas
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+DEFAULT_ATTEMPTS = 4
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30
+CONNECTIONS_PER_HOST = 16
+TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+
+class RateLimiter:
+    """Reparte las peticiones en el tiempo para no superar N por segundo entre hilos."""
+
+    def __init__(self, max_per_second=None):
+        self.interval = 1.0 / max_per_second if max_per_second else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def defer(self, seconds):
+        """Ninguna petición sale antes de `seconds` (p. ej. lo pedido en un `Retry-After`)."""
+        with self._lock:
+            self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+
+def retry_after_seconds(value):
+    """Segundos de un encabezado `Retry-After` (número o fecha HTTP); None si no se entiende."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class HttpClient:
+    """Sesión HTTP con pool de conexiones, concurrencia acotada, límites por host y reintentos.
+
+    `request` devuelve la respuesta final (también la de un 4xx o la del último
+    intento fallido) y solo lanza `requests.RequestException` si el último
+    intento no obtuvo respuesta. El cuerpo se lee dentro del turno del host,
+    así la conexión vuelve al pool antes de que entre la siguiente petición.
+    """
+
+    def __init__(self, connections_per_host=CONNECTIONS_PER_HOST, attempts=DEFAULT_ATTEMPTS,
+                 base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY, host_rates=None):
+        self.connections_per_host = connections_per_host
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=connections_per_host, max_retries=0)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._lock = threading.Lock()
+        self._slots = {}
+        self._limiters = {host: RateLimiter(rate) for host, rate in (host_rates or {}).items()}
+
+    @staticmethod
+    def host(url):
+        return urlsplit(url).netloc
+
+    def _host_state(self, host):
+        with self._lock:
+            slots = self._slots.get(host)
+            if slots is None:
+                slots = self._slots[host] = threading.BoundedSemaphore(self.connections_per_host)
+            limiter = self._limiters.get(host)
+            if limiter is None:
+                limiter = self._limiters[host] = RateLimiter()
+            return slots, limiter
+
+    def set_rate(self, host, max_per_second):
+        """Limita las peticiones por segundo a `host` (None o 0 lo deja sin límite)."""
+        with self._lock:
+            limiter = self._limiters.get(host)
+            if limiter is None:
+                self._limiters[host] = RateLimiter(max_per_second)
+            else:
+                limiter.interval = 1.0 / max_per_second if max_per_second else 0.0
+
+    def _backoff(self, attempt):
+        # Jitter completo: los hilos que fallaron a la vez no reintentan a la vez
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def request(self, method, url, timeout, attempts=None, **kwargs):
+        host = self.host(url)
+        slots, limiter = self._host_state(host)
+        attempts = attempts or self.attempts
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            limiter.wait()
+            try:
+                with slots:
+                    response = self._session.request(method, url, timeout=timeout, **kwargs)
+                    response.content  # lee el cuerpo y libera la conexión
+            except TRANSIENT_ERRORS as e:
+                metricas.count('http_peticiones', host=host, estado=type(e).__name__)
+                if last:
+                    raise
+                delay = self._backoff(attempt)
+            else:
+                metricas.count('http_peticiones', host=host, estado=response.status_code)
+                if response.status_code not in RETRY_STATUSES or last:
+                    return response
+                retry_after = retry_after_seconds(response.headers.get('Retry-After'))
+                if retry_after is not None and retry_after > self.max_delay:
+                    # Esperar tanto bloquearía la app; el llamador decide con la respuesta
+                    return response
+                if retry_after is not None:
+                    limiter.defer(retry_after)
+                    delay = 0
+                else:
+                    delay = self._backoff(attempt)
+            metricas.count('http_reintentos', host=host)
+            time.sleep(delay)
+
+    def get(self, url, timeout, **kwargs):
+        return self.request('GET', url, timeout, **kwargs)
+
+    def post(self, url, timeout, **kwargs):
+        return self.request('POST', url, timeout, **kwargs)
+
+    def close(self):
+        self._session.close()
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """Cliente HTTP compartido por el proceso."""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = HttpClient()
+        return _default_client
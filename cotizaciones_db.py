@@ -0,0 +1,668 @@
+"""Consultas y escrituras de la colección de cotizaciones en Firestore.
+
+Las consultas paginadas de seguimiento usan los índices compuestos declarados en
+`firestore.indexes.json` (se despliegan con `firebase deploy --only firestore:indexes`).
+"""
+import random
+import re
+import threading
+import time as time_module
+import uuid
+from datetime import datetime, time, timedelta, timezone
+
+import pandas as pd
+from google.api_core import exceptions as gexc
+from google.cloud.firestore_v1.transforms import Increment
+
+import metricas
+from blobs import externalize_images, require_durable
+from catalogo import tokenize
+
+COLLECTION = 'cotizaciones'
+SUMMARY_VERSION = 2
+# Campos que lee la pestaña de seguimiento; nunca incluye `items` (con sus imágenes)
+TRACKING_FIELDS = [
+    'numero_cotizacion', 'fecha', 'cliente_nombre', 'estado', 'comentarios',
+    'total', 'total_unidades', 'num_items', 'resumen_version', 'creado_en'
+]
+BACKFILL_BATCH_SIZE = 200
+TRACKING_PAGE_SIZE = 50
+STORE_READY_TIMEOUT = 10
+# Límites de Firestore por commit: 500 escrituras y 10 MiB; se deja margen en el tamaño
+MAX_BATCH_WRITES = 500
+MAX_BATCH_BYTES = 9 * 1024 * 1024
+WRITE_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.25
+COUNTERS_COLLECTION, QUOTE_COUNTER_DOC = 'counters', 'cotizaciones'
+QUOTE_NUMBER_BLOCK = 20
+RESERVE_ATTEMPTS = 20
+QUOTE_PREFIXES = {'Oviedo': "OV", 'Barranquilla': "BQ"}
+TRANSIENT_ERRORS = (
+    gexc.Aborted, gexc.DeadlineExceeded, gexc.ServiceUnavailable, gexc.InternalServerError,
+    gexc.ResourceExhausted, gexc.TooManyRequests, gexc.GatewayTimeout
+)
+# Firestore rechazó el commit sin aplicar nada: reenviarlo es seguro. En los demás
+# transitorios (plazo vencido, servicio que no respondió) el lote pudo aplicarse
+REJECTED_ERRORS = (gexc.Aborted, gexc.ResourceExhausted, gexc.TooManyRequests)
+# Marcas de los lotes confirmados; la política TTL de `expira_en` las borra
+COMMIT_MARKERS_COLLECTION = 'lotes_confirmados'
+COMMIT_MARKER_TTL = timedelta(days=7)
+# Errores que causa una escritura concreta del lote: partirlo aísla a la culpable
+WRITE_ERRORS = (gexc.FailedPrecondition, gexc.NotFound, gexc.InvalidArgument, gexc.AlreadyExists, ValueError)
+MIN_PREFIX, MAX_PREFIX = 2, 20
+TRACKING_EDITABLE = {"Estado": 'estado', "Comentarios": 'comentarios'}
+CONFLICT_MESSAGE = "Otra persona la modificó después de cargar la tabla; revisa los datos nuevos y vuelve a guardar."
+ZONA_COLOMBIA = timezone(timedelta(hours=-5))
+
+
+def client_search_terms(*texts):
+    """Prefijos del cliente desde el inicio de cada palabra, para filtrar con `array_contains`.
+
+    "Colegio San José" produce "co", "col", ..., "san jo", "jose", etc., así una
+    búsqueda de una o varias palabras seguidas es un único término.
+    """
+    terms = set()
+    for text in texts:
+        tokens = tokenize(text or '')
+        for start in range(len(tokens)):
+            phrase = ' '.join(tokens[start:])
+            terms.update(phrase[:n].rstrip() for n in range(MIN_PREFIX, min(len(phrase), MAX_PREFIX) + 1))
+            terms.add(tokens[start][:MAX_PREFIX])
+    return sorted(terms)
+
+
+def client_search_term(query):
+    """Término que se envía a Firestore para una búsqueda de cliente.
+
+    Se recorta igual que los prefijos de `client_search_terms`: si el corte cae
+    en un espacio, este no forma parte del término.
+    """
+    phrase = ' '.join(tokenize(query or ''))
+    return phrase[:MAX_PREFIX].rstrip() or None
+
+
+def quote_summary(quote_data):
+    """Campos resumen que se guardan junto a la cotización para no leer sus ítems."""
+    items = quote_data.get('items', {}) or {}
+    subtotal = sum(item.get('valor_total', 0) or 0 for item in items.values())
+    return {
+        'total': subtotal + (quote_data.get('flete_val', 0) or 0),
+        'total_unidades': sum(item.get('cantidad', 0) or 0 for item in items.values()),
+        'num_items': len(items),
+        'cliente_busqueda': client_search_terms(
+            quote_data.get('cliente_nombre'), quote_data.get('cliente_nit'), re.sub(r'\D', '', str(quote_data.get('cliente_nit') or ''))
+        ),
+        'resumen_version': SUMMARY_VERSION
+    }
+
+
+def has_summary(data):
+    return data.get('resumen_version') == SUMMARY_VERSION
+
+
+def tracking_row(quote_id, data, version=None):
+    """Fila de la tabla de seguimiento; `version` es el update_time leído, para guardar con precondición."""
+    return {
+        "id": quote_id,
+        "version": version,
+        "N° Cotización": data.get("numero_cotizacion", "S/N"),
+        "Fecha": data.get("fecha", "S/F"),
+        "Cliente": data.get("cliente_nombre", "N/A"),
+        "Total": data.get("total", 0),
+        "Estado": data.get("estado", "🔵 Creada"),
+        "Comentarios": data.get("comentarios", "")
+    }
+
+
+def tracking_changes(original, edited):
+    """Cambios de Estado y Comentarios entre dos tablas de seguimiento, alineadas por `id`.
+
+    Compara ambas columnas de una vez (vacío y None cuentan igual) y devuelve
+    {id: (cambios, versión leída)} solo de las filas que cambiaron. Las filas que
+    no están en las dos tablas se ignoran.
+    """
+    columns = list(TRACKING_EDITABLE)
+    original = original.drop_duplicates('id').set_index('id')
+    edited = edited.drop_duplicates('id').set_index('id')
+    ids = original.index.intersection(edited.index)
+    before = original.loc[ids, columns].astype(object).where(original.loc[ids, columns].notna(), '')
+    after = edited.loc[ids, columns].astype(object).where(edited.loc[ids, columns].notna(), '')
+    changed = (before != after).any(axis=1)
+    rows = after[changed].rename(columns=TRACKING_EDITABLE)
+    versions = original.loc[rows.index, 'version'] if 'version' in original else pd.Series(None, index=rows.index)
+    return {
+        doc_id: (changes, _version_value(version))
+        for doc_id, changes, version in zip(rows.index, rows.to_dict('records'), versions)
+    }
+
+
+def _version_value(version):
+    # pandas convierte los update_time de la tabla en Timestamp; la precondición usa datetime
+    if version is None or pd.isna(version):
+        return None
+    return version.to_pydatetime() if isinstance(version, pd.Timestamp) else version
+
+
+def day_range(desde, hasta):
+    """Límites de `creado_en` (inicio, fin exclusivo) para un rango de días en hora de Colombia."""
+    start = datetime.combine(desde, time.min, ZONA_COLOMBIA)
+    end = datetime.combine(hasta + timedelta(days=1), time.min, ZONA_COLOMBIA)
+    return start, end
+
+
+def tracking_query(db, tienda, estados=None, desde=None, hasta=None, cliente=None):
+    """Consulta de seguimiento con los filtros aplicados en Firestore, de la más nueva a la más antigua.
+
+    `desde` y `hasta` son datetimes sobre `creado_en` (hasta es exclusivo).
+    """
+    query = db.collection(COLLECTION).where('tienda', '==', tienda)
+    if estados:
+        query = query.where('estado', 'in', list(estados))
+    term = client_search_term(cliente)
+    if term:
+        query = query.where('cliente_busqueda', 'array_contains', term)
+    if desde is not None:
+        query = query.where('creado_en', '>=', desde)
+    if hasta is not None:
+        query = query.where('creado_en', '<', hasta)
+    return query.order_by('creado_en', direction='DESCENDING')
+
+
+def fetch_tracking_page(db, tienda, cursor=None, page_size=TRACKING_PAGE_SIZE, **filters):
+    """Una página de filas de seguimiento leyendo solo los campos resumen.
+
+    `cursor` es el último documento de la página anterior. Devuelve
+    (filas, cursor de la página siguiente o None si es la última).
+    """
+    query = tracking_query(db, tienda, **filters).select(TRACKING_FIELDS)
+    if cursor is not None:
+        query = query.start_after(cursor)
+    with metricas.span('firestore_seguimiento') as tramo:
+        snaps = list(query.limit(page_size + 1).stream())
+        tramo.set(documentos=len(snaps))
+    metricas.count('firestore_documentos', len(snaps), consulta='seguimiento')
+    rows = [tracking_row(snap.id, snap.to_dict(), snap.update_time) for snap in snaps[:page_size]]
+    next_cursor = snaps[page_size - 1] if len(snaps) > page_size else None
+    return rows, next_cursor
+
+
+def fetch_tracking_labels(db, tienda, **filters):
+    """{etiqueta: id} de todas las cotizaciones que cumplen los filtros, sin leer más campos."""
+    query = tracking_query(db, tienda, **filters).select(['numero_cotizacion', 'cliente_nombre', 'creado_en'])
+    labels = {}
+    with metricas.span('firestore_etiquetas') as tramo:
+        for snap in query.stream():
+            data = snap.to_dict()
+            labels[f"{data.get('numero_cotizacion', snap.id)} - {data.get('cliente_nombre', 'N/A')}"] = snap.id
+        tramo.set(documentos=len(labels))
+    metricas.count('firestore_documentos', len(labels), consulta='etiquetas')
+    return labels
+
+
+def _count(query):
+    return query.count().get()[0][0].value
+
+
+def count_missing_summaries(db, tienda):
+    """Cotizaciones de la tienda sin el resumen actual o sin `creado_en`; no aparecen en las consultas paginadas."""
+    base = db.collection(COLLECTION).where('tienda', '==', tienda)
+    # Ordenar por `creado_en` deja fuera, como en Firestore, a las que no lo tienen
+    complete = base.where('resumen_version', '==', SUMMARY_VERSION).order_by('creado_en')
+    return _count(base) - _count(complete)
+
+
+class QuoteSummaryStore:
+    """Resúmenes de las cotizaciones de una tienda en memoria, al día con un listener `on_snapshot`.
+
+    El listener recibe primero todas las cotizaciones y luego solo las que cambian;
+    de cada una se guardan únicamente los campos resumen (los `items` se descartan).
+    Las páginas y listas se sirven desde memoria con la misma semántica que
+    `tracking_query`, así una recarga de la app no cuesta lecturas en Firestore.
+    Las escrituras de la propia app se aplican de inmediato con `apply_local`
+    y el listener las confirma después.
+    """
+
+    def __init__(self, db, tienda):
+        self.db = db
+        self.tienda = tienda
+        self.version = 0
+        self.error = None
+        self._rows = {}
+        self._sorted = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._watch = None
+        self._waited = False
+
+    def start(self):
+        query = self.db.collection(COLLECTION).where('tienda', '==', self.tienda)
+        self._watch = query.on_snapshot(self._on_snapshot)
+        return self
+
+    def close(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+        self._ready.clear()
+
+    @property
+    def live(self):
+        return (
+            self.error is None and self._ready.is_set()
+            and self._watch is not None and getattr(self._watch, 'is_active', True)
+        )
+
+    def wait_ready(self, timeout=STORE_READY_TIMEOUT):
+        """Espera la primera foto del listener; solo la primera llamada bloquea."""
+        if not self._waited and self.error is None:
+            self._ready.wait(timeout)
+            self._waited = True
+        return self.live
+
+    @staticmethod
+    def _summary_row(snap, data):
+        if not has_summary(data) or not data.get('creado_en'):
+            data = {**data, **quote_summary(data)}
+            data['resumen_version'] = None
+        row = {field: data[field] for field in TRACKING_FIELDS if field in data}
+        row['creado_en'] = data.get('creado_en') or getattr(snap, 'create_time', None)
+        row['cliente_busqueda'] = frozenset(data.get('cliente_busqueda') or ())
+        row['update_time'] = getattr(snap, 'update_time', None)
+        return row
+
+    def _on_snapshot(self, docs, changes, read_time):
+        try:
+            with self._lock:
+                for change in changes:
+                    snap = change.document
+                    if change.type.name == 'REMOVED':
+                        self._rows.pop(snap.id, None)
+                    else:
+                        self._rows[snap.id] = self._summary_row(snap, snap.to_dict())
+                self._sorted = None
+                self.version += 1
+            metricas.count('firestore_documentos', len(changes), consulta='listener')
+        except Exception as e:
+            self.error = e
+        self._ready.set()
+
+    def apply_local(self, quote_id, data, update_time=None):
+        """Refleja una escritura propia antes de que llegue por el listener.
+
+        `update_time` es el que devolvió la escritura; sin él la fila queda sin
+        versión hasta que el listener traiga el documento.
+        """
+        with self._lock:
+            current = self._rows.get(quote_id)
+            if current is None and 'items' not in data:
+                return
+            if 'items' in data:
+                row = self._summary_row(None, {**(current or {}), **data})
+            else:
+                row = {**current, **{k: v for k, v in data.items() if k in TRACKING_FIELDS}}
+            if not isinstance(row.get('creado_en'), datetime):
+                row['creado_en'] = (current or {}).get('creado_en') or datetime.now(timezone.utc)
+            row['update_time'] = update_time
+            self._rows[quote_id] = row
+            self._sorted = None
+            self.version += 1
+
+    def remove_local(self, quote_id):
+        with self._lock:
+            if self._rows.pop(quote_id, None) is not None:
+                self._sorted = None
+                self.version += 1
+
+    def _ordered(self):
+        """(id, fila) de la más nueva a la más antigua, como ordena `tracking_query`."""
+        with self._lock:
+            if self._sorted is None:
+                self._sorted = sorted(
+                    self._rows.items(),
+                    key=lambda item: (item[1]['creado_en'] is not None, item[1]['creado_en'] or 0, item[0]),
+                    reverse=True
+                )
+            return self._sorted
+
+    def _matching(self, estados=None, desde=None, hasta=None, cliente=None):
+        term = client_search_term(cliente)
+        for quote_id, row in self._ordered():
+            if estados and row.get('estado') not in estados:
+                continue
+            if term and term not in row['cliente_busqueda']:
+                continue
+            creado_en = row['creado_en']
+            if desde is not None and (creado_en is None or creado_en < desde):
+                continue
+            if hasta is not None and (creado_en is None or creado_en >= hasta):
+                continue
+            yield quote_id, row
+
+    def page(self, cursor=None, page_size=TRACKING_PAGE_SIZE, **filters):
+        """Como `fetch_tracking_page`, con el desplazamiento en la lista filtrada como cursor."""
+        offset = cursor or 0
+        matching = list(self._matching(**filters))
+        rows = [tracking_row(quote_id, row, row.get('update_time')) for quote_id, row in matching[offset:offset + page_size]]
+        next_cursor = offset + page_size if len(matching) > offset + page_size else None
+        return rows, next_cursor
+
+    def labels(self, **filters):
+        return {
+            f"{row.get('numero_cotizacion') or quote_id} - {row.get('cliente_nombre') or 'N/A'}": quote_id
+            for quote_id, row in self._matching(**filters)
+        }
+
+    def missing_count(self):
+        with self._lock:
+            return sum(1 for row in self._rows.values() if row.get('resumen_version') != SUMMARY_VERSION)
+
+
+def _estimated_size(doc_id, data):
+    return len(doc_id) + len(repr(data)) + 100
+
+
+def _write_increments(write):
+    return write[4] if len(write) > 4 and write[4] else {}
+
+
+def _write_chunks(writes):
+    """Agrupa las escrituras en lotes que respetan los límites de un commit (con la marca del lote)."""
+    chunk, count, size = [], 1, 0
+    for write in writes:
+        increments = _write_increments(write)
+        # Cada documento de incrementos cuenta como una escritura más del lote
+        write_count = 1 + len(increments)
+        write_size = _estimated_size(write[1], write[2]) + sum(
+            _estimated_size(target[1], values) for target, values in increments.items()
+        )
+        if chunk and (count + write_count > MAX_BATCH_WRITES or size + write_size > MAX_BATCH_BYTES):
+            yield chunk
+            chunk, count, size = [], 1, 0
+        chunk.append(write)
+        count += write_count
+        size += write_size
+    if chunk:
+        yield chunk
+
+
+def _add_nested(total, values):
+    """Suma `values` (mapas anidados) sobre `total`; los números se acumulan y el resto se reemplaza."""
+    for key, value in values.items():
+        if isinstance(value, dict):
+            _add_nested(total.setdefault(key, {}), value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            total[key] = total.get(key, 0) + value
+        else:
+            total[key] = value
+    return total
+
+
+def _as_increments(values):
+    return {
+        key: _as_increments(value) if isinstance(value, dict)
+        else Increment(value) if isinstance(value, (int, float)) and not isinstance(value, bool)
+        else value
+        for key, value in values.items()
+    }
+
+
+def _backoff(attempt, base_delay=RETRY_BASE_DELAY):
+    time_module.sleep(base_delay * 2 ** attempt * (0.5 + random.random()))
+
+
+def with_retries(operation, attempts=WRITE_ATTEMPTS, base_delay=RETRY_BASE_DELAY):
+    """Ejecuta `operation()` reintentando los errores transitorios con espera exponencial.
+
+    Solo para operaciones idempotentes (lecturas); los lotes de escritura usan `_commit_chunk`.
+    """
+    for attempt in range(attempts):
+        try:
+            return operation()
+        except TRANSIENT_ERRORS:
+            if attempt == attempts - 1:
+                raise
+            _backoff(attempt, base_delay)
+
+
+def _commit_chunk(db, collection, chunk):
+    """Confirma un lote y devuelve {id: update_time}; reintentarlo nunca lo aplica dos veces.
+
+    El lote crea además una marca con un id propio. Si un intento falla con un
+    error que no garantiza que nada se aplicó, antes de reenviarlo se lee la
+    marca: si existe, el lote ya está confirmado y no se repite (los incrementos
+    de analítica no se suman dos veces, un `create` no choca consigo mismo y una
+    precondición de versión no da un conflicto falso).
+    """
+    marker = db.collection(COMMIT_MARKERS_COLLECTION).document(uuid.uuid4().hex)
+    marker_data = {'expira_en': datetime.now(timezone.utc) + COMMIT_MARKER_TTL, 'escrituras': len(chunk)}
+
+    def commit():
+        # Un lote nuevo en cada intento: uno que falló no se vuelve a enviar
+        batch = db.batch()
+        increments = {}
+        for kind, doc_id, data, *extra in chunk:
+            ref = db.collection(collection).document(doc_id)
+            version = extra[0] if extra else None
+            option = db.write_option(last_update_time=version) if version is not None else None
+            if kind == 'update':
+                batch.update(ref, data, option=option)
+            elif kind == 'set' and option is None:
+                batch.set(ref, data)
+            elif kind == 'create' and option is None:
+                batch.create(ref, data)
+            elif kind == 'delete':
+                batch.delete(ref, option=option)
+            else:
+                raise ValueError(f"Tipo de escritura desconocido o sin precondición posible: {kind}")
+            for target, values in _write_increments((kind, doc_id, data, *extra)).items():
+                _add_nested(increments.setdefault(target, {}), values)
+        # Los incrementos de todo el lote se suman por documento destino: una escritura por documento
+        for (target_collection, target_id), values in increments.items():
+            batch.set(db.collection(target_collection).document(target_id), _as_increments(values), merge=True)
+        batch.create(marker, marker_data)
+        # Los resultados de los documentos de incrementos y de la marca van después y se ignoran
+        return {write[1]: getattr(result, 'update_time', None) for write, result in zip(chunk, batch.commit() or ())}
+
+    def applied():
+        """{id: update_time} si un intento anterior se confirmó; todas las escrituras de un lote llevan su hora."""
+        snap = with_retries(marker.get)
+        return {write[1]: snap.create_time for write in chunk} if snap.exists else None
+
+    uncertain = False
+    for attempt in range(WRITE_ATTEMPTS):
+        if uncertain:
+            update_times = applied()
+            if update_times is not None:
+                return update_times
+        try:
+            return commit()
+        except TRANSIENT_ERRORS as e:
+            uncertain = uncertain or not isinstance(e, REJECTED_ERRORS)
+            if attempt == WRITE_ATTEMPTS - 1:
+                update_times = applied() if uncertain else None
+                if update_times is None:
+                    raise
+                return update_times
+            _backoff(attempt)
+
+
+def _write_error(e):
+    if isinstance(e, gexc.FailedPrecondition):
+        return CONFLICT_MESSAGE
+    return f"{type(e).__name__}: {e}"
+
+
+def _commit_isolating(db, collection, chunk, results, update_times):
+    """Confirma un lote; si lo rechaza una de sus escrituras, lo parte en mitades para aislarla.
+
+    Cualquier otro error (uno transitorio que agotó los reintentos, permisos...)
+    fallaría igual en cada mitad: el lote entero queda marcado con él.
+    """
+    try:
+        chunk_update_times = _commit_chunk(db, collection, chunk)
+    except Exception as e:
+        if len(chunk) == 1 or not isinstance(e, WRITE_ERRORS):
+            error = _write_error(e)
+            results.update((write[1], error) for write in chunk)
+            return
+        middle = len(chunk) // 2
+        _commit_isolating(db, collection, chunk[:middle], results, update_times)
+        _commit_isolating(db, collection, chunk[middle:], results, update_times)
+        return
+    update_times.update(chunk_update_times)
+    results.update((write[1], None) for write in chunk)
+
+
+def commit_writes(db, writes, collection=COLLECTION, on_progress=None, update_times=None):
+    """Envía escrituras en lotes atómicos con reintentos; devuelve {id: None o mensaje de error}.
+
+    `writes` es una lista de (tipo, id, datos) con tipo 'update', 'set', 'create'
+    o 'delete', o de (tipo, id, datos, versión) para que un 'update' o 'delete'
+    solo se aplique si el documento conserva el update_time `versión` (si cambió,
+    el error es `CONFLICT_MESSAGE`). Un quinto elemento opcional,
+    {(colección, id): mapa anidado}, lleva incrementos que van en el mismo lote
+    que la escritura (`set(merge=True)`; los números se suman con `Increment`).
+
+    Cada lote se aplica entero o no se aplica. Si un lote falla por una de sus
+    escrituras (por ejemplo, un documento que ya no existe o que otra persona
+    modificó), se divide en mitades y se reenvía, así solo quedan marcadas las
+    escrituras que fallan y el resto se guarda con pocos commits adicionales. Si
+    falla por otra causa, como Firestore sin servicio después de los reintentos,
+    todas las escrituras del lote quedan marcadas con ese error, sin partirlo. Un
+    lote se reenvía solo si consta que el intento anterior no se aplicó (ver
+    `_commit_chunk`), así los incrementos nunca se suman dos veces. Si
+    se pasa el dict `update_times`, se llena con el update_time de cada escritura
+    confirmada.
+    """
+    results = {}
+    update_times = {} if update_times is None else update_times
+    done = 0
+    for chunk in _write_chunks(writes):
+        _commit_isolating(db, collection, chunk, results, update_times)
+        done += len(chunk)
+        if on_progress:
+            on_progress(done, len(writes))
+    return results
+
+
+def failed_writes(results):
+    return {doc_id: error for doc_id, error in results.items() if error is not None}
+
+
+def format_quote_number(tienda, number):
+    return f"{QUOTE_PREFIXES.get(tienda, 'BQ')}-{str(number).zfill(4)}"
+
+
+class QuoteNumberAllocator:
+    """Números de cotización por bloques (hi/lo): una reserva en Firestore cada `block_size` números.
+
+    El contador sigue siendo el campo de cada tienda en `counters/cotizaciones`,
+    ahora con el último número reservado. Cada instancia de la app reserva
+    `block_size` números con una escritura condicionada al `update_time` leído
+    (si otra instancia escribió antes, se vuelve a leer y se reintenta) y los
+    entrega desde memoria. Los números de un bloque que no se alcanzan a usar
+    antes de reiniciar el proceso se pierden: la numeración es única pero puede
+    tener saltos.
+    """
+
+    def __init__(self, db, block_size=QUOTE_NUMBER_BLOCK):
+        self.db = db
+        self.block_size = block_size
+        self.stats = {'reservas': 0, 'conflictos': 0}
+        self._blocks = {}
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def _lock_for(self, tienda_key):
+        with self._locks_lock:
+            return self._locks.setdefault(tienda_key, threading.Lock())
+
+    def next_number(self, tienda):
+        tienda_key = tienda.lower()
+        with self._lock_for(tienda_key):
+            start, end = self._blocks.get(tienda_key, (0, 0))
+            if start >= end:
+                start, end = self._reserve(tienda_key)
+            self._blocks[tienda_key] = (start + 1, end)
+            return start
+
+    def _reserve(self, tienda_key):
+        """Reserva el siguiente bloque; devuelve (primer número, fin exclusivo)."""
+        counter_ref = self.db.collection(COUNTERS_COLLECTION).document(QUOTE_COUNTER_DOC)
+        for attempt in range(RESERVE_ATTEMPTS):
+            snap = with_retries(counter_ref.get)
+            current = (snap.to_dict() or {}).get(tienda_key, 0) if snap.exists else 0
+            try:
+                if snap.exists:
+                    option = self.db.write_option(last_update_time=snap.update_time)
+                    counter_ref.update({tienda_key: current + self.block_size}, option=option)
+                else:
+                    counter_ref.create({tienda_key: current + self.block_size})
+            except (gexc.FailedPrecondition, gexc.AlreadyExists, gexc.Aborted):
+                self.stats['conflictos'] += 1
+                time_module.sleep(RETRY_BASE_DELAY * min(attempt + 1, 4) * random.random())
+                continue
+            self.stats['reservas'] += 1
+            return current + 1, current + self.block_size + 1
+        raise RuntimeError("No se pudo reservar un bloque de números de cotización: demasiada contención.")
+
+
+def backfill_summaries(db, tienda=None, batch_size=BACKFILL_BATCH_SIZE, on_progress=None):
+    """Migración: escribe los campos resumen en las cotizaciones que no los tienen.
+
+    A las que no tienen `creado_en` se les pone la fecha de creación del documento.
+    Es idempotente; las que ya tienen la versión actual del resumen y `creado_en`
+    se saltan. Devuelve el reporte de `commit_writes`.
+    """
+    query = db.collection(COLLECTION)
+    if tienda:
+        query = query.where('tienda', '==', tienda)
+    pending = [
+        snap.id for snap in query.select(['resumen_version', 'creado_en']).stream()
+        if not has_summary(snap.to_dict()) or not snap.to_dict().get('creado_en')
+    ]
+    results = {}
+    for start in range(0, len(pending), batch_size):
+        refs = [db.collection(COLLECTION).document(quote_id) for quote_id in pending[start:start + batch_size]]
+        writes = []
+        for snap in with_retries(lambda: list(db.get_all(refs))):
+            if snap.exists:
+                data = snap.to_dict()
+                changes = quote_summary(data)
+                if not data.get('creado_en'):
+                    changes['creado_en'] = snap.create_time
+                writes.append(('update', snap.id, changes))
+        results.update(commit_writes(db, writes))
+        if on_progress:
+            on_progress(min(start + batch_size, len(pending)), len(pending))
+    return results
+
+
+def migrate_inline_images(db, blob_store, tienda=None, batch_size=BACKFILL_BATCH_SIZE, on_progress=None):
+    """Migración: mueve las imágenes `imagen_base64` de los ítems al almacén de blobs.
+
+    Cada ítem queda con `imagen_hash` en lugar de los bytes. Es idempotente: las
+    cotizaciones sin imágenes en línea no se reescriben. Devuelve el reporte de
+    `commit_writes` de las cotizaciones modificadas. Lanza ValueError si el
+    almacén no es durable: las imágenes movidas se perderían con él.
+    """
+    require_durable(blob_store)
+    query = db.collection(COLLECTION)
+    if tienda:
+        query = query.where('tienda', '==', tienda)
+    quote_ids = [snap.id for snap in query.select([]).stream()]
+    results = {}
+    for start in range(0, len(quote_ids), batch_size):
+        refs = [db.collection(COLLECTION).document(quote_id) for quote_id in quote_ids[start:start + batch_size]]
+        writes = []
+        for snap in with_retries(lambda: list(db.get_all(refs))):
+            items = (snap.to_dict() or {}).get('items')
+            if not items:
+                continue
+            items, moved = externalize_images(items, blob_store)
+            if moved:
+                writes.append(('update', snap.id, {'items': items}))
+        results.update(commit_writes(db, writes))
+        if on_progress:
+            on_progress(min(start + batch_size, len(quote_ids)), len(quote_ids))
+    return results
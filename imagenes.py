@@ -0,0 +1,281 @@
+"""Caché en disco de las imágenes de productos y descarga anticipada para los PDFs."""
+import base64
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import requests
+from PIL import Image, ImageOps
+
+import metricas
+from cliente_http import get_http_client
+
+DEFAULT_CACHE_DIR = os.path.join(".cache", "imagenes")
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+IMAGE_TIMEOUT = 5
+IMAGE_ATTEMPTS = 2
+PREFETCH_WORKERS = 8
+PDF_IMAGE_DPI = 150
+JPEG_QUALITY = 82
+# Para logos y textos: con menos calidad se ven halos alrededor de las letras
+OPAQUE_JPEG_QUALITY = 92
+NORMALIZED_MEMORY_ENTRIES = 512
+UPLOAD_MAX_PIXELS = 1600
+THUMBNAIL_PIXELS = 96
+
+
+class ImageCache:
+    """Caché LRU en disco direccionada por el sha256 de la URL, con tope de tamaño.
+
+    La fecha de modificación de cada archivo marca su último uso; al superar
+    `max_bytes` se borran los menos usados hasta quedar en el 90 % del tope.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for _, _, size in self._entries())
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    def get(self, url):
+        path = self._path(self.key(url))
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, url, data):
+        path = self._path(self.key(url))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            self._size += len(data) - previous
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        self._size = sum(size for _, _, size in entries)
+        target = self.max_bytes * 0.9
+        for path, _, size in entries:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_image_cache():
+    """Caché de imágenes compartida por el proceso."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ImageCache()
+        return _default_cache
+
+
+def is_remote_image(url):
+    return bool(url) and "placehold.co" not in url
+
+
+def fetch_image(url, timeout=IMAGE_TIMEOUT):
+    """Descarga una imagen por el cliente HTTP compartido; devuelve los bytes o None si falla."""
+    # Añadimos header para simular navegador si es necesario,
+    # aunque Wix suele servir imágenes estáticas sin problemas
+    headers_img = {'User-Agent': 'Mozilla/5.0'}
+    try:
+        response = get_http_client().get(url, headers=headers_img, timeout=timeout, attempts=IMAGE_ATTEMPTS)
+    except requests.RequestException:
+        metricas.count('imagenes_descargas', resultado='error')
+        return None
+    if response.status_code != 200:
+        metricas.count('imagenes_descargas', resultado=str(response.status_code))
+        return None
+    metricas.count('imagenes_descargas', resultado='ok')
+    metricas.count('imagenes_bytes', len(response.content))
+    return response.content
+
+
+def prefetch_images(urls, cache=None, max_workers=PREFETCH_WORKERS, timeout=IMAGE_TIMEOUT):
+    """Trae de la caché o descarga en paralelo las imágenes; devuelve {url: bytes o None}.
+
+    Cada descarga tiene su propio timeout, así una imagen lenta no retrasa las demás.
+    """
+    cache = cache or get_image_cache()
+    result = {}
+    missing = []
+    with metricas.span('imagenes_prefetch') as tramo:
+        for url in dict.fromkeys(u for u in urls if is_remote_image(u)):
+            data = cache.get(url)
+            if data is None:
+                missing.append(url)
+            else:
+                result[url] = data
+        metricas.count('imagenes_cache', len(result), resultado='acierto')
+        metricas.count('imagenes_cache', len(missing), resultado='fallo')
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(missing))) as executor:
+                for url, data in zip(missing, executor.map(lambda u: fetch_image(u, timeout), missing)):
+                    result[url] = data
+                    if data:
+                        cache.put(url, data)
+        tramo.set(
+            imagenes=len(result), cache_aciertos=len(result) - len(missing),
+            descargadas=sum(1 for url in missing if result[url]),
+            bytes_descargados=sum(len(result[url]) for url in missing if result[url]),
+        )
+    return result
+
+
+_normalized = OrderedDict()
+_normalized_lock = threading.Lock()
+
+
+def _target_pixels(size_mm, dpi):
+    return max(1, round(size_mm / 25.4 * dpi))
+
+
+def _encode_for_pdf(data, width_px, height_px):
+    with Image.open(BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)
+        # Se reduce cada eje por separado: el PDF estira la imagen a la celda igual que antes
+        size = (min(img.width, width_px), min(img.height, height_px))
+        if size != img.size:
+            img = img.resize(size, Image.LANCZOS)
+        has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+        out = BytesIO()
+        if has_alpha:
+            img.convert('RGBA').save(out, 'PNG', optimize=True)
+        else:
+            img.convert('RGB').save(out, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+        return out.getvalue()
+
+
+def normalize_image(data, width_mm, height_mm, dpi=PDF_IMAGE_DPI, cache=None):
+    """Ajusta una imagen al tamaño en píxeles de su celda del PDF y la recomprime.
+
+    Las fotos sin transparencia pasan a JPEG y las demás a PNG optimizado. El
+    resultado se guarda en memoria y en la caché de disco según el hash del
+    contenido y el tamaño destino, así una misma foto produce siempre los mismos
+    bytes y el PDF la incrusta una sola vez aunque aparezca en varias filas. Si
+    Pillow no puede leer la imagen se devuelven los bytes originales.
+    """
+    width_px, height_px = _target_pixels(width_mm, dpi), _target_pixels(height_mm, dpi)
+    key = f"normalizada:{hashlib.sha256(data).hexdigest()}:{width_px}x{height_px}"
+    with _normalized_lock:
+        if key in _normalized:
+            _normalized.move_to_end(key)
+            return _normalized[key]
+
+    cache = cache or get_image_cache()
+    result = cache.get(key)
+    if result is None:
+        try:
+            result = _encode_for_pdf(data, width_px, height_px)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            return data
+        if len(result) >= len(data):
+            result = data
+        cache.put(key, result)
+
+    with _normalized_lock:
+        _normalized[key] = result
+        while len(_normalized) > NORMALIZED_MEMORY_ENTRIES:
+            _normalized.popitem(last=False)
+    return result
+
+
+def opaque_jpeg(data, width_px, background=(255, 255, 255), quality=OPAQUE_JPEG_QUALITY):
+    """La imagen sobre un fondo liso, reducida a `width_px` de ancho y como JPEG.
+
+    fpdf2 incrusta los JPEG tal cual, sin decodificarlos ni recomprimirlos, así
+    que una imagen que se repite en cada documento (el logo) cuesta casi nada.
+    """
+    with Image.open(BytesIO(data)) as img:
+        img = img.convert('RGBA')
+        if img.width > width_px:
+            img = img.resize((width_px, max(1, round(img.height * width_px / img.width))), Image.LANCZOS)
+        flat = Image.new('RGB', img.size, background)
+        flat.paste(img, mask=img.getchannel('A'))
+        out = BytesIO()
+        flat.save(out, 'JPEG', quality=quality, optimize=True)
+        return out.getvalue()
+
+
+def shrink_upload(data, max_pixels=UPLOAD_MAX_PIXELS):
+    """Limita el lado mayor de una imagen subida y la recomprime antes de guardarla.
+
+    Devuelve los bytes originales si ya es pequeña, si recomprimirla no ahorra
+    nada o si Pillow no la puede leer.
+    """
+    try:
+        with Image.open(BytesIO(data)) as img:
+            scale = min(1.0, max_pixels / max(img.width, img.height))
+            width_px, height_px = max(1, round(img.width * scale)), max(1, round(img.height * scale))
+        result = _encode_for_pdf(data, width_px, height_px)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return data
+    return result if len(result) < len(data) else data
+
+
+def thumbnail_data_uri(data, max_pixels=THUMBNAIL_PIXELS):
+    """Miniatura de una imagen como URI `data:` para mostrarla en una tabla.
+
+    Devuelve None si no hay bytes o si Pillow no puede leer la imagen.
+    """
+    if not data:
+        return None
+    try:
+        with Image.open(BytesIO(data)) as img:
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((max_pixels, max_pixels), Image.LANCZOS)
+            has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+            out = BytesIO()
+            if has_alpha:
+                img.convert('RGBA').save(out, 'PNG', optimize=True)
+                mime = 'image/png'
+            else:
+                img.convert('RGB').save(out, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+                mime = 'image/jpeg'
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    return f"data:{mime};base64,{base64.b64encode(out.getvalue()).decode()}"
@@ -0,0 +1,147 @@
+"""Importación en lote de productos a una cotización desde listas de SKUs (texto, CSV o Excel)."""
+import csv
+import io
+import os
+
+import pandas as pd
+
+SKU_COLUMN_NAMES = ('sku', 'referencia', 'ref', 'codigo', 'código', 'cod')
+QUANTITY_COLUMN_NAMES = ('cantidad', 'cant', 'unidades', 'unds', 'qty')
+ESTADO_ANADIDO = "✅ Añadido"
+ESTADO_SIN_STOCK = "⚠️ Añadido sin stock suficiente"
+ESTADO_NO_ENCONTRADO = "❌ SKU no encontrado"
+ESTADO_CANTIDAD_INVALIDA = "❌ Cantidad inválida"
+RESULT_COLUMNS = ['linea', 'sku', 'cantidad', 'nombre', 'inventory', 'estado']
+
+
+class SkuListError(ValueError):
+    """El texto o archivo no tiene una lista de SKUs legible."""
+
+
+def _lines_frame(rows):
+    """DataFrame `linea, sku, cantidad` a partir de filas [sku, cantidad?]; la cantidad vacía vale 1."""
+    rows = [row for row in rows if row and str(row[0]).strip()]
+    lines = pd.DataFrame({
+        'linea': range(1, len(rows) + 1),
+        'sku': [str(row[0]).strip() for row in rows],
+        'cantidad': [row[1] if len(row) > 1 and str(row[1]).strip() else 1 for row in rows],
+    })
+    if len(lines) and lines['sku'].iloc[0].casefold() in SKU_COLUMN_NAMES:
+        lines = lines.iloc[1:]
+        lines['linea'] -= 1
+    return lines.reset_index(drop=True)
+
+
+def parse_sku_text(text):
+    """Lista pegada con una línea por producto: `sku,cantidad` (también `;`, tabulador o espacio)."""
+    rows = []
+    for line in str(text or '').splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        for separator in (',', ';', '\t'):
+            if separator in line:
+                rows.append([part.strip() for part in line.split(separator)][:2])
+                break
+        else:
+            rows.append(line.split()[:2])
+    return _lines_frame(rows)
+
+
+def _pick_columns(header):
+    """Posiciones de las columnas de SKU y cantidad según la fila de encabezado (None si no la hay)."""
+    names = [str(cell).strip().casefold() for cell in header] if header is not None else []
+    sku = next((names.index(n) for n in SKU_COLUMN_NAMES if n in names), 0)
+    quantity = next((names.index(n) for n in QUANTITY_COLUMN_NAMES if n in names), None)
+    if quantity is None:
+        quantity = 1 if sku == 0 else 0
+    return sku, quantity
+
+
+def read_sku_file(file_name, data):
+    """Lee un CSV o XLSX subido (bytes), con o sin encabezado, y devuelve sus líneas `linea, sku, cantidad`."""
+    extension = os.path.splitext(file_name)[1].casefold()
+    if extension not in ('.xlsx', '.xlsm', '.csv', '.txt'):
+        raise SkuListError(f"Formato no soportado: '{extension or file_name}'. Usa CSV o XLSX.")
+    try:
+        if extension in ('.xlsx', '.xlsm'):
+            df = pd.read_excel(io.BytesIO(data), header=None, dtype=str, engine='openpyxl')
+        else:
+            text = data.decode('utf-8-sig', errors='replace')
+            try:
+                separator = csv.Sniffer().sniff(text[:4096], delimiters=',;\t').delimiter
+            except csv.Error:
+                separator = ','
+            df = pd.read_csv(io.StringIO(text), sep=separator, header=None, dtype=str)
+    except (ValueError, pd.errors.ParserError) as e:
+        raise SkuListError(f"No se pudo leer '{file_name}': {e}") from e
+    if df.empty:
+        raise SkuListError(f"'{file_name}' no tiene filas.")
+
+    df = df.fillna('')
+    first = df.iloc[0].tolist()
+    has_header = any(str(cell).strip().casefold() in SKU_COLUMN_NAMES + QUANTITY_COLUMN_NAMES for cell in first)
+    sku_column, quantity_column = _pick_columns(first if has_header else None)
+    if has_header:
+        df = df.iloc[1:]
+    quantities = df.iloc[:, quantity_column] if quantity_column < len(df.columns) else pd.Series('', index=df.index)
+    return _lines_frame(zip(df.iloc[:, sku_column], quantities))
+
+
+def match_sku_lines(lines, sku_index):
+    """Cruza las líneas importadas con el catálogo en una sola pasada.
+
+    Devuelve el resultado por línea (`RESULT_COLUMNS` más la posición de la fila
+    del catálogo en `pos`). Las cantidades que no son enteros positivos se
+    marcan como inválidas. Los productos con menos inventario que lo pedido se
+    añaden igual pero quedan señalados.
+    """
+    result = lines.copy()
+    result['cantidad'] = pd.to_numeric(result['cantidad'], errors='coerce')
+    valid_quantity = result['cantidad'].notna() & (result['cantidad'] >= 1) & (result['cantidad'] % 1 == 0)
+    result['pos'] = sku_index.positions(result['sku'])
+    found = result['pos'].notna()
+
+    catalog = sku_index.df.reset_index(drop=True)
+    matched = catalog.reindex(result['pos'].fillna(-1).astype(int)).reset_index(drop=True)
+    result['nombre'] = matched['nombre'].where(found, None)
+    result['inventory'] = matched['inventory'].where(found)
+    result['catalog_sku'] = matched['sku'].where(found, None)
+    result['precio_unitario'] = matched['precio_iva_incluido'].where(found)
+    result['imagen_url'] = matched['imagen_url'].where(found, None)
+
+    # El inventario se compara con el total pedido del SKU en toda la lista
+    requested = result['cantidad'].where(found & valid_quantity, 0).groupby(result['catalog_sku']).transform('sum')
+    result['estado'] = ESTADO_ANADIDO
+    result.loc[found & valid_quantity & (result['inventory'] < requested), 'estado'] = ESTADO_SIN_STOCK
+    result.loc[~valid_quantity, 'estado'] = ESTADO_CANTIDAD_INVALIDA
+    result.loc[~found, 'estado'] = ESTADO_NO_ENCONTRADO
+    result['cantidad'] = result['cantidad'].where(valid_quantity).astype('Int64')
+    result['inventory'] = result['inventory'].astype('Int64')
+    return result
+
+
+def merge_into_quote(quote_items, matches):
+    """Suma a `quote_items` las líneas añadidas de `matches`; devuelve cuántos SKUs distintos tocó."""
+    added = matches[matches['estado'].isin([ESTADO_ANADIDO, ESTADO_SIN_STOCK])]
+    if added.empty:
+        return 0
+    totals = added.groupby('catalog_sku', sort=False).agg(
+        cantidad=('cantidad', 'sum'), nombre=('nombre', 'first'),
+        precio_unitario=('precio_unitario', 'first'), imagen_url=('imagen_url', 'first'),
+    )
+    for sku, row in totals.iterrows():
+        cantidad = int(row['cantidad'])
+        if sku in quote_items:
+            quote_items[sku]['cantidad'] += cantidad
+        else:
+            quote_items[sku] = {
+                'imagen_url': row['imagen_url'],
+                'nombre': row['nombre'],
+                'sku': sku,
+                'cantidad': cantidad,
+                'precio_unitario': float(row['precio_unitario'])
+            }
+        item = quote_items[sku]
+        item['valor_total'] = item['precio_unitario'] * item['cantidad']
+    return len(totals)
@@ -0,0 +1,350 @@
+"""Medición ligera de los caminos críticos: tramos con tiempo, contadores y su exportación.
+
+Cada ejecución del script (rerun) de una sesión abre una `Run`; lo que corre
+fuera de ella, como un fragmento que se vuelve a ejecutar solo o la descarga de
+un PDF generado al hacer clic, abre la suya con `run_scope`. Los tramos
+(`span`) medidos mientras está activa llevan su id y el de la sesión en el log
+estructurado (una línea JSON por tramo en el logger `cotizaciones.metricas`).
+Tramos, contadores y observaciones se acumulan además en un registro del
+proceso que se exporta en el formato de texto de Prometheus, a un archivo o por
+HTTP en `/metrics`. `SamplingProfiler` muestrea la pila de un hilo para
+capturar una ejecución lenta sin instrumentar nada más.
+"""
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cache import get_cache
+
+PREFIX = 'cotizaciones'
+LOGGER = logging.getLogger('cotizaciones.metricas')
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = (16e3, 64e3, 256e3, 1e6, 4e6, 16e6, 64e6)
+PROFILER_INTERVAL = 0.005
+RUN_COMPLETE = 'completa'
+RUN_INTERRUPTED = 'interrumpida'
+RUN_SCRIPT = 'script'
+
+_current_run = contextvars.ContextVar('metricas_run', default=None)
+
+
+def _labels_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _format_number(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class MetricsRegistry:
+    """Contadores e histogramas del proceso, con etiquetas, seguros entre hilos."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._histograms = {}
+
+    def count(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[(name, _labels_key(labels))] += value
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        with self._lock:
+            key = (name, _labels_key(labels))
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': buckets, 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(histogram['buckets']):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def counter_value(self, name, **labels):
+        with self._lock:
+            return self._counters.get((name, _labels_key(labels)), 0.0)
+
+    def render(self):
+        """Texto en el formato de exposición de Prometheus, incluidas las estadísticas de las cachés."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, {**h, 'counts': list(h['counts'])}) for key, h in self._histograms.items())
+        lines = []
+        declared = set()
+        for (name, labels), value in counters:
+            metric = f"{PREFIX}_{name}_total"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_format_labels(labels)} {_format_number(value)}")
+        for (name, labels), histogram in histograms:
+            metric = f"{PREFIX}_{name}"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            for bound, n in zip(histogram['buckets'], histogram['counts']):
+                lines.append(f"{metric}_bucket{_format_labels(labels, [('le', _format_number(bound))])} {n}")
+            lines.append(f"{metric}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {_format_number(histogram['sum'])}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {histogram['count']}")
+
+        cache_stats = get_cache().stats()
+        for field, kind in (('entradas', 'gauge'), ('aciertos', 'counter'), ('fallos', 'counter'), ('desalojos', 'counter')):
+            metric = f"{PREFIX}_cache_{field}" + ('_total' if kind == 'counter' else '')
+            lines.append(f"# TYPE {metric} {kind}")
+            for stats in cache_stats:
+                lines.append(f"{metric}{_format_labels([('espacio', stats['espacio'])])} {stats[field]}")
+        return '\n'.join(lines) + '\n'
+
+
+_registry = MetricsRegistry()
+
+
+def get_registry():
+    """Registro de métricas compartido por el proceso."""
+    return _registry
+
+
+def count(name, value=1, **labels):
+    _registry.count(name, value, **labels)
+
+
+def observe(name, value, buckets=SECONDS_BUCKETS, **labels):
+    _registry.observe(name, value, buckets, **labels)
+
+
+class Run:
+    """Una ejecución del script de una sesión (o de un fragmento o una descarga): sus tramos y su perfil.
+
+    `kind` distingue el script completo de lo demás; `parent` es la ejecución que
+    originó esta (la que dibujó el botón de una descarga, por ejemplo).
+    """
+
+    def __init__(self, session_id=None, profiler=None, kind=RUN_SCRIPT, parent=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.session_id = session_id
+        self.kind = kind
+        self.parent_id = parent.id if parent is not None else None
+        self.started = time.perf_counter()
+        self.last_activity = self.started
+        self.spans = Counter()
+        self.finished = False
+        self.profiler = profiler
+        self.profile = None
+
+
+def current_run():
+    return _current_run.get()
+
+
+def _log(event, run, **fields):
+    if not LOGGER.isEnabledFor(logging.INFO):
+        return
+    record = {'evento': event, 'ts': round(time.time(), 3)}
+    if run is not None:
+        record.update(run=run.id, sesion=run.session_id)
+    record.update(fields)
+    LOGGER.info(json.dumps(record, ensure_ascii=False, default=str))
+
+
+class Span:
+    """Campos de un tramo en curso; el código medido puede añadir los suyos (bytes, documentos...)."""
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+
+@contextmanager
+def span(name, **fields):
+    """Mide un bloque: histograma `tramo_segundos{tramo=name}` y una línea de log con sus campos."""
+    run = _current_run.get()
+    current = Span(name, dict(fields))
+    start = time.perf_counter()
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        end = time.perf_counter()
+        seconds = end - start
+        _registry.observe('tramo_segundos', seconds, tramo=name)
+        if error:
+            _registry.count('tramo_errores', tramo=name, error=error)
+        if run is not None:
+            run.spans[name] += seconds
+            run.last_activity = end
+        _log('tramo', run, tramo=name, ms=round(seconds * 1000, 2), error=error, **current.fields)
+
+
+def begin_run(session_id=None, previous=None, profile=False):
+    """Abre la ejecución actual del script.
+
+    `previous` es la ejecución anterior de la misma sesión: si `st.rerun()` o
+    `st.stop()` la cortaron antes de `end_run`, se cierra aquí como
+    interrumpida, con su duración hasta el último tramo que terminó.
+    """
+    if previous is not None and not previous.finished:
+        end_run(previous, RUN_INTERRUPTED)
+    profiler = SamplingProfiler().start() if profile else None
+    run = Run(session_id, profiler)
+    _current_run.set(run)
+    return run
+
+
+def end_run(run, status=RUN_COMPLETE, metrics_file=None):
+    """Cierra la ejecución, registra su duración y, con `metrics_file`, reescribe el archivo de métricas."""
+    if run.finished:
+        return
+    run.finished = True
+    end = time.perf_counter() if status == RUN_COMPLETE else run.last_activity
+    if run.profiler is not None:
+        run.profiler.stop()
+        run.profile = run.profiler.collapsed()
+    seconds = end - run.started
+    _registry.observe('rerun_segundos', seconds, tipo=run.kind)
+    _registry.count('reruns', estado=status, tipo=run.kind)
+    _log('rerun', run, tipo=run.kind, padre=run.parent_id, estado=status, ms=round(seconds * 1000, 2),
+         tramos_ms={name: round(s * 1000, 2) for name, s in run.spans.most_common()},
+         muestras_perfil=run.profiler.samples if run.profiler else None)
+    if _current_run.get() is run:
+        _current_run.set(None)
+    if metrics_file:
+        write_metrics_file(metrics_file)
+
+
+@contextmanager
+def run_scope(session_id=None, kind=RUN_SCRIPT, parent=None, metrics_file=None):
+    """Abre una `Run` para un bloque que corre fuera de la ejecución del script y la cierra al salir.
+
+    Si el bloque termina con una excepción (también `st.rerun()`), queda como
+    interrumpida. Al salir se restaura la ejecución que estaba activa antes.
+    """
+    run = Run(session_id, kind=kind, parent=parent)
+    token = _current_run.set(run)
+    status = RUN_INTERRUPTED
+    try:
+        yield run
+        status = RUN_COMPLETE
+    finally:
+        end_run(run, status, metrics_file)
+        _current_run.reset(token)
+
+
+def write_metrics_file(path):
+    """Escribe las métricas en `path` (formato de Prometheus, p. ej. para el textfile collector)."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(_registry.render())
+    os.replace(tmp_path, path)
+
+
+def configure_logging(destination='stderr'):
+    """Envía el log estructurado a stderr o a un archivo, una línea JSON por evento."""
+    handler = logging.StreamHandler(sys.stderr) if destination == 'stderr' else logging.FileHandler(destination, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    for existing in list(LOGGER.handlers):
+        LOGGER.removeHandler(existing)
+    LOGGER.addHandler(handler)
+    LOGGER.setLevel(logging.INFO)
+    LOGGER.propagate = False
+    return handler
+
+
+def start_metrics_server(port, host='127.0.0.1'):
+    """Sirve `GET /metrics` en un hilo aparte; devuelve el servidor (con `shutdown()` para pararlo)."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = _registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metricas-http', daemon=True).start()
+    return server
+
+
+class SamplingProfiler:
+    """Toma cada `interval` segundos la pila de un hilo y cuenta cuántas veces aparece cada una.
+
+    `collapsed()` devuelve el perfil en formato de pilas colapsadas (una línea
+    `f1;f2;f3 N` por pila), el que leen flamegraph.pl y speedscope.
+    """
+
+    def __init__(self, thread_id=None, interval=PROFILER_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.samples = 0
+        self._stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, name='metricas-perfilador', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self._stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        return '\n'.join(f"{stack} {n}" for stack, n in self._stacks.most_common()) + '\n'
+
+    def top(self, limit=20):
+        """Funciones con más muestras propias (en la cima de la pila): [(función, muestras)]."""
+        leaves = Counter()
+        for stack, n in self._stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += n
+        return leaves.most_common(limit)
@@ -0,0 +1,555 @@
+"""Generación del PDF de una cotización."""
+import base64
+import multiprocessing
+import os
+import sys
+import threading
+import types
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from io import BytesIO
+
+from fpdf import FPDF
+from fpdf.enums import MethodReturnValue
+
+import metricas
+from imagenes import PDF_IMAGE_DPI, is_remote_image, normalize_image, opaque_jpeg, prefetch_images
+
+ASSETS_DIR = os.path.dirname(os.path.abspath(__file__))
+LOGO_PATH = os.path.join(ASSETS_DIR, "logo_transparente.png")
+LOGO_WIDTH_MM = 45
+LOGO_DPI = 300
+FONT_FILES = {
+    '': os.path.join(ASSETS_DIR, "Lato-Regular.ttf"),
+    'B': os.path.join(ASSETS_DIR, "Lato-Bold.ttf"),
+    'I': os.path.join(ASSETS_DIR, "Lato-Italic.ttf"),
+}
+
+# Anchos de glifo por (familia, estilo, tamaño) y líneas por (texto, ancho, fuente), por proceso
+_glyph_widths = {}
+_line_counts = {}
+LINE_COUNT_CACHE_SIZE = 20000
+
+def format_currency(value):
+    try:
+        v = float(value)
+    except (TypeError, ValueError):
+        return "$0"
+    return f"${v:,.0f}".replace(",", ".")
+
+
+# --- RECURSOS COMPARTIDOS (FUENTES Y LOGO) ---
+class PdfResources:
+    """Fuentes y logo preparados una sola vez por proceso.
+
+    El logo se lee y se convierte una vez a un JPEG sobre fondo blanco, del
+    tamaño con que se imprime; fpdf2 lo incrusta en cada documento sin volver a
+    decodificarlo. Las fuentes no se pueden compartir con el API público de
+    fpdf2 (cada documento recorta la suya al escribirse): aquí solo se comprueba
+    una vez que existen y cada documento las registra con `add_font()`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.font_family = 'Arial'
+        self.logo_available = False
+        self._logo = None
+
+    def _load(self):
+        probe = FPDF()
+        try:
+            for style, path in FONT_FILES.items():
+                probe.add_font('Lato', style, path)
+            self.font_family = 'Lato'
+        except (RuntimeError, FileNotFoundError):
+            self.font_family = 'Arial'
+        self.logo_available = os.path.exists(LOGO_PATH)
+        if self.logo_available:
+            try:
+                with open(LOGO_PATH, 'rb') as f:
+                    self._logo = opaque_jpeg(f.read(), round(LOGO_WIDTH_MM / 25.4 * LOGO_DPI))
+            except (OSError, ValueError):
+                self._logo = None
+        self._loaded = True
+
+    def logo(self):
+        """Fuente del logo para `image()`: el JPEG ya preparado o, si no se pudo, el archivo."""
+        return BytesIO(self._logo) if self._logo is not None else LOGO_PATH
+
+    def ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._load()
+
+    def install(self, pdf):
+        """Registra las fuentes en `pdf`; devuelve la familia tipográfica a usar."""
+        self.ensure_loaded()
+        if self.font_family == 'Lato':
+            for style, path in FONT_FILES.items():
+                pdf.add_font('Lato', style, path)
+        return self.font_family
+
+
+_resources = PdfResources()
+
+def get_pdf_resources():
+    return _resources
+
+
+# --- CLASE PDF PERSONALIZADA ---
+class PDF(FPDF):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.color_primary = (4, 76, 125)
+        self.color_secondary = (240, 240, 240)
+        self.color_text = (50, 50, 50)
+        self.color_border = (220, 220, 220)
+        self.table_col_widths = None
+        self.is_table_page = False
+        self.current_font_family = 'Arial'
+        # Imágenes ya descargadas (url -> bytes) antes de maquetar la tabla
+        self.image_bytes = {}
+        self.blob_bytes = {}
+        self.image_dpi = PDF_IMAGE_DPI
+        # Fuentes y logo se registran una vez por documento desde la caché del proceso
+        self.resources = get_pdf_resources()
+        self.current_font_family = self.resources.install(self)
+
+    def header(self):
+        if self.resources.logo_available:
+            self.image(self.resources.logo(), 10, 8, LOGO_WIDTH_MM)
+        else:
+            self.set_font(self.current_font_family, "B", 14)
+            self.set_xy(10, 15)
+            self.cell(0, 10, "JUGANDO Y EDUCANDO")
+
+        self.set_font(self.current_font_family, "B", 9)
+        self.set_text_color(*self.color_text)
+        info_x = 120
+        self.set_xy(info_x, 10)
+        self.cell(0, 5, "DIDACTICOS JUGANDO Y EDUCANDO SAS", 0, 1, 'R')
+        self.set_font(self.current_font_family, "", 9)
+        self.set_x(info_x)
+        self.cell(0, 5, "NIT: 901144615-6", 0, 1, 'R')
+        self.set_x(info_x)
+        self.cell(0, 5, "CEL: 3153357921", 0, 1, 'R')
+        self.set_x(info_x)
+        self.cell(0, 5, "jugandoyeducando@hotmail.com", 0, 1, 'R')
+        self.set_x(info_x)
+        self.cell(0, 5, "Avenida 19 # 114A - 22, Bogota", 0, 1, 'R')
+
+        if self.is_table_page and self.table_col_widths:
+            self.set_y(40)
+            self.draw_table_header(self.table_col_widths)
+
+    def draw_quote_number(self, numero):
+        self.set_font(self.current_font_family, '', 11)
+        self.set_text_color(50, 50, 50)
+        self.set_xy(150, 55)
+        self.cell(35, 6, "Cotización N°:", 0, 0, 'R')
+
+        y_numero = self.get_y()
+        self.set_font(self.current_font_family, 'B', 12)
+        self.set_text_color(4, 76, 125)
+        self.cell(25, 6, numero, 0, 1, 'L')
+
+        self.set_draw_color(4, 76, 125)
+        self.set_line_width(0.6)
+        y_line = y_numero + 10
+        self.line(10, y_line, 200, y_line)
+        self.ln(12)
+
+    def draw_client_info(self, data):
+        self.ln(5)
+        self.set_font(self.current_font_family, "B", 11)
+        self.set_text_color(*self.color_primary)
+        self.cell(0, 8, "Información del Cliente", 0, 1, 'L')
+        self.set_font(self.current_font_family, "", 10)
+        self.set_text_color(*self.color_text)
+        y_start = self.get_y()
+        self.set_xy(10, y_start)
+        self.cell(25, 6, "Cliente:", 0, 0, 'L')
+        self.set_font(self.current_font_family, "B", 10)
+        self.multi_cell(75, 6, data.get('cliente_nombre', ''), 0, 'L')
+        self.set_font(self.current_font_family, "", 10)
+        self.set_xy(10, self.get_y())
+        self.cell(25, 6, "NIT/CC:", 0, 0, 'L')
+        self.multi_cell(75, 6, data.get('cliente_nit', ''), 0, 'L')
+        self.set_xy(10, self.get_y())
+        self.cell(25, 6, "Dirección:", 0, 0, 'L')
+        self.multi_cell(75, 6, f"{data.get('cliente_dir','')}, {data.get('cliente_ciudad','')}", 0, 'L')
+        y_left_end = self.get_y()
+        self.set_xy(110, y_start)
+        self.cell(25, 6, "Fecha:", 0, 0, 'L')
+        self.multi_cell(75, 6, data.get('fecha', ''), 0, 'L')
+        self.set_xy(110, self.get_y())
+        self.cell(25, 6, "Teléfono:", 0, 0, 'L')
+        self.multi_cell(75, 6, data.get('cliente_tel', ''), 0, 'L')
+        self.set_xy(110, self.get_y())
+        self.cell(25, 6, "Vigencia:", 0, 0, 'L')
+        self.multi_cell(75, 6, data.get('vigencia', ''), 0, 'L')
+        y_right_end = self.get_y()
+        self.set_y(max(y_left_end, y_right_end) + 5)
+
+    def get_multicell_lines(self, text, width, line_height=5):
+        """Líneas que ocupará `text` en `multi_cell(width, ...)` con la fuente de la tabla.
+
+        Si el texto cabe en una línea se decide sumando anchos de glifo cacheados;
+        si no, se usa el propio `multi_cell` en modo simulación, así el conteo
+        coincide siempre con el ajuste real. Los resultados se memorizan por
+        (texto, ancho, fuente).
+        """
+        self.set_font(self.current_font_family, "", 9)
+        text = str(text)
+        key = (text, round(width, 3), self.font_family, self.font_style, self.font_size_pt)
+        lines_count = _line_counts.get(key)
+        if lines_count is not None:
+            return lines_count
+
+        available = width - 2 * self.c_margin
+        if '\n' not in text and self.get_text_width_fast(text) <= available:
+            lines_count = 1
+        else:
+            lines = self.multi_cell(width, line_height, text, border=0, align='C',
+                                    dry_run=True, output=MethodReturnValue.LINES)
+            lines_count = max(1, len(lines))
+
+        _line_counts[key] = lines_count
+        if len(_line_counts) > LINE_COUNT_CACHE_SIZE:
+            _line_counts.pop(next(iter(_line_counts)))
+        return lines_count
+
+    def get_text_width_fast(self, text):
+        """Ancho de `text` sumando anchos de glifo cacheados por fuente y tamaño."""
+        table_key = (self.font_family, self.font_style, self.font_size_pt)
+        widths = _glyph_widths.setdefault(table_key, {})
+        total = 0.0
+        for ch in text:
+            w = widths.get(ch)
+            if w is None:
+                w = widths[ch] = self.get_string_width(ch)
+            total += w
+        return total
+
+    def draw_table_header(self, col_widths):
+        self.set_font(self.current_font_family, "B", 9)
+        self.set_fill_color(*self.color_primary)
+        self.set_text_color(255, 255, 255)
+        self.set_draw_color(*self.color_primary)
+        self.set_line_width(0.3)
+        self.cell(col_widths['img'], 8, "IMAGEN", 'T', 0, 'C', 1)
+        self.cell(col_widths['name'], 8, "PRODUCTO", 'T', 0, 'C', 1)
+        self.cell(col_widths['sku'], 8, "CÓDIGO", 'T', 0, 'C', 1)
+        self.cell(col_widths['qty'], 8, "UNDS.", 'T', 0, 'C', 1)
+        self.cell(col_widths['price'], 8, "VLR. UNITARIO", 'T', 0, 'C', 1)
+        self.cell(col_widths['total'], 8, "VALOR TOTAL", 'T', 1, 'C', 1)
+
+    def ensure_row_fits(self, row_height):
+        if self.get_y() + row_height > self.page_break_trigger:
+            self.add_page()
+            if self.is_table_page and self.table_col_widths:
+                self.set_y(40)
+                self.draw_table_header(self.table_col_widths)
+
+    def get_row_image(self, item, width, height):
+        """Imagen del producto ya reducida al tamaño de la celda (en mm), o None."""
+        image_bytes = None
+        if item.get('imagen_hash'):
+            image_bytes = self.blob_bytes.get(item['imagen_hash'])
+        elif item.get('imagen_base64'):
+            image_bytes = base64.b64decode(item['imagen_base64'])
+        elif is_remote_image(item.get('imagen_url')):
+            image_bytes = self.image_bytes.get(item['imagen_url'])
+        if not image_bytes:
+            return None
+        return BytesIO(normalize_image(image_bytes, width, height, dpi=self.image_dpi))
+
+    def draw_table_row(self, item, col_widths, fill=False):
+        line_height = 5
+        num_lines = self.get_multicell_lines(item.get('nombre', ''), col_widths['name'], line_height)
+        name_height = num_lines * line_height
+        row_height = max(30, name_height + 4)
+
+        self.ensure_row_fits(row_height)
+
+        x_start = self.get_x()
+        y_start = self.get_y()
+
+        self.set_font(self.current_font_family, "", 9)
+        self.set_text_color(*self.color_text)
+        self.set_draw_color(*self.color_border)
+        self.set_fill_color(*self.color_secondary)
+
+        self.cell(col_widths['img'], row_height, "", 'B', 0, 'C', fill)
+        self.cell(col_widths['name'], row_height, "", 'B', 0, 'C', fill)
+        self.cell(col_widths['sku'], row_height, "", 'B', 0, 'C', fill)
+        self.cell(col_widths['qty'], row_height, "", 'B', 0, 'C', fill)
+        self.cell(col_widths['price'], row_height, "", 'B', 0, 'R', fill)
+        self.cell(col_widths['total'], row_height, "", 'B', 1, 'R', fill)
+
+        # Imagen
+        try:
+            image_source = self.get_row_image(item, col_widths['img'] - 4, row_height - 4)
+            
+            if image_source:
+                # Ajuste de imagen para mantener proporción
+                self.image(image_source, x=x_start + 2, y=y_start + 2, w=col_widths['img'] - 4, h=row_height - 4)
+            else:
+                raise Exception("No image")
+        except Exception:
+            v_offset_placeholder = (row_height - 4) / 2
+            self.set_xy(x_start, y_start + v_offset_placeholder)
+            self.cell(col_widths['img'], 4, "S/I", 0, 0, 'C')
+
+        # Nombre
+        name_v_offset = (row_height - name_height) / 2
+        self.set_xy(x_start + col_widths['img'], y_start + name_v_offset)
+        self.multi_cell(col_widths['name'], line_height, str(item.get('nombre', '')), border=0, align='C')
+
+        text_height = self.font_size
+        cell_v_offset = (row_height - text_height) / 2
+        
+        # SKU
+        self.set_xy(x_start + col_widths['img'] + col_widths['name'], y_start + cell_v_offset)
+        self.cell(col_widths['sku'], text_height, str(item.get('sku', '')), 0, 0, 'C')
+        
+        # Cantidad
+        self.set_x(x_start + col_widths['img'] + col_widths['name'] + col_widths['sku'])
+        self.cell(col_widths['qty'], text_height, str(item.get('cantidad', '')), 0, 0, 'C')
+        
+        # Precio
+        self.set_x(x_start + col_widths['img'] + col_widths['name'] + col_widths['sku'] + col_widths['qty'])
+        self.cell(col_widths['price'], text_height, format_currency(item.get('precio_unitario', 0)), 0, 0, 'R')
+        
+        # Total
+        self.set_x(x_start + col_widths['img'] + col_widths['name'] + col_widths['sku'] + col_widths['qty'] + col_widths['price'])
+        self.cell(col_widths['total'], text_height, format_currency(item.get('valor_total', 0)), 0, 0, 'R')
+
+        self.set_y(y_start + row_height)
+
+    def footer(self):
+        self.set_y(-15)
+        self.set_font(self.current_font_family, "I", 8)
+        self.set_text_color(150, 150, 150)
+        self.cell(0, 10, f"Página {self.page_no()}", 0, 0, 'C')
+
+def generate_pdf_content(quote_data, blob_store=None):
+    """PDF de la cotización. Las imágenes subidas (`imagen_hash`) salen de `quote_data['blobs']`
+    o, si no están ahí, del almacén `blob_store`."""
+    with metricas.span('pdf', items=len(quote_data['items'])) as tramo:
+        pdf = _layout_quote(quote_data, blob_store)
+        content = bytes(pdf.output())
+        tramo.set(paginas=pdf.page_no(), bytes=len(content))
+    metricas.observe('pdf_bytes', len(content), buckets=metricas.BYTES_BUCKETS)
+    return content
+
+def _layout_quote(quote_data, blob_store=None):
+    pdf = PDF('P', 'mm', 'A4')
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.add_page()
+    
+    pdf.set_font(pdf.current_font_family, "B", 22)
+    pdf.set_text_color(*pdf.color_primary)
+    pdf.set_y(45)
+    pdf.cell(130, 10, "COTIZACIÓN", 0, 0, 'L')
+    pdf.draw_quote_number(quote_data.get("numero_cotizacion", "S/N"))
+    pdf.draw_client_info(quote_data)
+    
+    col_widths = {'img': 30, 'name': 70, 'sku': 20, 'qty': 15, 'price': 25, 'total': 30}
+    
+    # Descargar en paralelo (o leer de la caché) todas las imágenes antes de maquetar
+    pdf.image_bytes = prefetch_images(item.get('imagen_url') for item in quote_data['items'].values())
+    pdf.blob_bytes = dict(quote_data.get('blobs') or {})
+    missing_blobs = [
+        item['imagen_hash'] for item in quote_data['items'].values()
+        if item.get('imagen_hash') and item['imagen_hash'] not in pdf.blob_bytes
+    ]
+    if missing_blobs and blob_store is not None:
+        pdf.blob_bytes.update(blob_store.get_many(missing_blobs))
+
+    pdf.is_table_page = True
+    pdf.table_col_widths = col_widths
+    pdf.draw_table_header(col_widths)
+    
+    fill = True
+    for item in quote_data['items'].values():
+        pdf.draw_table_row(item, col_widths, fill)
+        fill = not fill
+    
+    pdf.is_table_page = False
+
+    needed = 55
+    if pdf.get_y() + needed > pdf.page_break_trigger:
+        pdf.add_page()
+
+    total_label_x = 100
+    totals_y_start = pdf.get_y() + 5 
+    pdf.set_font(pdf.current_font_family, "", 10)
+    pdf.set_text_color(*pdf.color_text)
+    pdf.set_xy(total_label_x, totals_y_start)
+    pdf.cell(70, 8, "SUBTOTAL", 0, 0, 'R')
+    pdf.set_font(pdf.current_font_family, "B", 10)
+    pdf.cell(30, 8, format_currency(quote_data['subtotal']), 0, 1, 'R')
+
+    pdf.set_font(pdf.current_font_family, "", 10)
+    pdf.set_x(total_label_x)
+    flete_label = "FLETE (INCLUIDO)" if str(quote_data.get('flete_str','')).upper() == 'INCLUIDO' else "FLETE"
+    pdf.cell(70, 8, flete_label, 0, 0, 'R')
+    pdf.set_font(pdf.current_font_family, "B", 10)
+    pdf.cell(30, 8, format_currency(quote_data.get('flete_val', 0)), 0, 1, 'R')
+
+    pdf.set_font(pdf.current_font_family, "", 10)
+    pdf.set_x(total_label_x)
+    pdf.cell(70, 8, "TOTAL UNIDADES", 0, 0, 'R')
+    pdf.set_font(pdf.current_font_family, "B", 10)
+    pdf.cell(30, 8, str(quote_data['total_unidades']), 0, 1, 'R')
+    pdf.set_x(total_label_x)
+    pdf.set_draw_color(*pdf.color_border)
+    pdf.line(total_label_x + 5, pdf.get_y(), 200, pdf.get_y())
+    pdf.ln(2)
+    pdf.set_font(pdf.current_font_family, "B", 11)
+    pdf.set_text_color(*pdf.color_primary)
+    pdf.set_x(total_label_x)
+    pdf.cell(70, 10, "TOTAL COTIZACION INCLUIDO IVA", 0, 0, 'R')
+    pdf.set_font(pdf.current_font_family, "B", 12)
+    pdf.cell(30, 10, format_currency(quote_data['total_cotizacion']), 0, 1, 'R')
+    return pdf
+
+# --- EXPORTACIÓN EN LOTE ---
+def build_pdf_payload(quote_data, blob_store=None):
+    """Datos para `generate_pdf_content` a partir de una cotización guardada en Firestore.
+
+    Con `blob_store` las imágenes subidas viajan en el payload (`blobs`), así los
+    procesos del pool no necesitan acceso al almacén.
+    """
+    items = quote_data.get('items', {}) or {}
+    hashes = [item['imagen_hash'] for item in items.values() if item.get('imagen_hash')]
+    subtotal = sum(item.get('valor_total', 0) for item in items.values())
+    flete_val = int(quote_data.get('flete_val', 0) or 0)
+    return {
+        'fecha': quote_data.get('fecha', ''),
+        'numero_cotizacion': quote_data.get('numero_cotizacion') or "N/A",
+        'cliente_nombre': quote_data.get('cliente_nombre', ''),
+        'cliente_nit': quote_data.get('cliente_nit', ''),
+        'cliente_ciudad': quote_data.get('cliente_ciudad', ''),
+        'cliente_tel': quote_data.get('cliente_tel', ''),
+        'cliente_email': quote_data.get('cliente_email', ''),
+        'cliente_dir': quote_data.get('cliente_dir', ''),
+        'forma_pago': quote_data.get('forma_pago', ''),
+        'vigencia': quote_data.get('vigencia', ''),
+        'items': items,
+        'subtotal': subtotal,
+        'flete_str': "MANUAL",
+        'flete_val': flete_val,
+        'total_unidades': sum(item.get('cantidad', 0) for item in items.values()),
+        'total_cotizacion': subtotal + flete_val,
+        'blobs': blob_store.get_many(hashes) if blob_store is not None and hashes else {}
+    }
+
+def pdf_file_name(quote_data):
+    cliente = quote_data.get('cliente_nombre')
+    file_name_cliente = cliente.replace(' ', '_') if cliente else 'General'
+    file_name_cot = quote_data.get('numero_cotizacion') or "NUEVA"
+    return f"Cotizacion_{file_name_cot}_{file_name_cliente}.pdf"
+
+def render_quote_pdf(job):
+    """Trabajo de un proceso del pool: (id, payload) -> (id, bytes del PDF)."""
+    quote_id, payload = job
+    return quote_id, generate_pdf_content(payload)
+
+@contextmanager
+def _detached_main():
+    """Oculta el script principal mientras se lanzan procesos hijos.
+
+    Bajo Streamlit el `__main__` del proceso es el script de la app, y cada hijo de
+    "spawn" lo volvería a ejecutar entero antes de recibir su primer trabajo.
+    """
+    main_module = sys.modules['__main__']
+    sys.modules['__main__'] = types.ModuleType('__main__')
+    try:
+        yield
+    finally:
+        sys.modules['__main__'] = main_module
+
+def _start_pool(max_workers):
+    """Pool de procesos con todos sus procesos ya lanzados.
+
+    `sys.modules['__main__']` es de todo el proceso, así que se oculta solo
+    mientras arrancan los hijos y no durante toda la exportación. El pool lanza
+    un proceso por cada trabajo enviado sin otro libre; una tarea vacía por
+    proceso, enviadas seguidas, los lanza todos aquí (`start()` copia el
+    `__main__` de forma síncrona y ninguno termina su tarea antes del bucle).
+    """
+    # "spawn" evita heredar los hilos del servidor de Streamlit en los procesos hijos
+    executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+    with _detached_main():
+        for _ in range(max_workers):
+            executor.submit(os.getpid)
+    return executor
+
+def export_quotes_zip(jobs, fileobj, max_workers=None, on_progress=None, total=None):
+    """Renderiza cotizaciones en un pool de procesos y las escribe una a una en un ZIP.
+
+    `jobs` es un iterable de (id, payload) que se consume a medida que hay lugar
+    en el pool (puede ser un generador que lee las cotizaciones por tandas);
+    `total` es cuántos trae, para el progreso. Cada PDF se agrega al ZIP apenas
+    termina y se descarta; como mucho hay `2 * max_workers` trabajos en vuelo,
+    así la memoria no crece con el lote. Un fallo en una cotización no detiene
+    las demás: se devuelve {id: mensaje de error} y se deja un ERRORES.txt
+    dentro del ZIP.
+    """
+    max_workers = max_workers or min(os.cpu_count() or 1, 4)
+    total = total if total is not None else len(jobs)
+    names = {}
+    errors = {}
+    done_count = 0
+    pending_jobs = iter(jobs)
+    with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        used_names = set()
+        written = set()
+        try:
+            with _start_pool(max_workers) as executor:
+                in_flight = {}
+
+                def submit_next():
+                    job = next(pending_jobs, None)
+                    if job is not None:
+                        names[job[0]] = pdf_file_name(job[1])
+                        in_flight[executor.submit(render_quote_pdf, job)] = job[0]
+
+                for _ in range(2 * max_workers):
+                    submit_next()
+                while in_flight:
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        quote_id = in_flight.pop(future)
+                        try:
+                            _, pdf_bytes = future.result()
+                            name = names[quote_id]
+                            if name in used_names:
+                                name = name.replace('.pdf', f"_{quote_id}.pdf")
+                            used_names.add(name)
+                            archive.writestr(name, pdf_bytes)
+                            written.add(quote_id)
+                        except BrokenProcessPool:
+                            raise
+                        except Exception as e:
+                            errors[quote_id] = f"{type(e).__name__}: {e}"
+                        done_count += 1
+                        if on_progress:
+                            on_progress(done_count, total)
+                        submit_next()
+        except BrokenProcessPool as e:
+            for quote_id, _ in pending_jobs:
+                names.setdefault(quote_id, quote_id)
+            for quote_id in names:
+                if quote_id not in written:
+                    errors.setdefault(quote_id, f"Proceso de generación interrumpido: {e}")
+        if errors:
+            report = "\n".join(f"{names.get(quote_id, quote_id)}: {message}" for quote_id, message in errors.items())
+            archive.writestr("ERRORES.txt", report)
+    return errors
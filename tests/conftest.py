@@ -0,0 +1,6 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Los módulos de la app están en la raíz; el Firestore en memoria, en benchmarks/
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks')]
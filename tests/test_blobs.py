@@ -0,0 +1,40 @@
+import base64
+
+from fake_firestore import FakeFirestore
+
+from blobs import CachedBlobStore, FirestoreBlobStore, LocalBlobStore, blob_key
+from cache import CacheNamespace
+from imagenes import ImageCache
+from cotizaciones_db import COLLECTION, failed_writes, migrate_inline_images
+
+IMAGE = b'\x89PNG imagen de prueba'
+
+
+def test_migration_skips_quotes_without_items(tmp_path):
+    db = FakeFirestore()
+    quotes = db.collection(COLLECTION)
+    quotes.document('OV-1').set({'tienda': 'Oviedo', 'numero_cotizacion': 'OV-1'})
+    quotes.document('OV-2').set({'tienda': 'Oviedo', 'items': {
+        'manual_1': {'nombre': "Producto", 'imagen_base64': base64.b64encode(IMAGE).decode()}
+    }})
+    store = LocalBlobStore(str(tmp_path), durable=True)
+
+    results = migrate_inline_images(db, store, 'Oviedo')
+
+    assert list(results) == ['OV-2'] and failed_writes(results) == {}
+    assert quotes.document('OV-2').get().get('items') == {'manual_1': {'nombre': "Producto", 'imagen_hash': blob_key(IMAGE)}}
+    assert store.get(blob_key(IMAGE)) == IMAGE
+    assert 'items' not in quotes.document('OV-1').get().to_dict()
+
+
+def test_cached_store_keeps_bytes_in_the_given_cache_namespace(tmp_path):
+    db = FakeFirestore()
+    key = FirestoreBlobStore(db).put(IMAGE)
+    memory = CacheNamespace('imagenes', max_entries=4)
+    store = CachedBlobStore(FirestoreBlobStore(db), cache=ImageCache(str(tmp_path)), memory=memory)
+
+    assert store.get(key) == IMAGE
+    reads = db.stats['reads']
+    assert store.get_many([key]) == {key: IMAGE}
+    assert db.stats['reads'] == reads
+    assert len(memory) == 1 and memory.stats()['aciertos'] == 1
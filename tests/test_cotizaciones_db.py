@@ -0,0 +1,99 @@
+from datetime import datetime, timezone
+
+from fake_firestore import FakeFirestore, FakeWriteBatch
+from google.api_core import exceptions as gexc
+
+import cotizaciones_db
+from cotizaciones_db import (COLLECTION, MAX_PREFIX, QuoteSummaryStore, client_search_term, commit_writes,
+                             failed_writes, fetch_tracking_page, quote_summary)
+
+
+def add_quote(db, quote_id, cliente_nombre, tienda='Oviedo'):
+    data = {'tienda': tienda, 'numero_cotizacion': quote_id, 'cliente_nombre': cliente_nombre, 'items': {},
+            'creado_en': datetime(2025, 1, 1, tzinfo=timezone.utc)}
+    data.update(quote_summary(data))
+    db.collection(COLLECTION).document(quote_id).set(data)
+
+
+def test_client_search_term_cut_at_a_space_is_stripped():
+    term = client_search_term("Colegio Santa Maria del Rosario")
+    assert len("colegio santa maria ") == MAX_PREFIX
+    assert term == "colegio santa maria"
+
+
+def test_search_by_full_long_client_name_finds_it():
+    db = FakeFirestore()
+    add_quote(db, 'OV-1', "Colegio Santa Maria del Rosario")
+    add_quote(db, 'OV-2', "Colegio San Jose")
+
+    rows, _ = fetch_tracking_page(db, 'Oviedo', cliente="Colegio Santa Maria del Rosario")
+    assert [row['id'] for row in rows] == ['OV-1']
+
+    store = QuoteSummaryStore(db, 'Oviedo').start()
+    try:
+        assert store.wait_ready()
+        rows, _ = store.page(cliente="Colegio Santa Maria del Rosario")
+        assert [row['id'] for row in rows] == ['OV-1']
+    finally:
+        store.close()
+
+
+class CommitThenTimeoutBatch(FakeWriteBatch):
+    def commit(self):
+        results = super().commit()
+        if self._client.timeouts_after_commit:
+            self._client.timeouts_after_commit -= 1
+            raise gexc.DeadlineExceeded("se aplicó, pero la respuesta no llegó")
+        return results
+
+
+class TimeoutAfterCommitFirestore(FakeFirestore):
+    """Los siguientes `timeouts_after_commit` commits se aplican y aun así fallan con un error ambiguo."""
+
+    timeouts_after_commit = 0
+
+    def batch(self):
+        return CommitThenTimeoutBatch(self)
+
+
+def test_batch_applied_before_an_ambiguous_error_is_not_applied_again(monkeypatch):
+    monkeypatch.setattr(cotizaciones_db.time_module, 'sleep', lambda seconds: None)
+    db = TimeoutAfterCommitFirestore()
+    add_quote(db, 'OV-1', "Cliente")
+    db.timeouts_after_commit = 1
+    version = db.collection(COLLECTION).document('OV-1').get().update_time
+    delta = {('analitica', 'oviedo_2025-01'): {'total': 100, 'cotizaciones': 1}}
+    update_times = {}
+
+    results = commit_writes(db, [
+        ('create', 'OV-2', {'tienda': 'Oviedo'}, None, delta),
+        ('update', 'OV-1', {'estado': "✉️ Enviada"}, version),
+    ], update_times=update_times)
+
+    assert failed_writes(results) == {}
+    assert db.collection('analitica').document('oviedo_2025-01').get().to_dict() == {'total': 100, 'cotizaciones': 1}
+    saved = db.collection(COLLECTION).document('OV-1').get()
+    assert saved.get('estado') == "✉️ Enviada"
+    assert update_times['OV-1'] == saved.update_time
+    assert update_times['OV-2'] == db.collection(COLLECTION).document('OV-2').get().update_time
+
+
+def test_batch_rejected_by_an_ambiguous_error_is_sent_again(monkeypatch):
+    monkeypatch.setattr(cotizaciones_db.time_module, 'sleep', lambda seconds: None)
+    db = FakeFirestore()
+    calls = []
+    original_rpc = db._rpc
+
+    def unavailable_once(commit=False):
+        if commit and not calls:
+            calls.append(commit)
+            raise gexc.ServiceUnavailable("sin servicio")
+        original_rpc(commit)
+
+    monkeypatch.setattr(db, '_rpc', unavailable_once)
+    delta = {('analitica', 'oviedo_2025-01'): {'total': 100}}
+
+    results = commit_writes(db, [('create', 'OV-1', {'tienda': 'Oviedo'}, None, delta)])
+
+    assert failed_writes(results) == {}
+    assert db.collection('analitica').document('oviedo_2025-01').get().to_dict() == {'total': 100}
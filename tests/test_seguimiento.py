@@ -0,0 +1,86 @@
+import os
+import time
+from datetime import datetime, timezone
+
+import firebase_admin
+import pytest
+import streamlit as st
+from fake_firestore import FakeFirestore
+from firebase_admin import firestore
+from streamlit.testing.v1 import AppTest
+
+from cache import get_cache
+from cotizaciones_db import COLLECTION, quote_summary
+from conftest import ROOT
+
+SAVE = "💾 Guardar Cambios de Seguimiento"
+
+
+def add_quote(db, quote_id, day):
+    data = {'tienda': 'Oviedo', 'numero_cotizacion': quote_id, 'cliente_nombre': f"Cliente {quote_id}",
+            'estado': "🔵 Creada", 'comentarios': "", 'fecha': f"{day:02d}/01/2025", 'items': {},
+            'creado_en': datetime(2025, 1, day, tzinfo=timezone.utc)}
+    data.update(quote_summary(data))
+    db.collection(COLLECTION).document(quote_id).set(data)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakeFirestore(listener_delay=0.0)
+    monkeypatch.setitem(firebase_admin._apps, '[DEFAULT]', object())
+    monkeypatch.setattr(firestore, 'client', lambda *args, **kwargs: db)
+    st.cache_resource.clear()
+    get_cache().invalidate()
+    yield db
+    st.cache_resource.clear()
+
+
+def rendered_app(db):
+    at = AppTest.from_file(os.path.join(ROOT, 'app_cotizaciones.py'), default_timeout=60)
+    at.secrets['firebase_secrets'] = {'private_key': 'x'}
+    at.run()
+    assert not at.exception
+    return at
+
+
+def save_first_row(at, changes):
+    # El editor manda sus cambios por posición de fila, como el navegador
+    at.session_state[at.session_state.tracking_table['editor']] = {
+        'edited_rows': {0: changes}, 'deleted_rows': [], 'added_rows': []
+    }
+    next(button for button in at.button if button.label == SAVE).click().run()
+    assert not at.exception
+
+
+def stored(db, quote_id):
+    return db.collection(COLLECTION).document(quote_id).get().to_dict()
+
+
+def test_edit_saves_the_rendered_row_after_a_new_quote_moves_the_rows(db):
+    add_quote(db, 'OV-1', 1)
+    add_quote(db, 'OV-2', 2)
+    at = rendered_app(db)
+    assert list(at.session_state.tracking_table['filas']['id']) == ['OV-2', 'OV-1']
+
+    # Otra persona crea una cotización más reciente: en una lectura nueva sería la primera fila
+    add_quote(db, 'OV-3', 3)
+    time.sleep(0.2)
+    save_first_row(at, {'Estado': "✉️ Enviada"})
+
+    assert stored(db, 'OV-2')['estado'] == "✉️ Enviada"
+    assert stored(db, 'OV-3')['estado'] == "🔵 Creada"
+    assert not any("No se pudieron guardar" in error.value for error in at.error)
+
+
+def test_edit_of_a_row_changed_after_rendering_is_rejected(db):
+    add_quote(db, 'OV-1', 1)
+    add_quote(db, 'OV-2', 2)
+    at = rendered_app(db)
+
+    db.collection(COLLECTION).document('OV-2').update({'comentarios': "Llamar el lunes"})
+    time.sleep(0.2)
+    save_first_row(at, {'Estado': "✉️ Enviada"})
+
+    assert stored(db, 'OV-2')['estado'] == "🔵 Creada"
+    assert stored(db, 'OV-2')['comentarios'] == "Llamar el lunes"
+    assert "No se pudieron guardar 1 cotizaciones; las demás se guardaron." in [error.value for error in at.error]